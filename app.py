@@ -1,152 +1,256 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
-import sqlite3
+from flask import Blueprint, Flask, Response, current_app, render_template, stream_template, request, redirect, url_for, session, flash, get_flashed_messages, jsonify
 from datetime import datetime
 import os
+import io
+import json
+import math
+import time
+import click
+from werkzeug.routing import IntegerConverter
+from models import allocator, archive, billing, bulk, counters, eventlog, fleet, migrations, pool, pricing, rollups, search, shards
+from models.allocator import spot_allocator
+from models.eventlog import EventLogGap, event_log
+from models.provisioning import build_layout
+from models.pricing import price_table, pricing_engine
+from models.database import DatabaseManager, ParkingLot, ParkingSpot, Reservation, User
+from models.schedule import schedule_index
+from models.shards import shard_map
+from models import schedule
+from services.admission import AdmissionRejected, booking_admission
+from services.cache import api_cache
+from services.events import format_event, spot_events
+from services import admission, hashing, metrics
+from services.hashing import HashingBusy, password_hasher
+from services.startup import startup
 
-app = Flask(__name__)
-app.secret_key = 'parking_app_secret_key_2024'
+# Every route and command lives on this blueprint, so create_app() can hand
+# out independent apps. Commands are registered at the top level of the CLI.
+bp = Blueprint('parking', __name__, cli_group=None)
 
-DATABASE = 'parking_app.db'
+def env_flag(value):
+    return value == '1'
+
+# SQLite integers are signed 64-bit, so a larger number in a URL, form or
+# JSON body cannot name a row. Such ids are treated like any other id that
+# does not exist rather than failing the query.
+SQLITE_MAX_INT = (1 << 63) - 1
+
+class SqliteIntConverter(IntegerConverter):
+    def __init__(self, map, *args, **kwargs):
+        kwargs.setdefault('max', SQLITE_MAX_INT)
+        super().__init__(map, *args, **kwargs)
+
+def sqlite_int(value):
+    value = int(value)
+    if abs(value) > SQLITE_MAX_INT:
+        raise ValueError(f'{value} is out of range')
+    return value
+
+def is_sqlite_int(value):
+    return isinstance(value, int) and abs(value) <= SQLITE_MAX_INT
+
+# Every setting with the parser for its environment variable and its
+# default. Values come from these defaults, then a settings file named by
+# PARKING_SETTINGS, then the environment, then create_app(config).
+SETTINGS = {
+    'SECRET_KEY': (str, 'parking_app_secret_key_2024'),
+    'DATABASE': (str, 'parking_app.db'),
+    'DATABASE_SHARDS': (int, 1),
+    'DATABASE_POOL_SIZE': (int, pool.DEFAULT_POOL_SIZE),
+    'DATABASE_BUSY_TIMEOUT': (int, pool.DEFAULT_BUSY_TIMEOUT),
+    'DATABASE_SYNCHRONOUS': (str, pool.DEFAULT_SYNCHRONOUS),
+    'DATABASE_CACHE_SIZE': (int, pool.DEFAULT_CACHE_SIZE),
+    'DATABASE_CACHED_STATEMENTS': (int, pool.DEFAULT_CACHED_STATEMENTS),
+    'ARCHIVE_DATABASE': (str, 'parking_archive.db'),
+    'ARCHIVE_AFTER_DAYS': (int, 90),
+    'PAGE_SIZE': (int, 200),
+    'SEARCH_LIMIT': (int, 50),
+    'SCHEDULE_HORIZON_DAYS': (int, schedule.DEFAULT_HORIZON_DAYS),
+    'SCHEDULE_HOLD_MINUTES': (int, schedule.DEFAULT_HOLD_MINUTES),
+    'PRICING_INTERVAL': (int, pricing.DEFAULT_INTERVAL),
+    'PRICING_WINDOW_DAYS': (int, pricing.DEFAULT_WINDOW_DAYS),
+    'PRICING_BANDS': (str, pricing.DEFAULT_BANDS),
+    'BULK_CHUNK_SIZE': (int, 5000),
+    'API_CACHE_TTL': (float, 5),
+    'STREAM_POLL_SECONDS': (float, 5),
+    'METRICS_ENABLED': (env_flag, True),
+    'SLOW_QUERY_MS': (float, 100),
+    'BOOKING_RATE': (float, admission.DEFAULT_RATE),
+    'BOOKING_BURST': (int, admission.DEFAULT_BURST),
+    'BOOKING_QUEUE_DEPTH': (int, admission.DEFAULT_QUEUE_DEPTH),
+    'BOOKING_QUEUE_TIMEOUT': (float, admission.DEFAULT_QUEUE_TIMEOUT),
+    'BOOKING_FULL_TTL': (float, allocator.DEFAULT_FULL_TTL),
+    'PASSWORD_HASH_METHOD': (str, hashing.DEFAULT_METHOD),
+    'PASSWORD_HASH_WORKERS': (int, os.cpu_count() or 1),
+    'PASSWORD_HASH_MAX_PENDING': (int, 64),
+    'PASSWORD_VERIFY_CACHE_TTL': (float, 300),
+    'WARMUP_ENABLED': (env_flag, True),
+    'EVENT_LOG_ENABLED': (env_flag, True),
+    'EVENT_LOG_SEGMENT_BYTES': (int, eventlog.DEFAULT_SEGMENT_BYTES),
+    'EVENT_LOG_FSYNC': (env_flag, False),
+    'EVENT_LOG_CHECKPOINT_EVENTS': (int, eventlog.DEFAULT_CHECKPOINT_EVENTS),
+}
+
+def load_config(app, config=None):
+    for name, (_, default) in SETTINGS.items():
+        app.config[name] = default
+    app.config.from_envvar('PARKING_SETTINGS', silent=True)
+    for name, (parse, _) in SETTINGS.items():
+        if name in os.environ:
+            app.config[name] = parse(os.environ[name])
+    if isinstance(config, str):
+        app.config.from_pyfile(config)
+    elif config:
+        app.config.update(config)
+
+def create_app(config=None):
+    # Builds a new app and wires the shared services up from its
+    # configuration without touching the database. The first request
+    # brings the schema up to date; see startup below.
+    app = Flask(__name__)
+    load_config(app, config)
+    pool.init_app(app)
+    shards.init_app(app)
+    eventlog.init_app(app)
+    pricing.init_app(app)
+    hashing.init_app(app)
+    admission.init_app(app)
+    if app.config['METRICS_ENABLED']:
+        metrics.init_app(app)
+    else:
+        # An earlier app may have left its observers on the shared pool
+        # and admission queue.
+        pool.set_statement_observer(None)
+        booking_admission.observer = None
+    # Lot ids repeat across databases, so nothing cached for an earlier
+    # app's database may carry over to this one.
+    spot_allocator.clear()
+    price_table.clear()
+    api_cache.clear()
+    api_cache.ttl = app.config['API_CACHE_TTL']
+    schedule_index.configure(app.config['SCHEDULE_HORIZON_DAYS'], app.config['SCHEDULE_HOLD_MINUTES'])
+    startup.init_app(app)
+    app.url_map.converters['int'] = SqliteIntConverter
+    app.register_blueprint(bp)
+    return app
 
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return pool.get_connection(current_app.config['DATABASE'])
+
+def stream_page(template, **context):
+    # Flashes live in the session cookie, which is sent before the body
+    # streams, so consume them now; the template then reads the cached copy.
+    get_flashed_messages()
+    return stream_template(template, **context)
 
 def init_database():
-    conn = get_db_connection()
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            email TEXT,
-            phone TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS parking_lots (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            prime_location_name TEXT NOT NULL,
-            price REAL NOT NULL,
-            address TEXT NOT NULL,
-            pin_code TEXT NOT NULL,
-            maximum_number_of_spots INTEGER NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS parking_spots (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            lot_id INTEGER NOT NULL,
-            status TEXT DEFAULT 'A',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (lot_id) REFERENCES parking_lots (id)
-        )
-    ''')
-    
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS reservations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            spot_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            parking_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            leaving_timestamp TIMESTAMP,
-            parking_cost REAL,
-            status TEXT DEFAULT 'active',
-            FOREIGN KEY (spot_id) REFERENCES parking_spots (id),
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    admin_exists = conn.execute('SELECT COUNT(*) FROM users WHERE username = ?', ('admin',)).fetchone()[0]
-    if admin_exists == 0:
-        admin_password = generate_password_hash('admin123')
-        conn.execute('INSERT INTO users (username, password, email) VALUES (?, ?, ?)',
-                    ('admin', admin_password, 'admin@parking.com'))
-    
-    conn.commit()
-    conn.close()
+    DatabaseManager.init_database()
 
-@app.route('/')
+startup.bootstrap = init_database
+
+@startup.warmup
+def start_pricing():
+    pricing_engine.start()
+
+@startup.warmup
+def warm_booking_state():
+    # Free spot lists and schedule holds for every lot, so the first
+    # bookings do not each pay for loading their lot.
+    if not current_app.config['WARMUP_ENABLED']:
+        return
+    conns = [shard_map.connection(shard) for shard in shard_map.shards]
+    for shard, conn in enumerate(conns):
+        # A checkpoint plus the log after it, when there is one, is
+        # much cheaper than scanning every spot.
+        state = event_log.recover(conn, shard) if event_log.enabled else None
+        if state is None:
+            spot_allocator.load(conn)
+        else:
+            spot_allocator.seed(state.free_spots())
+    for conn in conns:
+        for (lot_id,) in conn.execute('SELECT id FROM parking_lots'):
+            schedule_index.walk_in_capacity(conn, lot_id)
+
+@bp.route('/')
 def home():
     return render_template('index.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
         
-        conn = get_db_connection()
-        user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-        conn.close()
+        user = User.get_by_username(username)
         
-        if user and check_password_hash(user['password'], password):
-            session['user_id'] = user['id']
-            session['username'] = user['username']
-            session['is_admin'] = user['username'] == 'admin'
+        try:
+            valid = user is not None and password_hasher.verify(user.username, user.password, password)
+            if valid and password_hasher.needs_rehash(user.password):
+                User.update_password(user.id, password_hasher.hash(password))
+        except HashingBusy:
+            flash('Too many sign-ins right now. Please try again in a moment.')
+            return render_template('login.html'), 503, {'Retry-After': '2'}
+        
+        if valid:
+            session['user_id'] = user.id
+            session['username'] = user.username
+            session['is_admin'] = user.username == 'admin'
             if session['is_admin']:
-                return redirect(url_for('admin_dashboard'))
+                return redirect(url_for('.admin_dashboard'))
             else:
-                return redirect(url_for('user_dashboard'))
+                return redirect(url_for('.user_dashboard'))
         else:
             flash('Invalid username or password')
     
     return render_template('login.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
         email = request.form['email']
         phone = request.form['phone']
-        conn = get_db_connection()
-        existing_user = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
-        if existing_user:
+        if User.username_exists(username):
             flash('Username already exists')
         else:
-            hashed_password = generate_password_hash(password)
-            conn.execute('INSERT INTO users (username, password, email, phone) VALUES (?, ?, ?, ?)',
-                        (username, hashed_password, email, phone))
-            conn.commit()
+            try:
+                hashed_password = password_hasher.hash(password)
+            except HashingBusy:
+                flash('Too many registrations right now. Please try again in a moment.')
+                return render_template('register.html'), 503, {'Retry-After': '2'}
+            User.create_user(username, hashed_password, email, phone)
             flash('Registration successful! Please login.')
-            conn.close()
-            return redirect(url_for('login'))
-        
-        conn.close()
+            return redirect(url_for('.login'))
     return render_template('register.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.clear()
-    return redirect(url_for('home'))
+    return redirect(url_for('.home'))
 
-@app.route('/admin/dashboard')
+@bp.route('/admin/dashboard')
 def admin_dashboard():
     if not session.get('is_admin'):
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     
-    conn = get_db_connection()
-    lots = conn.execute('SELECT * FROM parking_lots').fetchall()
-    total_spots = conn.execute('SELECT COUNT(*) as count FROM parking_spots').fetchone()['count']
-    occupied_spots = conn.execute('SELECT COUNT(*) as count FROM parking_spots WHERE status = "O"').fetchone()['count']
-    total_users = conn.execute('SELECT COUNT(*) as count FROM users WHERE username != "admin"').fetchone()['count']
-    conn.close()
-    return render_template('admin_dashboard.html', 
-                         lots=lots, 
-                         total_spots=total_spots, 
-                         occupied_spots=occupied_spots,
-                         total_users=total_users)
-
-@app.route('/admin/create_lot', methods=['GET', 'POST'])
+    after = request.args.get('after', 0, type=sqlite_int)
+    page_size = current_app.config['PAGE_SIZE']
+    lots = ParkingLot.get_all_lots(after, page_size)
+    total_lots, total_spots, occupied_spots, total_users = ParkingLot.get_totals()
+    return stream_page('admin_dashboard.html', 
+                       lots=lots, 
+                       total_lots=total_lots,
+                       total_spots=total_spots, 
+                       occupied_spots=occupied_spots,
+                       total_users=total_users,
+                       after=after,
+                       page_size=page_size)
+
+@bp.route('/admin/create_lot', methods=['GET', 'POST'])
 def create_lot():
     if not session.get('is_admin'):
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     
     if request.method == 'POST':
         name = request.form['name']
@@ -154,27 +258,29 @@ def create_lot():
         address = request.form['address']
         pin_code = request.form['pin_code']
         max_spots = int(request.form['max_spots'])
+        levels = int(request.form.get('levels') or 1)
+        ev_spots = int(request.form.get('ev_spots') or 0)
+        try:
+            layout = build_layout(max_spots, levels, ev_spots)
+        except ValueError as exc:
+            flash(f'{exc}!')
+            return redirect(url_for('.create_lot'))
         
-        conn = get_db_connection()
-        cursor = conn.execute('INSERT INTO parking_lots (prime_location_name, price, address, pin_code, maximum_number_of_spots) VALUES (?, ?, ?, ?, ?)',
-                            (name, price, address, pin_code, max_spots))
-        lot_id = cursor.lastrowid
-        for i in range(max_spots):
-            conn.execute('INSERT INTO parking_spots (lot_id) VALUES (?)', (lot_id,))
-        
-        conn.commit()
-        conn.close()
+        ParkingLot.create_lot(name, price, address, pin_code, max_spots, layout)
         flash('Parking lot created successfully!')
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('.admin_dashboard'))
     
     return render_template('create_lot.html')
 
-@app.route('/admin/edit_lot/<int:lot_id>', methods=['GET', 'POST'])
+@bp.route('/admin/edit_lot/<int:lot_id>', methods=['GET', 'POST'])
 def edit_lot(lot_id):
     if not session.get('is_admin'):
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     
-    conn = get_db_connection()
+    lot = ParkingLot.get_lot_by_id(lot_id)
+    if lot is None:
+        flash('Parking lot not found!')
+        return redirect(url_for('.admin_dashboard'))
     if request.method == 'POST':
         name = request.form['name']
         price = float(request.form['price'])
@@ -182,149 +288,717 @@ def edit_lot(lot_id):
         pin_code = request.form['pin_code']
         max_spots = int(request.form['max_spots'])
         
-        current_spots = conn.execute('SELECT COUNT(*) as count FROM parking_spots WHERE lot_id = ?', (lot_id,)).fetchone()['count']
-        
-        conn.execute('UPDATE parking_lots SET prime_location_name = ?, price = ?, address = ?, pin_code = ?, maximum_number_of_spots = ? WHERE id = ?',
-                    (name, price, address, pin_code, max_spots, lot_id))
-        if max_spots > current_spots:
-            for i in range(max_spots - current_spots):
-                conn.execute('INSERT INTO parking_spots (lot_id) VALUES (?)', (lot_id,))
-        elif max_spots < current_spots:
-            spots_to_remove = conn.execute('SELECT id FROM parking_spots WHERE lot_id = ? AND status = "A" LIMIT ?', 
-                                         (lot_id, current_spots - max_spots)).fetchall()
-            for spot in spots_to_remove:
-                conn.execute('DELETE FROM parking_spots WHERE id = ?', (spot['id'],))
-        
-        conn.commit()
-        conn.close()
+        ParkingLot.update_lot(lot_id, name, price, address, pin_code, max_spots)
         flash('Parking lot updated successfully!')
-        return redirect(url_for('admin_dashboard'))
-    lot = conn.execute('SELECT * FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()
-    conn.close()
+        return redirect(url_for('.admin_dashboard'))
     return render_template('edit_lot.html', lot=lot)
 
-@app.route('/admin/delete_lot/<int:lot_id>')
+@bp.route('/admin/delete_lot/<int:lot_id>')
 def delete_lot(lot_id):
     if not session.get('is_admin'):
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     
-    conn = get_db_connection()
-    occupied_count = conn.execute('SELECT COUNT(*) as count FROM parking_spots WHERE lot_id = ? AND status = "O"', (lot_id,)).fetchone()['count']
-    if occupied_count > 0:
-        flash('Cannot delete lot with occupied spots!')
+    try:
+        ParkingLot.delete_lot(lot_id)
+    except ValueError as exc:
+        flash(f'{exc}!')
     else:
-        conn.execute('DELETE FROM parking_spots WHERE lot_id = ?', (lot_id,))
-        conn.execute('DELETE FROM parking_lots WHERE id = ?', (lot_id,))
-        conn.commit()
         flash('Parking lot deleted successfully!')
-    
-    conn.close()
-    return redirect(url_for('admin_dashboard'))
+    return redirect(url_for('.admin_dashboard'))
 
-@app.route('/admin/view_spots/<int:lot_id>')
+@bp.route('/admin/view_spots/<int:lot_id>')
 def view_spots(lot_id):
     if not session.get('is_admin'):
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     
-    conn = get_db_connection()
-    lot = conn.execute('SELECT * FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()
-    spots = conn.execute('''
-        SELECT ps.*, r.user_id, u.username, r.parking_timestamp 
-        FROM parking_spots ps 
-        LEFT JOIN reservations r ON ps.id = r.spot_id AND r.status = "active"
-        LEFT JOIN users u ON r.user_id = u.id 
-        WHERE ps.lot_id = ?
-    ''', (lot_id,)).fetchall()
-    conn.close()
+    filters = spot_filters(request.args)
+    after = request.args.get('after', 0, type=sqlite_int)
+    page_size = current_app.config['PAGE_SIZE']
+    lot = ParkingLot.get_lot_by_id(lot_id)
+    if lot is None:
+        flash('Parking lot not found!')
+        return redirect(url_for('.admin_dashboard'))
+    spots = ParkingSpot.get_spots_by_lot(lot_id, after_id=after, limit=page_size, **filters)
     
-    return render_template('view_spots.html', lot=lot, spots=spots)
+    return stream_page('view_spots.html', lot=lot, spots=spots, filters=filters, after=after, page_size=page_size)
+
+def spot_filters(args):
+    return {
+        'status': args.get('status') or None,
+        'level': args.get('level', type=sqlite_int),
+        'username': args.get('username') or None,
+    }
 
-@app.route('/user/dashboard')
+@bp.route('/admin/view_spots/<int:lot_id>/stream')
+def stream_spots(lot_id):
+    if not session.get('is_admin'):
+        return redirect(url_for('.login'))
+    
+    page_size = current_app.config['PAGE_SIZE']
+    limit = max(min(request.args.get('limit', page_size, type=int), page_size), 0)
+    after_id = request.args.get('after', 0, type=sqlite_int)
+    filters = spot_filters(request.args)
+    poll_seconds = current_app.config['STREAM_POLL_SECONDS']
+    
+    def take_snapshot(lot):
+        # Only the page the client shows is sent, with the lot's counters so
+        # its totals are right again after missed events.
+        spots = ParkingSpot.get_spots_by_lot(lot_id, after_id=after_id, limit=limit, **filters)
+        return {
+            'lot_id': lot_id,
+            'available_spots': lot.available_spots,
+            'occupied_spots': lot.occupied_spots,
+            'spots': [{'spot_id': spot.id, 'status': spot.status, 'user_id': spot.user_id,
+                       'username': spot.username, 'timestamp': spot.parking_timestamp}
+                      for spot in spots],
+        }
+    
+    last_seq = spot_events.parse_event_id(request.headers.get('Last-Event-ID'))
+    subscription = spot_events.subscribe(lot_id)
+    backlog = spot_events.replay(lot_id, last_seq) if last_seq is not None else None
+    # Read the sequence before the lot so nothing can slip between them.
+    seen = spot_events.current_seq()
+    lot = ParkingLot.get_lot_by_id(lot_id)
+    if lot is None:
+        spot_events.unsubscribe(subscription)
+        return jsonify(error='Not found'), 404
+    snapshot = take_snapshot(lot) if backlog is None else None
+    if snapshot is not None:
+        last_seq = seen
+    
+    # The generator runs after the request context is gone; the lot and
+    # spot reads it makes take pooled connections of their own.
+    def generate():
+        nonlocal seen
+        after = last_seq
+        # The lot's counters as of event seen, moved on by every later event.
+        counts = [lot.available_spots, lot.occupied_spots]
+        try:
+            yield 'retry: 3000\n\n'
+            if snapshot is not None:
+                yield format_event(spot_events.event_id(after), snapshot, 'snapshot')
+            else:
+                for seq, _, data in backlog:
+                    after = seq
+                    yield format_event(spot_events.event_id(seq), data, 'spot')
+            next_check = time.monotonic() + poll_seconds
+            while not subscription.overflowed:
+                event = subscription.get(timeout=max(0, next_check - time.monotonic()))
+                if event is not None:
+                    if event[0] > seen:
+                        delta = 1 if event[2]['status'] == 'O' else -1
+                        counts = [counts[0] - delta, counts[1] + delta]
+                    if event[0] > after:
+                        after = event[0]
+                        yield format_event(spot_events.event_id(after), event[2], 'spot')
+                    if time.monotonic() < next_check:
+                        continue
+                next_check = time.monotonic() + poll_seconds
+                # Other worker processes publish to buses of their own, so
+                # their bookings only show up in the lot's counters. When
+                # those have moved without us, resend the snapshot.
+                seq = spot_events.current_seq()
+                current = ParkingLot.get_lot_by_id(lot_id)
+                if current is None:
+                    return
+                if [current.available_spots, current.occupied_spots] != counts:
+                    after = seen = max(after, seq)
+                    counts = [current.available_spots, current.occupied_spots]
+                    yield format_event(spot_events.event_id(after), take_snapshot(current), 'snapshot')
+                elif event is None:
+                    yield ': keepalive\n\n'
+        finally:
+            spot_events.unsubscribe(subscription)
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@bp.route('/user/dashboard')
 def user_dashboard():
     if not session.get('user_id') or session.get('is_admin'):
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     
-    conn = get_db_connection()
     user_id = session['user_id']
-    active_reservations = conn.execute('''
-        SELECT r.*, ps.id as spot_number, pl.prime_location_name, pl.price
-        FROM reservations r
-        JOIN parking_spots ps ON r.spot_id = ps.id
-        JOIN parking_lots pl ON ps.lot_id = pl.id
-        WHERE r.user_id = ? AND r.status = "active"
-    ''', (user_id,)).fetchall()
-    parking_history = conn.execute('''
-        SELECT r.*, ps.id as spot_number, pl.prime_location_name, pl.price
-        FROM reservations r
-        JOIN parking_spots ps ON r.spot_id = ps.id
-        JOIN parking_lots pl ON ps.lot_id = pl.id
-        WHERE r.user_id = ? AND r.status = "completed"
-        ORDER BY r.parking_timestamp DESC LIMIT 10
-    ''', (user_id,)).fetchall()
+    active_reservations = Reservation.get_active_reservations(user_id)
+    parking_history = Reservation.get_user_history(user_id, archive_path=current_app.config['ARCHIVE_DATABASE'])
+    scheduled_reservations = Reservation.get_scheduled(user_id)
     
-    conn.close()
     return render_template('user_dashboard.html', 
                          active_reservations=active_reservations,
+                         scheduled_reservations=scheduled_reservations,
                          parking_history=parking_history)
 
-@app.route('/user/book_parking', methods=['GET', 'POST'])
+@bp.route('/user/book_parking', methods=['GET', 'POST'])
 def book_parking():
     if not session.get('user_id') or session.get('is_admin'):
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     
     if request.method == 'POST':
-        lot_id = int(request.form['lot_id'])
-        user_id = session['user_id']
-        conn = get_db_connection()
-        available_spot = conn.execute('SELECT * FROM parking_spots WHERE lot_id = ? AND status = "A" LIMIT 1', (lot_id,)).fetchone()
-        
-        if available_spot:
-            conn.execute('UPDATE parking_spots SET status = "O" WHERE id = ?', (available_spot['id'],))
-            conn.execute('INSERT INTO reservations (spot_id, user_id) VALUES (?, ?)', (available_spot['id'], user_id))
-            conn.commit()
+        as_json = wants_json()
+        if request.is_json:
+            lot_id = (request.get_json(silent=True) or {}).get('lot_id')
+            lot_id = lot_id if is_sqlite_int(lot_id) else None
+        else:
+            lot_id = request.form.get('lot_id', type=sqlite_int)
+        if lot_id is None:
+            if as_json:
+                return jsonify(error='Parking lot not found!'), 404
+            flash('Parking lot not found!')
+            return redirect(url_for('.book_parking'))
+        try:
+            turn = booking_admission.acquire(session['user_id'], lot_id)
+        except AdmissionRejected as exc:
+            if as_json:
+                return admission_response(exc)
+            flash(str(exc))
+            return redirect(url_for('.user_dashboard'))
+        try:
+            booking = ParkingSpot.book_spot(lot_id, session['user_id'], session['username'])
+        finally:
+            booking_admission.release(lot_id, turn)
+        if booking:
+            if as_json:
+                return jsonify(lot_id=lot_id, spot_id=booking[0], reservation_id=booking[1]), 201
             flash('Parking spot booked successfully!')
+            return redirect(url_for('.user_dashboard'))
+        # Only the failure path pays for working out why.
+        lot = ParkingLot.get_lot_by_id(lot_id)
+        if lot is None:
+            message, status = 'Parking lot not found!', 404
+        elif lot.available_spots:
+            message, status = 'The remaining spots in this lot are held for scheduled arrivals!', 409
         else:
-            flash('No available spots in this lot!')
-        conn.close()
-        return redirect(url_for('user_dashboard'))
+            message, status = 'No available spots in this lot!', 409
+        if as_json:
+            return jsonify(error=message), status
+        flash(message)
+        return redirect(url_for('.user_dashboard'))
     
-    conn = get_db_connection()
-    lots_with_availability = conn.execute('''
-        SELECT pl.*, COUNT(ps.id) as available_spots
-        FROM parking_lots pl
-        LEFT JOIN parking_spots ps ON pl.id = ps.lot_id AND ps.status = "A"
-        GROUP BY pl.id
-        HAVING available_spots > 0
-    ''').fetchall()
-    conn.close()
+    filters = search_filters(request.args)
+    lots_with_availability = ParkingLot.search_lots(limit=current_app.config['SEARCH_LIMIT'], **filters)
+    # A lot that is full now may still have room later.
+    reservable_lots = ParkingLot.search_lots(limit=current_app.config['SEARCH_LIMIT'], only_available=False, **filters)
     
-    return render_template('book_parking.html', lots=lots_with_availability)
+    return render_template('book_parking.html', lots=lots_with_availability, reservable_lots=reservable_lots,
+                           filters=filters, current_price=price_table.price)
+
+def wants_json():
+    return request.is_json or request.accept_mimetypes.best == 'application/json'
 
-@app.route('/user/release_spot/<int:reservation_id>')
+def admission_response(exc):
+    # A full lot will not take the booking however soon it is retried; the
+    # other rejections are back-pressure and say when to come back.
+    if exc.reason == 'full':
+        return jsonify(error=str(exc), reason=exc.reason), 409
+    return (jsonify(error=str(exc), reason=exc.reason), 429,
+            {'Retry-After': str(max(1, math.ceil(exc.retry_after or 0)))})
+
+def search_filters(args):
+    order = args.get('order', 'price')
+    return {
+        'text': args.get('q', '').strip() or None,
+        'pin_prefix': args.get('pin', '').strip() or None,
+        'min_price': args.get('min_price', type=float),
+        'max_price': args.get('max_price', type=float),
+        'order': order if order in search.ORDERINGS else 'price',
+    }
+
+@bp.route('/user/release_spot/<int:reservation_id>')
 def release_spot(reservation_id):
     if not session.get('user_id') or session.get('is_admin'):
-        return redirect(url_for('login'))
-    conn = get_db_connection()
-    reservation = conn.execute('SELECT * FROM reservations WHERE id = ? AND user_id = ?', 
-                              (reservation_id, session['user_id'])).fetchone()
-    if reservation:
-        parking_time = datetime.now() - datetime.fromisoformat(reservation['parking_timestamp'])
-        hours = parking_time.total_seconds() / 3600
-        
-        lot_price = conn.execute('''
-            SELECT pl.price FROM parking_lots pl
-            JOIN parking_spots ps ON pl.id = ps.lot_id
-            WHERE ps.id = ?
-        ''', (reservation['spot_id'],)).fetchone()['price']
-        total_cost = hours * lot_price
-        conn.execute('UPDATE parking_spots SET status = "A" WHERE id = ?', (reservation['spot_id'],))
-        conn.execute('UPDATE reservations SET leaving_timestamp = ?, parking_cost = ?, status = "completed" WHERE id = ?',
-                    (datetime.now(), total_cost, reservation_id))
-        conn.commit()
+        return redirect(url_for('.login'))
+    total_cost = Reservation.release_reservation(reservation_id, session['user_id'], session['username'])
+    if total_cost is not None:
         flash(f'Spot released successfully! Total cost: ₹{total_cost:.2f}')
-    conn.close()
-    return redirect(url_for('user_dashboard'))
+    else:
+        flash('Reservation not found!')
+    return redirect(url_for('.user_dashboard'))
+
+def parse_schedule_window(form):
+    try:
+        return (datetime.fromisoformat(form.get('start', '')),
+                datetime.fromisoformat(form.get('end', '')))
+    except ValueError:
+        return None
+
+@bp.route('/user/schedule', methods=['POST'])
+def schedule_parking():
+    if not session.get('user_id') or session.get('is_admin'):
+        return redirect(url_for('.login'))
+    
+    lot_id = request.form.get('lot_id', type=sqlite_int)
+    window = parse_schedule_window(request.form)
+    if lot_id is None or window is None:
+        flash('Choose a lot and a valid start and end time!')
+        return redirect(url_for('.book_parking'))
+    
+    conn = shard_map.connection_for(lot_id)
+    try:
+        schedule_id = schedule_index.reserve(conn, lot_id, session['user_id'], *window)
+    except ValueError as exc:
+        flash(f'{exc}!')
+        return redirect(url_for('.book_parking'))
+    if schedule_id:
+        flash(f'Reserved {window[0]:%d %b %H:%M} - {window[1]:%d %b %H:%M}. Check in when you arrive.')
+        return redirect(url_for('.user_dashboard'))
+    if ParkingLot.get_lot_by_id(lot_id) is None:
+        flash('Parking lot not found!')
+    else:
+        flash('No spots are free in this lot for that time!')
+    return redirect(url_for('.book_parking'))
+
+@bp.route('/user/schedule/<int:schedule_id>/check_in', methods=['POST'])
+def check_in_scheduled(schedule_id):
+    if not session.get('user_id') or session.get('is_admin'):
+        return redirect(url_for('.login'))
+    
+    conn = shard_map.connection_for(schedule_id)
+    try:
+        booking = schedule_index.check_in(conn, schedule_id, session['user_id'])
+    except ValueError as exc:
+        flash(f'{exc}!')
+        return redirect(url_for('.user_dashboard'))
+    if booking:
+        lot_id, spot_id, _ = booking
+        api_cache.invalidate_lot(lot_id)
+        spot_events.publish(lot_id, {'spot_id': spot_id, 'status': 'O', 'user_id': session['user_id'],
+                                     'username': session['username'],
+                                     'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')})
+        flash(f'Checked in! Your spot number is {spot_id}.')
+    else:
+        flash('Could not check in: the lot is full right now or the reservation is no longer open!')
+    return redirect(url_for('.user_dashboard'))
+
+@bp.route('/user/schedule/<int:schedule_id>/cancel', methods=['POST'])
+def cancel_scheduled(schedule_id):
+    if not session.get('user_id') or session.get('is_admin'):
+        return redirect(url_for('.login'))
+    
+    conn = shard_map.connection_for(schedule_id)
+    if schedule_index.cancel(conn, schedule_id, session['user_id']):
+        flash('Scheduled reservation cancelled.')
+    else:
+        flash('Scheduled reservation not found!')
+    return redirect(url_for('.user_dashboard'))
+
+@bp.route('/api/v1/bookings/batch', methods=['POST'])
+def api_book_batch():
+    if not session.get('user_id') or session.get('is_admin'):
+        return jsonify(error='Forbidden'), 403
+    data = request.get_json(silent=True) or {}
+    count = data.get('count')
+    lot_id = data.get('lot_id')
+    if not isinstance(count, int) or not 1 <= count <= fleet.MAX_BATCH:
+        return jsonify(error=f'count must be between 1 and {fleet.MAX_BATCH}'), 400
+    if lot_id is not None and not is_sqlite_int(lot_id):
+        return jsonify(error='lot_id must be an integer'), 400
+    
+    booked = Reservation.book_batch(session['user_id'], count, lot_id, bool(data.get('adjacent')))
+    timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    for booked_lot_id in {booking[0] for booking in booked}:
+        api_cache.invalidate_lot(booked_lot_id)
+    for booked_lot_id, spot_id, _ in booked:
+        spot_events.publish(booked_lot_id, {'spot_id': spot_id, 'status': 'O', 'user_id': session['user_id'],
+                                            'username': session['username'], 'timestamp': timestamp})
+    
+    results = [{'status': 'booked', 'lot_id': booked_lot_id, 'spot_id': spot_id, 'reservation_id': reservation_id}
+               for booked_lot_id, spot_id, reservation_id in booked]
+    results += [{'status': 'unavailable'}] * (count - len(booked))
+    return jsonify(requested=count, booked=len(booked), results=results), 200 if booked else 409
+
+@bp.route('/api/v1/bookings/release', methods=['POST'])
+def api_release_batch():
+    if not session.get('user_id') or session.get('is_admin'):
+        return jsonify(error='Forbidden'), 403
+    data = request.get_json(silent=True) or {}
+    reservation_ids = data.get('reservation_ids')
+    if (not isinstance(reservation_ids, list) or not 1 <= len(reservation_ids) <= fleet.MAX_BATCH
+            or not all(is_sqlite_int(reservation_id) for reservation_id in reservation_ids)):
+        return jsonify(error=f'reservation_ids must be a list of 1 to {fleet.MAX_BATCH} integers'), 400
+    
+    released = Reservation.release_batch(session['user_id'], list(dict.fromkeys(reservation_ids)))
+    timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    for released_lot_id in {release[0] for release in released.values()}:
+        api_cache.invalidate_lot(released_lot_id)
+    for released_lot_id, spot_id, _ in released.values():
+        spot_events.publish(released_lot_id, {'spot_id': spot_id, 'status': 'A', 'user_id': session['user_id'],
+                                              'username': session['username'], 'timestamp': timestamp})
+    
+    results = []
+    for reservation_id in reservation_ids:
+        if reservation_id in released:
+            released_lot_id, spot_id, cost = released[reservation_id]
+            results.append({'reservation_id': reservation_id, 'status': 'released', 'lot_id': released_lot_id,
+                            'spot_id': spot_id, 'parking_cost': round(cost, 2)})
+        else:
+            results.append({'reservation_id': reservation_id, 'status': 'not_found'})
+    return jsonify(released=len(released), total_cost=round(sum(release[2] for release in released.values()), 2),
+                   results=results)
+
+@bp.route('/admin/reports')
+def reports():
+    if not session.get('is_admin'):
+        return redirect(url_for('.login'))
+    
+    lot_id = request.args.get('lot_id', type=sqlite_int)
+    granularity = 'hourly' if request.args.get('granularity') == 'hourly' else 'daily'
+    start = request.args.get('from') or None
+    end = request.args.get('to') or None
+    summary = summary_report(start, end)
+    rows = rollups.lot_report(shard_map.connection_for(lot_id), lot_id, granularity, start, end) if lot_id else []
+    # Each shard rolls up on its own; the report is as fresh as the stalest.
+    watermarks = [row['updated_at'] for row in shard_map.gather(lambda conn, shard: conn.execute(
+        'SELECT updated_at FROM rollup_state WHERE name = ?', (rollups.WATERMARK_NAME,)).fetchone()) if row]
+    return render_template('reports.html', summary=summary, rows=rows, lot_id=lot_id,
+                           granularity=granularity, start=start, end=end,
+                           updated_at=min(watermarks) if watermarks else None)
+
+def summary_report(start=None, end=None):
+    # Shards hold ascending id ranges, so concatenating keeps lot order.
+    return [row for rows in shard_map.gather(lambda conn, shard: rollups.summary_report(conn, start, end))
+            for row in rows]
+
+@bp.route('/api/v1/reports/lots')
+def api_report_summary():
+    if not session.get('is_admin'):
+        return jsonify(error='Forbidden'), 403
+    summary = summary_report(request.args.get('from'), request.args.get('to'))
+    return jsonify(lots=[dict(row) for row in summary])
+
+@bp.route('/api/v1/reports/lots/<int:lot_id>')
+def api_report_lot(lot_id):
+    if not session.get('is_admin'):
+        return jsonify(error='Forbidden'), 403
+    if ParkingLot.get_lot_by_id(lot_id) is None:
+        return jsonify(error='Not found'), 404
+    granularity = 'hourly' if request.args.get('granularity') == 'hourly' else 'daily'
+    rows = rollups.lot_report(shard_map.connection_for(lot_id), lot_id, granularity,
+                              request.args.get('from'), request.args.get('to'))
+    return jsonify(lot_id=lot_id, granularity=granularity, buckets=[dict(row) for row in rows])
+
+@bp.route('/admin/export/<kind>')
+def export_data(kind):
+    if not session.get('is_admin'):
+        return redirect(url_for('.login'))
+    fmt = request.args.get('format', 'csv')
+    if kind not in bulk.KINDS or fmt not in bulk.FORMATS:
+        return jsonify(error='Unknown export'), 404
+    
+    # Rows are read and encoded a chunk at a time while the response is
+    # being sent, on a connection of its own outside the request context.
+    archive_database = current_app.config['ARCHIVE_DATABASE']
+    chunk_size = current_app.config['BULK_CHUNK_SIZE']
+    def generate():
+        conns = [pool.get_pool(path).acquire() for path in export_paths(kind)]
+        try:
+            yield from bulk.export_stream(export_sources(kind, conns, archive_database), kind, fmt, chunk_size)
+        finally:
+            for conn in conns:
+                conn.release()
+    
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(generate(), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={kind}.{fmt}'
+    return response
+
+def export_paths(kind):
+    # Users only live on the main database.
+    return shard_map.paths[:1] if kind == 'users' else shard_map.paths
+
+def export_sources(kind, conns, archive_database):
+    return [(conn, shard_map.archive_path(archive_database, shard)) for shard, conn in enumerate(conns)]
+
+@bp.route('/admin/import/<kind>', methods=['POST'])
+def import_data(kind):
+    if not session.get('is_admin'):
+        return jsonify(error='Forbidden'), 403
+    if kind not in bulk.KINDS:
+        return jsonify(error='Unknown import'), 404
+    upload = request.files.get('file')
+    filename = upload.filename if upload else ''
+    fmt = request.args.get('format') or ('ndjson' if filename.endswith(('.ndjson', '.jsonl')) else 'csv')
+    if fmt not in bulk.FORMATS:
+        return jsonify(error='Unknown format'), 400
+    
+    stream = io.TextIOWrapper(upload.stream if upload else request.stream, encoding='utf-8-sig', newline='')
+    try:
+        imported, skipped = bulk.import_sharded(shard_map, kind, bulk.read_records(stream, fmt),
+                                                current_app.config['BULK_CHUNK_SIZE'],
+                                                current_app.config['PASSWORD_HASH_METHOD'])
+    except ValueError as exc:
+        return jsonify(error=str(exc)), 400
+    if kind == 'lots':
+        api_cache.clear()
+    if kind != 'users' and imported:
+        checkpoint_shards()
+    return jsonify(kind=kind, imported=imported, skipped=skipped)
+
+def checkpoint_shards():
+    # Imports write rows without logging them, so replays start after them.
+    return [event_log.checkpoint(shard_map.connection(shard), shard) for shard in shard_map.shards]
+
+def cached_json(key, build):
+    entry = api_cache.get(key)
+    if entry is None:
+        data = build()
+        if data is None:
+            return jsonify(error='Not found'), 404
+        entry = api_cache.set(key, json.dumps(data, separators=(',', ':')))
+    
+    if request.if_none_match.contains(entry.etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(entry.body, mimetype='application/json')
+    response.set_etag(entry.etag)
+    response.cache_control.max_age = int(api_cache.ttl)
+    response.cache_control.public = True
+    return response
+
+def lot_to_dict(lot):
+    return {
+        'id': lot['id'],
+        'name': lot['prime_location_name'],
+        'address': lot['address'],
+        'pin_code': lot['pin_code'],
+        'price': lot['price'],
+        'current_price': price_table.price(lot['id'], lot['price']),
+        'total_spots': lot['total_spots'],
+        'available_spots': lot['available_spots'],
+        'occupied_spots': lot['occupied_spots'],
+    }
+
+@bp.route('/api/v1/lots')
+def api_lots():
+    def build():
+        return {'lots': [lot_to_dict(lot) for lot in ParkingLot.get_all_lots()]}
+    return cached_json(('lots',), build)
+
+@bp.route('/api/v1/lots/search')
+def api_lot_search():
+    filters = search_filters(request.args)
+    limit = request.args.get('limit', current_app.config['SEARCH_LIMIT'], type=int)
+    only_available = request.args.get('available', '1') != '0'
+    lots = ParkingLot.search_lots(limit=limit, only_available=only_available, **filters)
+    return jsonify(lots=[lot_to_dict(lot) for lot in lots])
+
+@bp.route('/api/v1/lots/<int:lot_id>/availability')
+def api_lot_availability(lot_id):
+    def build():
+        lot = ParkingLot.get_lot_by_id(lot_id)
+        if lot is None:
+            return None
+        return {
+            'lot_id': lot.id,
+            'total_spots': lot.total_spots,
+            'available_spots': lot.available_spots,
+            'occupied_spots': lot.occupied_spots,
+        }
+    return cached_json(('availability', lot_id), build)
+
+@bp.route('/api/v1/lots/<int:lot_id>/schedule')
+def api_lot_schedule(lot_id):
+    window = parse_schedule_window(request.args)
+    if window is None or window[1] <= window[0]:
+        return jsonify(error='start and end must be ISO timestamps with end after start'), 400
+    conn = shard_map.connection_for(lot_id)
+    free_spots = schedule_index.free_spots(conn, lot_id, *window)
+    if free_spots is None:
+        return jsonify(error='Not found'), 404
+    return jsonify(lot_id=lot_id, start=window[0].isoformat(), end=window[1].isoformat(), free_spots=free_spots)
+
+@bp.route('/api/v1/lots/<int:lot_id>/spots')
+def api_lot_spots(lot_id):
+    def build():
+        if ParkingLot.get_lot_by_id(lot_id) is None:
+            return None
+        spots = ParkingSpot.get_layout(lot_id)
+        return {
+            'lot_id': lot_id,
+            'spots': [{'id': spot['id'], 'status': spot['status'], 'level': spot['level'],
+                       'zone': spot['zone'], 'ev_capable': bool(spot['ev_capable'])} for spot in spots],
+        }
+    return cached_json(('spots', lot_id), build)
+
+@bp.cli.command('migrate')
+def migrate_command():
+    for shard, applied in shard_map.migrate():
+        prefix = f'Shard {shard}: ' if shard_map.count > 1 else ''
+        for version, description in applied:
+            click.echo(f'{prefix}Applied migration {version}: {description}')
+    click.echo(f'Schema is at version {migrations.current_version(get_db_connection())}')
+
+@bp.cli.command('check-counters')
+@click.option('--repair', is_flag=True, help='Rebuild counters that have drifted.')
+def check_counters_command(repair):
+    drifted = 0
+    for shard in shard_map.shards:
+        conn = shard_map.connection(shard)
+        drift = counters.find_drift(conn)
+        for lot_id, stored, actual in drift:
+            click.echo(f'Lot {lot_id}: stored total/available/occupied {stored}, actual {actual}')
+        if drift and repair:
+            counters.rebuild_counters(conn)
+            conn.commit()
+        drifted += len(drift)
+    if drifted and repair:
+        click.echo(f'Rebuilt counters for {drifted} lot(s)')
+    elif not drifted:
+        click.echo('All lot counters are consistent')
+
+@bp.cli.command('checkpoint')
+def checkpoint_command():
+    for shard, state in enumerate(checkpoint_shards()):
+        prefix = f'Shard {shard}: ' if shard_map.count > 1 else ''
+        click.echo(f'{prefix}Checkpointed {len(state.lots)} lots at LSN {state.lsn}')
+
+@bp.cli.command('replay')
+@click.option('--repair', is_flag=True, help='Write the replayed counters to lots whose stored counters differ, '
+                                              'then rebuild the usage rollups from the reservations.')
+@click.option('--checkpoint', 'save', is_flag=True, help='Save the replayed state as the new checkpoint.')
+def replay_command(repair, save):
+    drifted = 0
+    for shard in shard_map.shards:
+        prefix = f'Shard {shard}: ' if shard_map.count > 1 else ''
+        conn = shard_map.connection(shard)
+        if conn.in_transaction:
+            conn.commit()
+        # One snapshot for the LSN and the stored counters; a repair holds
+        # the write lock so no booking lands in between.
+        conn.execute('BEGIN IMMEDIATE' if repair else 'BEGIN')
+        try:
+            started = time.perf_counter()
+            state = event_log.shard(shard).load_checkpoint()
+            if state is None:
+                raise click.ClickException(f'{prefix}No checkpoint yet. Run "flask checkpoint" first.')
+            checkpointed = state.lsn
+            try:
+                event_log.replay(conn, shard, state)
+            except EventLogGap as exc:
+                raise click.ClickException(f'{prefix}{exc}. Run "flask checkpoint" to start over.')
+            elapsed = time.perf_counter() - started
+            drift = counters.compare_counts(conn, state.counts())
+            if drift and repair:
+                counters.write_counts(conn, drift)
+                conn.commit()
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+
+        click.echo(f'{prefix}Replayed {state.lsn - checkpointed} events from LSN {checkpointed} to {state.lsn} '
+                   f'in {elapsed * 1000:.1f} ms')
+        for lot_id, stored, replayed in drift:
+            click.echo(f'{prefix}Lot {lot_id}: stored total/available/occupied {stored}, replayed {replayed}')
+        drifted += len(drift)
+        click.echo(f'{prefix}{sum(lot.occupied for lot in state.lots.values())} of '
+                   f'{sum(lot.total for lot in state.lots.values())} spots occupied')
+        if repair:
+            # The log holds no history from before its checkpoint, so the
+            # rollups are refolded from the reservations and the archive.
+            folded = rollups.run_rollup(conn, rebuild=True, archive_path=shard_map.archive_path(
+                current_app.config['ARCHIVE_DATABASE'], shard))
+            click.echo(f'{prefix}Rebuilt the usage rollups from {folded} completed reservations')
+        if save:
+            pruned = event_log.save_checkpoint(shard, state)
+            click.echo(f'{prefix}Checkpointed at LSN {state.lsn}, removed {pruned} old segment(s)')
+    if drifted and repair:
+        click.echo(f'Rebuilt counters for {drifted} lot(s)')
+    elif not drifted:
+        click.echo('All lot counters match the event log')
+
+@bp.cli.command('set-tariff')
+@click.argument('lot_id', type=int)
+@click.option('--rounding', type=click.Choice(['exact', 'hour']), default='exact')
+@click.option('--tier', 'tiers', multiple=True, help='UP_TO_HOUR:MULTIPLIER band, e.g. 2:1.0 or -:0.5')
+@click.option('--daily-cap', type=float, default=None)
+def set_tariff_command(lot_id, rounding, tiers, daily_cap):
+    bands = []
+    for tier in tiers:
+        upto, _, multiplier = tier.partition(':')
+        bands.append((None if upto in ('', '-') else float(upto), float(multiplier)))
+    tariff = billing.Tariff(rounding, bands or None, daily_cap)
+    conn = shard_map.connection_for(lot_id)
+    conn.execute('UPDATE parking_lots SET tariff = ? WHERE id = ?', (tariff.to_json(), lot_id))
+    conn.commit()
+    click.echo(f'Lot {lot_id} tariff set to {tariff.to_json()}')
+
+@bp.cli.command('settle')
+@click.option('--since', default=None, help='Only reservations that left at or after this timestamp.')
+@click.option('--until', default=None, help='Only reservations that left before this timestamp.')
+@click.option('--lot', 'lot_id', type=int, default=None)
+@click.option('--chunk-size', type=int, default=50000)
+@click.option('--dry-run', is_flag=True)
+def settle_command(since, until, lot_id, chunk_size, dry_run):
+    settled = total = 0
+    for shard in ([shard_map.shard_of(lot_id)] if lot_id else shard_map.shards):
+        count, amount = billing.settle_reservations(shard_map.connection(shard), since, until, lot_id, chunk_size, dry_run)
+        settled += count
+        total += amount
+    click.echo(f'{"Would settle" if dry_run else "Settled"} {settled} reservations totalling ₹{total:.2f}')
+
+@bp.cli.command('reprice')
+@click.option('--skip-rollup', is_flag=True, help='Price from the usage rollups as they stand.')
+def reprice_command(skip_rollup):
+    repriced = pricing_engine.refresh(force=True, rollup=not skip_rollup)
+    click.echo(f'Repriced {repriced} lots from {current_app.config["PRICING_WINDOW_DAYS"]} days of occupancy')
+
+@bp.cli.command('rollup')
+@click.option('--rebuild', is_flag=True, help='Discard existing rollups and refold all history, archived rows included.')
+@click.option('--chunk-size', type=int, default=20000)
+def rollup_command(rebuild, chunk_size):
+    folded = sum(rollups.run_rollup(shard_map.connection(shard), chunk_size, rebuild,
+                                    archive_path=shard_map.archive_path(current_app.config['ARCHIVE_DATABASE'], shard))
+                 for shard in shard_map.shards)
+    click.echo(f'Folded {folded} completed reservations into the usage rollups')
+
+@bp.cli.command('archive')
+@click.option('--older-than', 'older_than_days', type=int, default=None,
+              help='Archive completed reservations that left more than this many days ago.')
+@click.option('--chunk-size', type=int, default=5000)
+@click.option('--ignore-rollups', is_flag=True, help='Archive rows even if the usage rollups have not folded them.')
+def archive_command(older_than_days, chunk_size, ignore_rollups):
+    if older_than_days is None:
+        older_than_days = current_app.config['ARCHIVE_AFTER_DAYS']
+    for shard in shard_map.shards:
+        path = shard_map.archive_path(current_app.config['ARCHIVE_DATABASE'], shard)
+        moved = archive.archive_reservations(shard_map.connection(shard), path, older_than_days,
+                                             chunk_size, require_rollup=not ignore_rollups)
+        click.echo(f'Moved {moved} reservations to {path}')
+
+@bp.cli.command('export')
+@click.argument('kind', type=click.Choice(bulk.KINDS))
+@click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS), default='csv')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--chunk-size', type=int, default=None)
+def export_command(kind, fmt, output, chunk_size):
+    conns = [shard_map.connection(shard) for shard in range(len(export_paths(kind)))]
+    sources = export_sources(kind, conns, current_app.config['ARCHIVE_DATABASE'])
+    for block in bulk.export_stream(sources, kind, fmt, chunk_size or current_app.config['BULK_CHUNK_SIZE']):
+        output.write(block)
+
+@bp.cli.command('import')
+@click.argument('kind', type=click.Choice(bulk.KINDS))
+@click.argument('source', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS), default=None,
+              help='Defaults to ndjson for .ndjson/.jsonl files and csv otherwise.')
+@click.option('--chunk-size', type=int, default=None)
+def import_command(kind, source, fmt, chunk_size):
+    if fmt is None:
+        fmt = 'ndjson' if source.name.endswith(('.ndjson', '.jsonl')) else 'csv'
+    try:
+        imported, skipped = bulk.import_sharded(shard_map, kind, bulk.read_records(source, fmt),
+                                                chunk_size or current_app.config['BULK_CHUNK_SIZE'],
+                                                current_app.config['PASSWORD_HASH_METHOD'])
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    click.echo(f'Imported {imported} {kind}, skipped {skipped}')
+    if kind == 'reservations' and imported:
+        click.echo('Run "flask rollup --rebuild" if the imported history predates the last rollup.')
+    if kind != 'users' and imported:
+        checkpoint_shards()
+
+app = create_app()
 
 if __name__ == '__main__':
-    init_database()
     app.run(debug=True)
\ No newline at end of file
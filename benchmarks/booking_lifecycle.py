@@ -0,0 +1,275 @@
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+def seed(database, lots, spots_per_lot, users, history, rng):
+    from werkzeug.security import generate_password_hash
+    from models import migrations
+    from models.provisioning import build_layout, provision_layout
+
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    migrations.migrate(conn)
+    conn.execute('INSERT INTO users (username, password, email) VALUES (?, ?, ?)',
+                 ('admin', generate_password_hash('admin123'), 'admin@parking.com'))
+    # One hash for every synthetic user keeps seeding fast.
+    password = generate_password_hash('bench')
+    conn.executemany('INSERT INTO users (username, password, email, phone) VALUES (?, ?, ?, ?)',
+                     ((f'bench{i}', password, f'bench{i}@example.com', '0000000000') for i in range(users)))
+
+    lot_ids = []
+    for i in range(lots):
+        cursor = conn.execute('INSERT INTO parking_lots (prime_location_name, price, address, pin_code, maximum_number_of_spots) VALUES (?, ?, ?, ?, ?)',
+                              (f'Bench Lot {i}', rng.choice([20.0, 40.0, 60.0]), f'{i} Bench Road', f'{600000 + i}', spots_per_lot))
+        provision_layout(conn, cursor.lastrowid, build_layout(spots_per_lot, levels=max(1, spots_per_lot // 500)))
+        lot_ids.append(cursor.lastrowid)
+
+    user_ids = [row[0] for row in conn.execute('SELECT id FROM users WHERE username != "admin"')]
+    spot_ids = [row[0] for row in conn.execute('SELECT id FROM parking_spots')]
+    now = datetime.now()
+
+    def history_rows():
+        for _ in range(history):
+            start = now - timedelta(minutes=rng.randint(60, 60 * 24 * 365))
+            end = start + timedelta(minutes=rng.randint(10, 60 * 12))
+            yield (rng.choice(spot_ids), rng.choice(user_ids), start.strftime('%Y-%m-%d %H:%M:%S'),
+                   end.strftime('%Y-%m-%d %H:%M:%S'), round(rng.uniform(10, 500), 2))
+
+    conn.executemany('''
+        INSERT INTO reservations (spot_id, user_id, parking_timestamp, leaving_timestamp, parking_cost, status)
+        VALUES (?, ?, ?, ?, ?, 'completed')
+    ''', history_rows())
+    conn.commit()
+    conn.close()
+    return lot_ids, users
+
+class TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code
+
+class HttpSession:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def timed(self, session, route, method, path, data=None):
+        start = time.perf_counter()
+        status = session.request(method, path, data)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.samples.setdefault(route, []).append(elapsed)
+            if status >= 400:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return status
+
+def worker(make_session, database, recorder, lot_ids, hot_lot_share, user_index, deadline, seed_value, admin):
+    rng = random.Random(seed_value)
+    session = make_session()
+    if admin:
+        recorder.timed(session, 'POST /login', 'POST', '/login', {'username': 'admin', 'password': 'admin123'})
+        while time.perf_counter() < deadline:
+            lot_id = rng.choice(lot_ids)
+            route = rng.choice(('GET /admin/dashboard', 'GET /admin/view_spots', 'GET /api/v1/lots'))
+            path = {'GET /admin/dashboard': '/admin/dashboard',
+                    'GET /admin/view_spots': f'/admin/view_spots/{lot_id}',
+                    'GET /api/v1/lots': '/api/v1/lots'}[route]
+            recorder.timed(session, route, 'GET', path)
+        return
+
+    username = f'bench{user_index}'
+    recorder.timed(session, 'POST /login', 'POST', '/login', {'username': username, 'password': 'bench'})
+    conn = sqlite3.connect(database, timeout=30)
+    user_id = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()[0]
+    while time.perf_counter() < deadline:
+        active = conn.execute('SELECT id FROM reservations WHERE user_id = ? AND status = "active"', (user_id,)).fetchall()
+        roll = rng.random()
+        if active and roll < 0.45:
+            recorder.timed(session, 'GET /user/release_spot', 'GET', f'/user/release_spot/{rng.choice(active)[0]}')
+        elif roll < 0.8:
+            lot_id = lot_ids[0] if rng.random() < hot_lot_share else rng.choice(lot_ids)
+            recorder.timed(session, 'POST /user/book_parking', 'POST', '/user/book_parking', {'lot_id': lot_id})
+        elif roll < 0.9:
+            recorder.timed(session, 'GET /user/book_parking', 'GET', '/user/book_parking')
+        else:
+            recorder.timed(session, 'GET /user/dashboard', 'GET', '/user/dashboard')
+    conn.close()
+
+def count_double_bookings(database):
+    conn = sqlite3.connect(database)
+    duplicate_spots = conn.execute('''
+        SELECT COUNT(*) FROM (
+            SELECT spot_id FROM reservations WHERE status = "active" GROUP BY spot_id HAVING COUNT(*) > 1
+        )
+    ''').fetchone()[0]
+    mismatched = conn.execute('''
+        SELECT COUNT(*) FROM parking_spots ps
+        WHERE (ps.status = "O") != EXISTS (SELECT 1 FROM reservations r WHERE r.spot_id = ps.id AND r.status = "active")
+    ''').fetchone()[0]
+    conn.close()
+    return duplicate_spots, mismatched
+
+def summarise(recorder, elapsed):
+    routes = {}
+    for route, samples in sorted(recorder.samples.items()):
+        routes[route] = {
+            'requests': len(samples),
+            'errors': recorder.errors.get(route, 0),
+            'throughput_rps': len(samples) / elapsed,
+            'p50_ms': percentile(samples, 0.50) * 1000,
+            'p95_ms': percentile(samples, 0.95) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+        }
+    return routes
+
+def compare(result, baseline, threshold):
+    regressions = []
+    for route, current in result['routes'].items():
+        previous = baseline.get('routes', {}).get(route)
+        if not previous:
+            continue
+        if previous['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append(f'{route}: p95 {previous["p95_ms"]:.2f} ms -> {current["p95_ms"]:.2f} ms')
+        if previous['throughput_rps'] and current['throughput_rps'] < previous['throughput_rps'] * (1 - threshold):
+            regressions.append(f'{route}: throughput {previous["throughput_rps"]:.1f} -> {current["throughput_rps"]:.1f} req/s')
+    if result['double_bookings'] > baseline.get('double_bookings', 0):
+        regressions.append(f'double bookings {baseline.get("double_bookings", 0)} -> {result["double_bookings"]}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive booking/release traffic and report per-route latency.')
+    parser.add_argument('--lots', type=int, default=20)
+    parser.add_argument('--spots-per-lot', type=int, default=500)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--history', type=int, default=100000, help='Completed reservations to seed.')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--admin-workers', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds of traffic.')
+    parser.add_argument('--hot-lot-share', type=float, default=0.5, help='Share of bookings aimed at one lot.')
+    parser.add_argument('--mode', choices=['testclient', 'wsgi'], default='testclient')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write results as JSON to this file.')
+    parser.add_argument('--baseline', help='Compare against a previous JSON result.')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Allowed regression, as a fraction.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='parking-bench-')
+    # The app resolves its database relative to the working directory.
+    os.chdir(workdir)
+    database = os.path.join(workdir, 'parking_app.db')
+    started = time.perf_counter()
+    lot_ids, users = seed(database, args.lots, args.spots_per_lot, args.users, args.history, rng)
+    print(f'Seeded {args.lots} lots x {args.spots_per_lot} spots, {users} users, '
+          f'{args.history} reservations in {time.perf_counter() - started:.1f}s ({workdir})')
+
+    # Simulated users book far faster than the per-user rate limit allows.
+    os.environ.setdefault('BOOKING_RATE', '0')
+    import app as parking_app
+    server = None
+    if args.mode == 'wsgi':
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', 0, parking_app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        make_session = lambda: HttpSession(base_url)
+    else:
+        make_session = lambda: TestClientSession(parking_app.app)
+
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=worker, args=(make_session, database, recorder, lot_ids, args.hot_lot_share,
+                                                     i % users, deadline, args.seed + i, False))
+               for i in range(args.workers)]
+    threads += [threading.Thread(target=worker, args=(make_session, database, recorder, lot_ids, args.hot_lot_share,
+                                                      0, deadline, args.seed - i - 1, True))
+                for i in range(args.admin_workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if server is not None:
+        server.shutdown()
+
+    duplicate_spots, mismatched = count_double_bookings(database)
+    routes = summarise(recorder, elapsed)
+    total = sum(route['requests'] for route in routes.values())
+    result = {
+        'config': vars(args),
+        'elapsed_s': elapsed,
+        'total_requests': total,
+        'throughput_rps': total / elapsed,
+        'double_bookings': duplicate_spots,
+        'inconsistent_spots': mismatched,
+        'routes': routes,
+    }
+
+    print(f'{"route":<28}{"requests":>10}{"errors":>8}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+    for route, stats in routes.items():
+        print(f'{route:<28}{stats["requests"]:>10}{stats["errors"]:>8}{stats["throughput_rps"]:>10.1f}'
+              f'{stats["p50_ms"]:>10.2f}{stats["p95_ms"]:>10.2f}{stats["p99_ms"]:>10.2f}')
+    print(f'total {total} requests, {result["throughput_rps"]:.1f} req/s, '
+          f'{duplicate_spots} double bookings, {mismatched} inconsistent spots')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
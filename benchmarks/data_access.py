@@ -0,0 +1,179 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.booking_lifecycle import percentile, seed
+
+class StatementCounter:
+    # Fed by sqlite3's trace callback, so implicit BEGINs are counted too.
+    # Each statement a trigger runs is reported again with its parent's
+    # text; those run inside the engine, so repeats are not counted.
+    def __init__(self):
+        self.count = 0
+        self.last = None
+
+    def reset(self):
+        self.count = 0
+        self.last = None
+
+    def __call__(self, sql):
+        if sql != self.last:
+            self.count += 1
+            self.last = sql
+
+def active_reservation(database, username):
+    conn = sqlite3.connect(database)
+    row = conn.execute('''
+        SELECT r.id FROM reservations r JOIN users u ON r.user_id = u.id
+        WHERE u.username = ? AND r.status = "active" ORDER BY r.id DESC LIMIT 1
+    ''', (username,)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+SPOT_MAP_QUERY = '''
+    SELECT ps.id, ps.lot_id, ps.status, ps.level, ps.zone, ps.ev_capable, r.user_id, u.username, r.parking_timestamp
+    FROM parking_spots ps
+    LEFT JOIN reservations r ON ps.id = r.spot_id AND r.status = "active"
+    LEFT JOIN users u ON r.user_id = u.id
+    WHERE ps.lot_id = ?
+'''
+
+def row_footprint(database, lot_id, row_factory):
+    # Bytes held per fetched row of a lot's spot map.
+    conn = sqlite3.connect(database)
+    tracemalloc.start()
+    cursor = conn.execute(SPOT_MAP_QUERY, (lot_id,))
+    cursor.row_factory = row_factory
+    before = tracemalloc.get_traced_memory()[0]
+    rows = cursor.fetchall()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    conn.close()
+    return held / max(1, len(rows))
+
+def measure(client, counter, method, path, data=None):
+    counter.reset()
+    tracemalloc.reset_peak()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    response = client.open(path, method=method, data=data)
+    response.get_data()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - start_memory
+    response.close()
+    return response.status_code, counter.count, peak, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Count SQL statements, peak allocations and latency per request.')
+    parser.add_argument('--lots', type=int, default=20)
+    parser.add_argument('--spots-per-lot', type=int, default=500)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--history', type=int, default=20000)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write results as JSON to this file.')
+    parser.add_argument('--baseline', help='Compare against a previous JSON result.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='parking-data-access-')
+    os.chdir(workdir)
+    database = os.path.join(workdir, 'parking_app.db')
+    lot_ids, _ = seed(database, args.lots, args.spots_per_lot, args.users, args.history, rng)
+
+    # Leave metrics out of the timings, and hash inline so login cost is
+    # not hidden in a worker process.
+    os.environ['METRICS_ENABLED'] = '0'
+    os.environ['PASSWORD_HASH_WORKERS'] = '0'
+    os.environ['API_CACHE_TTL'] = '0'
+    os.environ['BOOKING_RATE'] = '0'
+    os.environ['PRICING_INTERVAL'] = '0'
+    import app as parking_app
+    from models import pool
+    counter = StatementCounter()
+    connect = pool.ConnectionPool._connect
+    def traced_connect(self):
+        conn = connect(self)
+        conn.set_trace_callback(counter)
+        return conn
+    pool.ConnectionPool._connect = traced_connect
+
+    user = parking_app.app.test_client()
+    user.post('/login', data={'username': 'bench0', 'password': 'bench'})
+    admin = parking_app.app.test_client()
+    admin.post('/login', data={'username': 'admin', 'password': 'admin123'})
+
+    samples = {}
+    def record(route, result):
+        status, statements, peak, elapsed = result
+        entry = samples.setdefault(route, {'statements': [], 'peak_bytes': [], 'latency': [], 'errors': 0})
+        entry['statements'].append(statements)
+        entry['peak_bytes'].append(peak)
+        entry['latency'].append(elapsed)
+        if status >= 400:
+            entry['errors'] += 1
+
+    tracemalloc.start()
+    for _ in range(args.iterations):
+        lot_id = rng.choice(lot_ids)
+        record('POST /user/book_parking', measure(user, counter, 'POST', '/user/book_parking', {'lot_id': lot_id}))
+        record('GET /user/dashboard', measure(user, counter, 'GET', '/user/dashboard'))
+        reservation_id = active_reservation(database, 'bench0')
+        record('GET /user/release_spot', measure(user, counter, 'GET', f'/user/release_spot/{reservation_id}'))
+        record('GET /user/book_parking', measure(user, counter, 'GET', '/user/book_parking'))
+        record('GET /admin/dashboard', measure(admin, counter, 'GET', '/admin/dashboard'))
+        record('GET /admin/view_spots', measure(admin, counter, 'GET', f'/admin/view_spots/{lot_id}'))
+        record('GET /api/v1/lots', measure(admin, counter, 'GET', '/api/v1/lots'))
+    tracemalloc.stop()
+
+    routes = {}
+    for route, entry in samples.items():
+        routes[route] = {
+            'requests': len(entry['latency']),
+            'errors': entry['errors'],
+            'statements': sum(entry['statements']) / len(entry['statements']),
+            'peak_kib': sum(entry['peak_bytes']) / len(entry['peak_bytes']) / 1024,
+            'p50_ms': percentile(entry['latency'], 0.50) * 1000,
+            'p95_ms': percentile(entry['latency'], 0.95) * 1000,
+        }
+    result = {'config': vars(args), 'routes': routes}
+    footprint = {'sqlite3.Row': row_footprint(database, lot_ids[0], sqlite3.Row)}
+    try:
+        from models.records import SpotRecord
+        footprint['SpotRecord'] = row_footprint(database, lot_ids[0], SpotRecord.factory)
+    except ImportError:
+        pass
+    result['bytes_per_row'] = footprint
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f).get('routes', {})
+
+    print(f'{"route":<26}{"stmts":>8}{"peak KiB":>10}{"p50 ms":>9}{"p95 ms":>9}{"errors":>8}')
+    for route, stats in routes.items():
+        line = (f'{route:<26}{stats["statements"]:>8.1f}{stats["peak_kib"]:>10.1f}'
+                f'{stats["p50_ms"]:>9.2f}{stats["p95_ms"]:>9.2f}{stats["errors"]:>8}')
+        previous = baseline.get(route)
+        if previous:
+            line += (f'   was {previous["statements"]:.1f} stmts, {previous["peak_kib"]:.1f} KiB,'
+                     f' {previous["p50_ms"]:.2f} ms')
+        print(line)
+    for name, size in footprint.items():
+        print(f'spot map row as {name}: {size:.0f} bytes')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from models import migrations
+from models.pool import ConnectionPool
+from models.provisioning import build_layout, provision_layout
+
+def create_lot(conn, max_spots):
+    cursor = conn.execute('INSERT INTO parking_lots (prime_location_name, price, address, pin_code, maximum_number_of_spots) VALUES (?, ?, ?, ?, ?)',
+                          ('Benchmark Garage', 50.0, 'Benchmark Road', '600001', max_spots))
+    return cursor.lastrowid
+
+def per_row(conn, max_spots, levels, ev_spots):
+    lot_id = create_lot(conn, max_spots)
+    for i in range(max_spots):
+        conn.execute('INSERT INTO parking_spots (lot_id) VALUES (?)', (lot_id,))
+    conn.commit()
+
+def bulk(conn, max_spots, levels, ev_spots):
+    lot_id = create_lot(conn, max_spots)
+    provision_layout(conn, lot_id, build_layout(max_spots, levels, ev_spots))
+    conn.commit()
+
+def run(strategy, max_spots, levels, ev_spots, repeat):
+    timings = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as tmp:
+            pool = ConnectionPool(os.path.join(tmp, 'bench.db'))
+            conn = pool.acquire()
+            migrations.migrate(conn)
+            start = time.perf_counter()
+            strategy(conn, max_spots, levels, ev_spots)
+            timings.append(time.perf_counter() - start)
+            conn.close()
+            pool.close_all()
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-row and bulk spot provisioning.')
+    parser.add_argument('--spots', type=int, default=20000)
+    parser.add_argument('--levels', type=int, default=8)
+    parser.add_argument('--ev-spots', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for name, strategy in (('per-row', per_row), ('bulk', bulk)):
+        elapsed = run(strategy, args.spots, args.levels, args.ev_spots, args.repeat)
+        print(f'{name:>8}: {args.spots} spots in {elapsed * 1000:.1f} ms '
+              f'({args.spots / elapsed:,.0f} spots/s)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.booking_lifecycle import percentile, seed
+
+def churn(parking_app, lot_ids, user_ids, operations, rng):
+    # Books and releases in turn around half occupancy; returns the latency
+    # of every write.
+    from models.database import ParkingSpot, Reservation
+    held = []
+    latencies = []
+    for _ in range(operations):
+        with parking_app.app.app_context():
+            started = time.perf_counter()
+            if held and (len(held) > 50 or rng.random() < 0.5):
+                reservation_id, user_id = held.pop(rng.randrange(len(held)))
+                Reservation.release_reservation(reservation_id, user_id)
+            else:
+                user_id = rng.choice(user_ids)
+                booking = ParkingSpot.book_spot(rng.choice(lot_ids), user_id)
+                if booking:
+                    held.append((booking[1], user_id))
+            latencies.append(time.perf_counter() - started)
+    return latencies
+
+def latency_summary(latencies):
+    return {
+        'operations': len(latencies),
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+    }
+
+def rescan(conn):
+    # What rebuilding the same state costs without the log: every lot's
+    # counters checked against its spots and every free list reloaded.
+    # The usage rollups are refolded from the reservations either way, so
+    # that is timed on its own.
+    from models import counters, rollups
+    from models.allocator import SpotAllocator
+    started = time.perf_counter()
+    counters.find_drift(conn)
+    SpotAllocator().load(conn)
+    scanned = time.perf_counter()
+    rollups.run_rollup(conn, rebuild=True)
+    return scanned - started, time.perf_counter() - scanned
+
+def replay(conn):
+    from models.eventlog import event_log
+    started = time.perf_counter()
+    conn.execute('BEGIN')
+    try:
+        state = event_log.replay(conn, 0)
+    finally:
+        conn.rollback()
+    return time.perf_counter() - started, state
+
+def compare(result, baseline, threshold):
+    regressions = []
+    checks = {
+        'logged write p50 ms': (baseline.get('logged', {}).get('p50_ms'), result['logged']['p50_ms']),
+        'replay s': (baseline.get('replay_s'), result['replay_s']),
+    }
+    for name, (before, after) in checks.items():
+        if before and after > before * (1 + threshold):
+            regressions.append(f'{name}: {before:.3f} -> {after:.3f}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure event log overhead on writes and replay against a rescan.')
+    parser.add_argument('--lots', type=int, default=20)
+    parser.add_argument('--spots-per-lot', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--history', type=int, default=200000, help='Completed reservations to seed.')
+    parser.add_argument('--operations', type=int, default=5000, help='Bookings and releases per phase.')
+    parser.add_argument('--fsync', action='store_true', help='fsync the log on every write.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write results as JSON to this file.')
+    parser.add_argument('--baseline', help='Compare against a previous JSON result.')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Allowed regression, as a fraction.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='parking-replay-')
+    # The app resolves its database relative to the working directory.
+    os.chdir(workdir)
+    database = os.path.join(workdir, 'parking_app.db')
+    started = time.perf_counter()
+    lot_ids, users = seed(database, args.lots, args.spots_per_lot, args.users, args.history, rng)
+    print(f'Seeded {args.lots} lots x {args.spots_per_lot} spots, {users} users, '
+          f'{args.history} reservations in {time.perf_counter() - started:.1f}s ({workdir})')
+
+    os.environ.update(BOOKING_RATE='0', METRICS_ENABLED='0', WARMUP_ENABLED='0', PRICING_INTERVAL='0',
+                      EVENT_LOG_FSYNC='1' if args.fsync else '0')
+    import app as parking_app
+    from models.eventlog import event_log
+    from models.shards import shard_map
+    parking_app.init_database()
+    with parking_app.app.app_context():
+        user_ids = [row[0] for row in shard_map.connection(0).execute('SELECT id FROM users WHERE username != "admin"')]
+
+    # Unlogged writes first; the checkpoint after them starts the log afresh.
+    event_log.enabled = False
+    unlogged = churn(parking_app, lot_ids, user_ids, args.operations, rng)
+    event_log.enabled = True
+    with parking_app.app.app_context():
+        started = time.perf_counter()
+        checkpointed = event_log.checkpoint(shard_map.connection(0), 0).lsn
+        checkpoint_s = time.perf_counter() - started
+    logged = churn(parking_app, lot_ids, user_ids, args.operations, rng)
+
+    with parking_app.app.app_context():
+        conn = shard_map.connection(0)
+        replay_s, state = replay(conn)
+        rescan_s, rollup_s = rescan(conn)
+    log_bytes = sum(os.path.getsize(event_log.shard(0).segment_path(segment))
+                    for segment in event_log.shard(0).segments())
+
+    result = {
+        'config': vars(args),
+        'unlogged': latency_summary(unlogged),
+        'logged': latency_summary(logged),
+        'events': state.lsn - checkpointed,
+        'log_bytes': log_bytes,
+        'checkpoint_s': checkpoint_s,
+        'replay_s': replay_s,
+        'rescan_s': rescan_s,
+        'rollup_rebuild_s': rollup_s,
+    }
+    print(f'{"writes":<12}{"ops":>8}{"p50 ms":>10}{"p95 ms":>10}')
+    for name in ('unlogged', 'logged'):
+        stats = result[name]
+        print(f'{name:<12}{stats["operations"]:>8}{stats["p50_ms"]:>10.3f}{stats["p95_ms"]:>10.3f}')
+    print(f'{result["events"]} events in {log_bytes} bytes; checkpoint {checkpoint_s * 1000:.1f} ms, '
+          f'replay {replay_s * 1000:.1f} ms; rescan {rescan_s * 1000:.1f} ms plus {rollup_s * 1000:.1f} ms '
+          f'to rebuild the rollups')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def configure(workdir, shards, synchronous):
+    # The app reads its settings at import, so set them first.
+    os.chdir(workdir)
+    os.environ['DATABASE_SHARDS'] = str(shards)
+    os.environ['DATABASE_SYNCHRONOUS'] = synchronous
+    os.environ['METRICS_ENABLED'] = '0'
+    os.environ['PASSWORD_HASH_WORKERS'] = '0'
+    os.environ['API_CACHE_TTL'] = '0'
+
+def seed(workdir, shards, synchronous, lots, spots_per_lot, users):
+    configure(workdir, shards, synchronous)
+    import app as parking_app
+    from models.database import ParkingLot, User
+    parking_app.init_database()
+    with parking_app.app.app_context():
+        lot_ids = [ParkingLot.create_lot(f'Bench {i}', 10.0, 'Bench road', f'{600000 + i}', spots_per_lot)
+                   for i in range(lots)]
+        user_ids = [User.create_user(f'shard{i}', 'x', None, None) for i in range(users)]
+    return lot_ids, user_ids
+
+def worker(workdir, shards, synchronous, lot_ids, user_id, seed_value, start_at, deadline, results):
+    configure(workdir, shards, synchronous)
+    import app as parking_app
+    from models.database import ParkingSpot, Reservation
+    rng = random.Random(seed_value)
+    held = []
+    writes = 0
+    failed = 0
+    while time.time() < start_at:
+        time.sleep(0.001)
+    while time.time() < deadline:
+        with parking_app.app.app_context():
+            if len(held) < 4:
+                booking = ParkingSpot.book_spot(rng.choice(lot_ids), user_id)
+                if booking:
+                    held.append(booking[1])
+                else:
+                    failed += 1
+            else:
+                if Reservation.release_reservation(held.pop(rng.randrange(len(held))), user_id) is None:
+                    failed += 1
+            writes += 1
+    results.put((writes, failed))
+
+def run(shards, args):
+    workdir = tempfile.mkdtemp(prefix=f'parking-shards-{shards}-')
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as setup:
+        lot_ids, user_ids = setup.apply(seed, (workdir, shards, args.synchronous, args.lots,
+                                               args.spots_per_lot, args.workers))
+
+    results = context.Queue()
+    # Workers start together once they have all imported the app.
+    start_at = time.time() + args.warmup
+    deadline = start_at + args.duration
+    processes = [context.Process(target=worker, args=(workdir, shards, args.synchronous, lot_ids, user_ids[i],
+                                                      args.seed + i, start_at, deadline, results))
+                 for i in range(args.workers)]
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    writes = sum(total[0] for total in totals)
+    return {
+        'shards': shards,
+        'writes': writes,
+        'failed': sum(total[1] for total in totals),
+        'writes_per_s': writes / args.duration,
+        'workdir': workdir,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure booking/release write throughput per shard count.')
+    parser.add_argument('--shards', default='1,2,4', help='Comma-separated shard counts to compare.')
+    parser.add_argument('--workers', type=int, default=8, help='Writer processes.')
+    parser.add_argument('--lots', type=int, default=16)
+    parser.add_argument('--spots-per-lot', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds of traffic per shard count.')
+    parser.add_argument('--warmup', type=float, default=3.0, help='Seconds allowed for workers to start.')
+    parser.add_argument('--synchronous', default='NORMAL', help='PRAGMA synchronous for every shard.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write results as JSON to this file.')
+    args = parser.parse_args()
+
+    results = [run(int(shards), args) for shards in args.shards.split(',')]
+    base = results[0]['writes_per_s'] or 1
+    print(f'{"shards":>8}{"writes":>10}{"failed":>8}{"writes/s":>11}{"speedup":>9}')
+    for result in results:
+        print(f'{result["shards"]:>8}{result["writes"]:>10}{result["failed"]:>8}'
+              f'{result["writes_per_s"]:>11.1f}{result["writes_per_s"] / base:>9.2f}')
+    print(f'{os.cpu_count()} CPUs; with fewer CPUs than workers the run is CPU-bound and cannot show scaling.')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
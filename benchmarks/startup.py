@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Runs in the worker process. Eager start-up is what "python app.py" used
+# to do before serving: migrate, then load every lot's free spots.
+SERVE = '''
+import logging
+import sys
+from werkzeug.serving import make_server
+logging.getLogger('werkzeug').setLevel(logging.ERROR)
+import app as parking_app
+if sys.argv[1] == 'eager':
+    parking_app.init_database()
+    with parking_app.app.app_context():
+        parking_app.warm_booking_state()
+    parking_app.app.config['WARMUP_ENABLED'] = False
+server = make_server('127.0.0.1', 0, parking_app.app, threaded=True)
+print(server.server_port, flush=True)
+server.serve_forever()
+'''
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+def seed(database, lots, spots_per_lot, rng):
+    from models import migrations
+    from models.provisioning import build_layout, provision_layout
+
+    conn = sqlite3.connect(database)
+    migrations.migrate(conn)
+    for i in range(lots):
+        cursor = conn.execute('INSERT INTO parking_lots (prime_location_name, price, address, pin_code, maximum_number_of_spots) VALUES (?, ?, ?, ?, ?)',
+                              (f'Bench Lot {i}', rng.choice([20.0, 40.0, 60.0]), f'{i} Bench Road', f'{600000 + i}', spots_per_lot))
+        provision_layout(conn, cursor.lastrowid, build_layout(spots_per_lot, levels=max(1, spots_per_lot // 500)))
+    conn.commit()
+    conn.close()
+
+def get(url):
+    started = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=30) as response:
+        response.read()
+    return time.perf_counter() - started
+
+def start_worker(workdir, mode, path, interval):
+    env = dict(os.environ, PYTHONPATH=ROOT, METRICS_ENABLED='0', PASSWORD_HASH_WORKERS='0')
+    spawned = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', SERVE, mode], cwd=workdir, env=env,
+                               stdout=subprocess.PIPE, text=True)
+    try:
+        port = int(process.stdout.readline())
+        listening = time.perf_counter()
+        url = f'http://127.0.0.1:{port}{path}'
+        while True:
+            try:
+                first_latency = get(url)
+                break
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(interval)
+        first_response = time.perf_counter()
+        second_latency = get(url)
+    finally:
+        process.terminate()
+        process.wait()
+    return {
+        'listening_ms': (listening - spawned) * 1000,
+        'first_request_ms': (first_response - spawned) * 1000,
+        'first_latency_ms': first_latency * 1000,
+        'second_latency_ms': second_latency * 1000,
+    }
+
+def summarise(samples):
+    summary = {}
+    for key in samples[0]:
+        values = [sample[key] for sample in samples]
+        summary[key] = {'p50': percentile(values, 0.5), 'max': max(values)}
+    return summary
+
+def compare(result, baseline, threshold):
+    regressions = []
+    for scenario, current in result['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if not previous:
+            continue
+        before, after = previous['first_request_ms']['p50'], current['first_request_ms']['p50']
+        if before and after > before * (1 + threshold):
+            regressions.append(f'{scenario}: time to first request {before:.1f} ms -> {after:.1f} ms')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure how long a new worker takes to answer its first request.')
+    parser.add_argument('--lots', type=int, default=50)
+    parser.add_argument('--spots-per-lot', type=int, default=2000)
+    parser.add_argument('--runs', type=int, default=5, help='Workers started per scenario.')
+    parser.add_argument('--path', default='/api/v1/lots', help='URL path of the first request.')
+    parser.add_argument('--poll-interval', type=float, default=0.005)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write results as JSON to this file.')
+    parser.add_argument('--baseline', help='Compare against a previous JSON result.')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Allowed regression, as a fraction.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    seeded = tempfile.mkdtemp(prefix='parking-startup-')
+    seed(os.path.join(seeded, 'parking_app.db'), args.lots, args.spots_per_lot, rng)
+
+    # cold: a fresh database the first request has to create.
+    # lazy / eager: a current schema, with the lot state loaded in the
+    # background after the first request, or before the worker listens.
+    scenarios = {'cold': [], 'lazy': [], 'eager': []}
+    for _ in range(args.runs):
+        for scenario, samples in scenarios.items():
+            workdir = tempfile.mkdtemp(prefix='parking-startup-cold-') if scenario == 'cold' else seeded
+            samples.append(start_worker(workdir, 'eager' if scenario == 'eager' else 'lazy',
+                                        args.path, args.poll_interval))
+
+    result = {'config': vars(args), 'scenarios': {name: summarise(samples) for name, samples in scenarios.items()}}
+    print(f'{"scenario":<10}{"listening ms":>14}{"first req ms":>14}{"first lat ms":>14}{"second lat ms":>15}')
+    for name, summary in result['scenarios'].items():
+        print(f'{name:<10}{summary["listening_ms"]["p50"]:>14.1f}{summary["first_request_ms"]["p50"]:>14.1f}'
+              f'{summary["first_latency_ms"]["p50"]:>14.1f}{summary["second_latency_ms"]["p50"]:>15.1f}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import threading
+import time
+
+from models import eventlog
+from models.eventlog import event_log
+
+DEFAULT_FULL_TTL = 2.0
+LOCK_STRIPES = 64
+
+class SpotAllocator:
+    def __init__(self, full_ttl=DEFAULT_FULL_TTL):
+        self._free = {}
+        self._full_until = {}
+        # A fixed set of locks shared out by lot id, so ids that name no lot
+        # cannot leave locks of their own behind.
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._lock = threading.Lock()
+        self.full_ttl = full_ttl
+
+    def _lot_lock(self, lot_id):
+        return self._locks[hash(lot_id) % LOCK_STRIPES]
+
+    def load(self, *conns):
+        free = {}
+        # Descending order so popitem() hands out the lowest spot id first.
+        for conn in conns:
+            for row in conn.execute('SELECT id, lot_id FROM parking_spots WHERE status = "A" ORDER BY id DESC'):
+                free.setdefault(row['lot_id'], {})[row['id']] = None
+        self._merge(free)
+
+    def seed(self, free):
+        # {lot_id: free spot ids} from somewhere other than a scan, such as
+        # a replay of the event log.
+        self._merge({lot_id: dict.fromkeys(sorted(spot_ids, reverse=True)) for lot_id, spot_ids in free.items()})
+
+    def _merge(self, free):
+        # Lots loaded while the caller gathered free keep their own, newer, lists.
+        with self._lock:
+            for lot_id, spots in free.items():
+                self._free.setdefault(lot_id, spots)
+
+    def load_lot(self, conn, lot_id):
+        # Returns False, keeping nothing for it, if the lot does not exist.
+        rows = conn.execute('''
+            SELECT ps.id FROM parking_lots pl
+            LEFT JOIN parking_spots ps ON ps.lot_id = pl.id AND ps.status = "A"
+            WHERE pl.id = ? ORDER BY ps.id DESC
+        ''', (lot_id,)).fetchall()
+        if not rows:
+            self.reset_lot(lot_id)
+            return False
+        free = dict.fromkeys(row['id'] for row in rows if row['id'] is not None)
+        with self._lot_lock(lot_id):
+            self._free[lot_id] = free
+            if free:
+                self._full_until.pop(lot_id, None)
+        return True
+
+    def reset_lot(self, lot_id):
+        with self._lot_lock(lot_id):
+            self._free.pop(lot_id, None)
+            self._full_until.pop(lot_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._free = {}
+            self._full_until = {}
+
+    def is_loaded(self, lot_id):
+        return lot_id in self._free
+
+    def available(self, lot_id):
+        return len(self._free.get(lot_id, ()))
+
+    def mark_full(self, lot_id):
+        # Only lots loaded from the database, so ids that name no lot
+        # leave no mark behind.
+        with self._lot_lock(lot_id):
+            if lot_id in self._free:
+                self._full_until[lot_id] = time.monotonic() + self.full_ttl
+
+    def known_full(self, lot_id):
+        # True while a walk-in booking recently found no room in the lot, or
+        # this worker's free list for it has run dry, and no spot has been
+        # freed here since. Spots freed by other processes are picked up
+        # once the mark expires: the next booking then reloads the lot.
+        now = time.monotonic()
+        until = self._full_until.get(lot_id)
+        if until is not None:
+            return until > now
+        if lot_id in self._free and not self._free[lot_id]:
+            self._full_until[lot_id] = now + self.full_ttl
+            return True
+        return False
+
+    def acquire(self, lot_id):
+        with self._lot_lock(lot_id):
+            free = self._free.get(lot_id)
+            if not free:
+                return None
+            return free.popitem()[0]
+
+    def acquire_many(self, lot_id, count, adjacent=False):
+        with self._lot_lock(lot_id):
+            free = self._free.get(lot_id)
+            if not free:
+                return []
+            if not adjacent:
+                return [free.popitem()[0] for _ in range(min(count, len(free)))]
+            # Lowest run of consecutive spot numbers long enough for the batch.
+            ordered = sorted(free)
+            for end in range(count - 1, len(ordered)):
+                if ordered[end] - ordered[end - count + 1] == count - 1:
+                    run = ordered[end - count + 1:end + 1]
+                    for spot_id in run:
+                        del free[spot_id]
+                    return run
+            return []
+
+    def release(self, lot_id, spot_id):
+        with self._lot_lock(lot_id):
+            self._full_until.pop(lot_id, None)
+            free = self._free.get(lot_id)
+            if free is not None:
+                free[spot_id] = None
+
+    def book(self, conn, lot_id, user_id, price_multiplier=1.0):
+        if not self.is_loaded(lot_id) and not self.load_lot(conn, lot_id):
+            return None
+        reloaded = False
+        while True:
+            spot_id = self.acquire(lot_id)
+            if spot_id is None:
+                # Another process may have freed spots we have not seen yet.
+                if reloaded:
+                    return None
+                self.load_lot(conn, lot_id)
+                reloaded = True
+                continue
+
+            try:
+                # One statement books the spot: the insert only happens while
+                # the spot is still free, a trigger marks it occupied, and the
+                # stay records the hourly rate it was booked at.
+                row = conn.execute('''
+                    INSERT INTO reservations (spot_id, user_id, hourly_price)
+                    SELECT ps.id, ?, ROUND(pl.price * ?, 2) FROM parking_spots ps
+                    JOIN parking_lots pl ON ps.lot_id = pl.id
+                    WHERE ps.id = ? AND ps.lot_id = ? AND ps.status = "A"
+                    RETURNING id, parking_timestamp, hourly_price
+                ''', (user_id, price_multiplier, spot_id, lot_id)).fetchone()
+                if row is None:
+                    # Stale entry: the spot was taken or removed elsewhere.
+                    conn.rollback()
+                    continue
+                event_log.record(conn, [eventlog.booked(lot_id, spot_id, row[0], user_id, row[1], row[2])])
+                conn.commit()
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                self.release(lot_id, spot_id)
+                raise
+            return spot_id, row[0]
+
+    def claim_many(self, conn, lot_id, count, adjacent=False):
+        # Claims up to count spots inside the caller's open transaction and
+        # returns their ids. The caller inserts their reservations, which
+        # marks them occupied, then commits, or rolls back and releases.
+        if not self.is_loaded(lot_id) and not self.load_lot(conn, lot_id):
+            return []
+        claimed = []
+        reloaded = False
+        while len(claimed) < count:
+            spot_ids = self.acquire_many(lot_id, count - len(claimed), adjacent)
+            if not spot_ids:
+                if reloaded:
+                    break
+                self.load_lot(conn, lot_id)
+                reloaded = True
+                continue
+
+            placeholders = ','.join('?' * len(spot_ids))
+            # Entries that are no longer free were taken elsewhere and are dropped.
+            fresh = [row[0] for row in conn.execute(
+                f'SELECT id FROM parking_spots WHERE id IN ({placeholders}) AND lot_id = ? AND status = "A"',
+                (*spot_ids, lot_id))]
+            if adjacent and len(fresh) < len(spot_ids):
+                for spot_id in fresh:
+                    self.release(lot_id, spot_id)
+                if reloaded:
+                    break
+                self.load_lot(conn, lot_id)
+                reloaded = True
+                continue
+            claimed.extend(fresh)
+        return claimed
+
+spot_allocator = SpotAllocator()
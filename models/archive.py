@@ -0,0 +1,114 @@
+import os
+from datetime import datetime, timedelta
+
+from models import rollups
+
+ARCHIVE_SCHEMA = 'archive'
+
+HISTORY_COLUMNS = '''
+    r.id, r.spot_id, r.user_id, r.parking_timestamp, r.leaving_timestamp, r.parking_cost, r.status
+'''
+
+def is_attached(conn):
+    return any(row[1] == ARCHIVE_SCHEMA for row in conn.execute('PRAGMA database_list'))
+
+def attach_archive(conn, path, create=False):
+    if is_attached(conn):
+        return True
+    if not create and not os.path.exists(path):
+        return False
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (path,))
+    if create:
+        conn.execute(f'PRAGMA {ARCHIVE_SCHEMA}.journal_mode = WAL')
+        # Cold rows carry the lot details they were billed under, so history
+        # still reads correctly after a lot is edited or deleted.
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.reservations (
+                id INTEGER PRIMARY KEY,
+                spot_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                lot_id INTEGER,
+                prime_location_name TEXT,
+                price REAL,
+                parking_timestamp TIMESTAMP,
+                leaving_timestamp TIMESTAMP,
+                parking_cost REAL,
+                status TEXT,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute(f'''
+            CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_archive_user_time
+            ON reservations (user_id, parking_timestamp)
+        ''')
+    return True
+
+def archive_reservations(conn, path, older_than_days=90, chunk_size=5000, require_rollup=True):
+    attach_archive(conn, path, create=True)
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime('%Y-%m-%d %H:%M:%S')
+    if require_rollup:
+        # Never archive rows the usage rollups have not folded in yet.
+        watermark_timestamp, _ = rollups.get_watermark(conn)
+        cutoff = min(cutoff, watermark_timestamp)
+
+    moved = 0
+    after = 0
+    while True:
+        ids = [row[0] for row in conn.execute('''
+            SELECT id FROM main.reservations
+            WHERE id > ? AND status = "completed" AND leaving_timestamp < ?
+            ORDER BY id LIMIT ?
+        ''', (after, cutoff, chunk_size))]
+        if not ids:
+            break
+        after = ids[-1]
+        placeholders = ','.join('?' * len(ids))
+
+        # Copy then delete in separate transactions: WAL does not make a
+        # transaction atomic across attached files, and a crash in between
+        # only leaves a duplicate that the next run cleans up.
+        conn.execute(f'''
+            INSERT OR IGNORE INTO {ARCHIVE_SCHEMA}.reservations
+                (id, spot_id, user_id, lot_id, prime_location_name, price,
+                 parking_timestamp, leaving_timestamp, parking_cost, status)
+            SELECT r.id, r.spot_id, r.user_id, ps.lot_id, pl.prime_location_name, COALESCE(r.hourly_price, pl.price),
+                   r.parking_timestamp, r.leaving_timestamp, r.parking_cost, r.status
+            FROM main.reservations r
+            LEFT JOIN main.parking_spots ps ON r.spot_id = ps.id
+            LEFT JOIN main.parking_lots pl ON ps.lot_id = pl.id
+            WHERE r.id IN ({placeholders})
+        ''', ids)
+        conn.commit()
+        moved += conn.execute(f'''
+            DELETE FROM main.reservations
+            WHERE id IN ({placeholders})
+              AND id IN (SELECT id FROM {ARCHIVE_SCHEMA}.reservations WHERE id IN ({placeholders}))
+        ''', ids + ids).rowcount
+        conn.commit()
+    return moved
+
+def user_history(conn, path, user_id, limit=10):
+    hot = f'''
+        SELECT {HISTORY_COLUMNS}, ps.id as spot_number, pl.prime_location_name,
+               COALESCE(r.hourly_price, pl.price) AS price
+        FROM main.reservations r
+        JOIN main.parking_spots ps ON r.spot_id = ps.id
+        JOIN main.parking_lots pl ON ps.lot_id = pl.id
+        WHERE r.user_id = ? AND r.status = "completed"
+    '''
+    if not attach_archive(conn, path):
+        return conn.execute(hot + ' ORDER BY r.parking_timestamp DESC LIMIT ?', (user_id, limit)).fetchall()
+
+    # UNION rather than UNION ALL so a row caught mid-archive shows once.
+    return conn.execute(f'''
+        SELECT * FROM (
+            {hot}
+            UNION
+            SELECT {HISTORY_COLUMNS}, r.spot_id as spot_number, r.prime_location_name, r.price
+            FROM {ARCHIVE_SCHEMA}.reservations r
+            WHERE r.user_id = ?
+        )
+        ORDER BY parking_timestamp DESC LIMIT ?
+    ''', (user_id, user_id, limit)).fetchall()
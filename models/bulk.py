@@ -0,0 +1,265 @@
+import csv
+import io
+import itertools
+import json
+
+from models import archive
+from models.provisioning import build_layout, provision_layout
+from services.hashing import password_hasher
+
+FORMATS = ('csv', 'ndjson')
+KINDS = ('lots', 'users', 'reservations')
+
+EXPORT_COLUMNS = {
+    'lots': ['id', 'prime_location_name', 'price', 'address', 'pin_code', 'maximum_number_of_spots',
+             'total_spots', 'available_spots', 'occupied_spots', 'tariff', 'created_at'],
+    # Password hashes never leave the database.
+    'users': ['id', 'username', 'email', 'phone', 'created_at'],
+    'reservations': ['id', 'spot_id', 'lot_id', 'user_id', 'parking_timestamp', 'leaving_timestamp',
+                     'parking_cost', 'status'],
+}
+
+EXPORT_QUERIES = {
+    'lots': '''
+        SELECT id, prime_location_name, price, address, pin_code, maximum_number_of_spots,
+               total_spots, available_spots, occupied_spots, tariff, created_at
+        FROM parking_lots WHERE id > ? ORDER BY id LIMIT ?
+    ''',
+    'users': '''
+        SELECT id, username, email, phone, created_at
+        FROM users WHERE id > ? AND username != "admin" ORDER BY id LIMIT ?
+    ''',
+    'reservations': '''
+        SELECT r.id, r.spot_id, ps.lot_id, r.user_id, r.parking_timestamp, r.leaving_timestamp,
+               r.parking_cost, r.status
+        FROM main.reservations r
+        LEFT JOIN main.parking_spots ps ON r.spot_id = ps.id
+        WHERE r.id > ? ORDER BY r.id LIMIT ?
+    ''',
+}
+
+ARCHIVED_RESERVATIONS = f'''
+    SELECT id, spot_id, lot_id, user_id, parking_timestamp, leaving_timestamp, parking_cost, status
+    FROM {archive.ARCHIVE_SCHEMA}.reservations WHERE id > ? ORDER BY id LIMIT ?
+'''
+
+def _keyset(conn, sql, chunk_size):
+    after = 0
+    while True:
+        rows = conn.execute(sql, (after, chunk_size)).fetchall()
+        if not rows:
+            return
+        yield from rows
+        after = rows[-1][0]
+
+def iter_rows(conn, kind, chunk_size=5000, archive_path=None):
+    if kind == 'reservations' and archive_path and archive.attach_archive(conn, archive_path):
+        # Archived rows are the oldest, so finance gets history in order.
+        yield from _keyset(conn, ARCHIVED_RESERVATIONS, chunk_size)
+    yield from _keyset(conn, EXPORT_QUERIES[kind], chunk_size)
+
+def encode_csv(columns, rows, batch_size=1000):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    pending = 0
+    for row in rows:
+        writer.writerow(tuple(row))
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+def encode_ndjson(columns, rows, batch_size=1000):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row)), separators=(',', ':')))
+        if len(lines) >= batch_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def export_stream(sources, kind, fmt, chunk_size=5000):
+    # sources are (conn, archive_path) pairs, one per shard, read in turn.
+    # Shards own disjoint id ranges, so rows stay in id order per source.
+    columns = EXPORT_COLUMNS[kind]
+    encode = encode_csv if fmt == 'csv' else encode_ndjson
+    return encode(columns, itertools.chain.from_iterable(
+        iter_rows(conn, kind, chunk_size, archive_path) for conn, archive_path in sources))
+
+def read_records(stream, fmt):
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def _chunks(records, chunk_size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _value(record, name, convert=str, default=None, required=False):
+    value = record.get(name)
+    if value is None or value == '':
+        if required:
+            raise ValueError(f'missing {name}')
+        return default
+    return convert(value)
+
+def _lot_row(record):
+    max_spots = _value(record, 'maximum_number_of_spots', int, required=True)
+    levels = _value(record, 'levels', int, 1)
+    ev_spots = _value(record, 'ev_spots', int, 0)
+    if max_spots < 0 or levels < 1 or ev_spots < 0:
+        raise ValueError('spot counts must not be negative')
+    row = (_value(record, 'prime_location_name', required=True),
+           _value(record, 'price', float, required=True),
+           _value(record, 'address', required=True),
+           _value(record, 'pin_code', required=True),
+           max_spots,
+           _value(record, 'tariff'))
+    return row, build_layout(max_spots, levels, ev_spots, _value(record, 'zone'))
+
+def _import_lots(conn, chunk):
+    rows = [_lot_row(record) for record in chunk]
+    last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM parking_lots').fetchone()[0]
+    conn.executemany('''
+        INSERT INTO parking_lots (prime_location_name, price, address, pin_code, maximum_number_of_spots, tariff)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (row for row, _ in rows))
+    # AUTOINCREMENT ids are handed out in insert order inside the transaction.
+    lot_ids = [row[0] for row in conn.execute('SELECT id FROM parking_lots WHERE id > ? ORDER BY id', (last_id,))]
+    for lot_id, (_, layout) in zip(lot_ids, rows):
+        provision_layout(conn, lot_id, layout)
+    return len(rows)
+
+def _user_row(record):
+    return (_value(record, 'username', required=True), _value(record, 'password_hash'),
+            _value(record, 'email'), _value(record, 'phone'))
+
+def _user_rows(chunk, password_method):
+    # Plain passwords are hashed a chunk at a time on the hashing pool,
+    # before the chunk takes the write lock.
+    rows = [_user_row(record) for record in chunk]
+    unhashed = [i for i, row in enumerate(rows) if row[1] is None]
+    passwords = [_value(chunk[i], 'password', required=True) for i in unhashed]
+    for i, password_hash in zip(unhashed, password_hasher.hash_many(passwords, password_method)):
+        rows[i] = (rows[i][0], password_hash, *rows[i][2:])
+    return rows
+
+def _import_users(conn, rows):
+    return conn.executemany('INSERT OR IGNORE INTO users (username, password, email, phone) VALUES (?, ?, ?, ?)',
+                            rows).rowcount
+
+def _reservation_row(record):
+    status = _value(record, 'status', default='completed')
+    if status != 'completed':
+        raise ValueError('only completed reservations can be imported')
+    return (_value(record, 'id', int),
+            _value(record, 'spot_id', int, required=True),
+            _value(record, 'user_id', int, required=True),
+            _value(record, 'parking_timestamp', required=True),
+            _value(record, 'leaving_timestamp', required=True),
+            _value(record, 'parking_cost', float))
+
+def _import_reservations(conn, chunk, owns_id=None):
+    rows = [_reservation_row(record) for record in chunk]
+    # Rows keep their id when one is given and it belongs to this shard, so
+    # re-running an import is a no-op. Other rows take an id from the
+    # shard's own range and are matched on user, spot and arrival instead.
+    kept = []
+    renumbered = []
+    for row in rows:
+        if row[0] is not None and (owns_id is None or owns_id(row[0])):
+            kept.append(row)
+        else:
+            renumbered.append(row[1:])
+    imported = conn.executemany('''
+        INSERT OR IGNORE INTO reservations (id, spot_id, user_id, parking_timestamp, leaving_timestamp, parking_cost, status)
+        SELECT ?1, ?2, ?3, ?4, ?5, ?6, 'completed'
+        WHERE EXISTS (SELECT 1 FROM parking_spots WHERE id = ?2)
+          AND EXISTS (SELECT 1 FROM users WHERE id = ?3)
+    ''', kept).rowcount if kept else 0
+    if renumbered:
+        imported += conn.executemany('''
+            INSERT INTO reservations (spot_id, user_id, parking_timestamp, leaving_timestamp, parking_cost, status)
+            SELECT ?1, ?2, ?3, ?4, ?5, 'completed'
+            WHERE EXISTS (SELECT 1 FROM parking_spots WHERE id = ?1)
+              AND EXISTS (SELECT 1 FROM users WHERE id = ?2)
+              AND NOT EXISTS (SELECT 1 FROM reservations
+                              WHERE user_id = ?2 AND status = 'completed' AND parking_timestamp = ?3 AND spot_id = ?1)
+        ''', renumbered).rowcount
+    return imported
+
+def import_records(conn, kind, records, chunk_size=5000, password_method='scrypt', first_line=1, owns_id=None):
+    if conn.in_transaction:
+        conn.commit()
+    imported = 0
+    skipped = 0
+    line = first_line
+    for chunk in _chunks(records, chunk_size):
+        try:
+            users = _user_rows(chunk, password_method) if kind == 'users' else None
+        except (ValueError, TypeError) as exc:
+            raise ValueError(f'Chunk starting at record {line}: {exc}') from exc
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if kind == 'lots':
+                count = _import_lots(conn, chunk)
+            elif kind == 'users':
+                count = _import_users(conn, users)
+            else:
+                count = _import_reservations(conn, chunk, owns_id)
+            conn.commit()
+        except (ValueError, TypeError) as exc:
+            conn.rollback()
+            raise ValueError(f'Chunk starting at record {line}: {exc}') from exc
+        except Exception:
+            conn.rollback()
+            raise
+        imported += count
+        skipped += len(chunk) - count
+        line += len(chunk)
+    return imported, skipped
+
+def _spot_shard(shards, record):
+    try:
+        return shards.shard_of(_value(record, 'spot_id', int, 0))
+    except (ValueError, TypeError):
+        # Left to the import itself to reject with a proper message.
+        return 0
+
+def import_sharded(shards, kind, records, chunk_size=5000, password_method='scrypt'):
+    # Users belong to the main database and an imported batch of lots goes
+    # to the emptiest shard; reservations follow the shard of their spot.
+    if kind == 'users' or shards.count == 1:
+        return import_records(shards.connection(0), kind, records, chunk_size, password_method)
+    if kind == 'lots':
+        return import_records(shards.connection(shards.place_lot()), kind, records, chunk_size, password_method)
+
+    imported = 0
+    skipped = 0
+    line = 1
+    for chunk in _chunks(records, chunk_size):
+        by_shard = {}
+        for record in chunk:
+            by_shard.setdefault(_spot_shard(shards, record), []).append(record)
+        for shard, group in by_shard.items():
+            count, rejected = import_records(shards.connection(shard), kind, group, chunk_size, password_method, line,
+                                             lambda record_id, shard=shard: shards.shard_of(record_id) == shard)
+            imported += count
+            skipped += rejected
+        line += len(chunk)
+    return imported, skipped
@@ -0,0 +1,59 @@
+COUNTS_QUERY = '''
+    SELECT pl.id, pl.total_spots, pl.available_spots, pl.occupied_spots,
+           COUNT(ps.id) AS actual_total,
+           COALESCE(SUM(ps.status = 'A'), 0) AS actual_available,
+           COALESCE(SUM(ps.status = 'O'), 0) AS actual_occupied
+    FROM parking_lots pl
+    LEFT JOIN parking_spots ps ON ps.lot_id = pl.id
+'''
+
+def find_drift(conn, lot_id=None):
+    query = COUNTS_QUERY
+    params = ()
+    if lot_id is not None:
+        query += ' WHERE pl.id = ?'
+        params = (lot_id,)
+    query += ' GROUP BY pl.id'
+    drift = []
+    for row in conn.execute(query, params):
+        stored = (row[1], row[2], row[3])
+        actual = (row[4], row[5], row[6])
+        if stored != actual:
+            drift.append((row[0], stored, actual))
+    return drift
+
+def rebuild_counters(conn, lot_id=None):
+    query = '''
+        UPDATE parking_lots SET
+            total_spots = (SELECT COUNT(*) FROM parking_spots WHERE lot_id = parking_lots.id),
+            available_spots = (SELECT COUNT(*) FROM parking_spots WHERE lot_id = parking_lots.id AND status = 'A'),
+            occupied_spots = (SELECT COUNT(*) FROM parking_spots WHERE lot_id = parking_lots.id AND status = 'O')
+    '''
+    params = ()
+    if lot_id is not None:
+        query += ' WHERE id = ?'
+        params = (lot_id,)
+    return conn.execute(query, params).rowcount
+
+def get_totals(conn):
+    row = conn.execute('''
+        SELECT COALESCE(SUM(total_spots), 0), COALESCE(SUM(available_spots), 0), COALESCE(SUM(occupied_spots), 0)
+        FROM parking_lots
+    ''').fetchone()
+    return row[0], row[1], row[2]
+
+def compare_counts(conn, counts):
+    # Like find_drift, but against counts already known, such as from a
+    # replay of the event log: {lot_id: (total, available, occupied)}.
+    # Lots missing from counts are expected to be empty.
+    drift = []
+    for row in conn.execute('SELECT id, total_spots, available_spots, occupied_spots FROM parking_lots'):
+        stored = (row[1], row[2], row[3])
+        expected = counts.get(row[0], (0, 0, 0))
+        if stored != expected:
+            drift.append((row[0], stored, expected))
+    return drift
+
+def write_counts(conn, drift):
+    conn.executemany('UPDATE parking_lots SET total_spots = ?, available_spots = ?, occupied_spots = ? WHERE id = ?',
+                     ((*expected, lot_id) for lot_id, _, expected in drift))
@@ -1,67 +1,40 @@
-import sqlite3
 from datetime import datetime
 from werkzeug.security import generate_password_hash
+from models import archive, billing, eventlog, fleet, pool, search
+from models.allocator import spot_allocator
+from models.eventlog import event_log
+from models.pricing import price_table
+from models.provisioning import build_layout, provision_layout, resize_lot
+from models.records import (ActiveReservationRecord, LotRecord, SpotRecord, UserRecord, LOT_COLUMNS,
+                            USER_COLUMNS, select)
+from models.schedule import TIME_FORMAT, schedule_index, upcoming
+from models.shards import shard_map
+from services.cache import api_cache
+from services.events import spot_events
 
-DATABASE = 'parking_app.db'
+ARCHIVE_DATABASE = 'parking_archive.db'
+
+pool.add_connect_hook(billing.register_functions)
+
+def event_timestamp():
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
 
 class DatabaseManager:
     @staticmethod
     def get_connection():
-        conn = sqlite3.connect(DATABASE)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return shard_map.connection(0)
+    
+    @staticmethod
+    def get_shard_connection(record_id):
+        # Lots, spots, reservations and schedules live on the shard their id
+        # belongs to; users always live on the main database.
+        return shard_map.connection_for(record_id)
     
     @staticmethod
     def init_database():
+        shard_map.migrate()
         conn = DatabaseManager.get_connection()
         
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                email TEXT,
-                phone TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS parking_lots (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                prime_location_name TEXT NOT NULL,
-                price REAL NOT NULL,
-                address TEXT NOT NULL,
-                pin_code TEXT NOT NULL,
-                maximum_number_of_spots INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS parking_spots (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                lot_id INTEGER NOT NULL,
-                status TEXT DEFAULT 'A',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (lot_id) REFERENCES parking_lots (id)
-            )
-        ''')
-        
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS reservations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                spot_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                parking_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                leaving_timestamp TIMESTAMP,
-                parking_cost REAL,
-                status TEXT DEFAULT 'active',
-                FOREIGN KEY (spot_id) REFERENCES parking_spots (id),
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
         admin_exists = conn.execute('SELECT COUNT(*) FROM users WHERE username = ?', ('admin',)).fetchone()[0]
         if admin_exists == 0:
             admin_password = generate_password_hash('admin123')
@@ -82,10 +55,17 @@ class User:
     @staticmethod
     def get_by_username(username):
         conn = DatabaseManager.get_connection()
-        user_data = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+        user_data = select(conn, UserRecord, f'SELECT {USER_COLUMNS} FROM users WHERE username = ?', (username,)).fetchone()
         conn.close()
         return user_data
     
+    @staticmethod
+    def username_exists(username):
+        conn = DatabaseManager.get_connection()
+        exists = conn.execute('SELECT 1 FROM users WHERE username = ?', (username,)).fetchone() is not None
+        conn.close()
+        return exists
+    
     @staticmethod
     def create_user(username, password_hash, email, phone):
         conn = DatabaseManager.get_connection()
@@ -96,10 +76,17 @@ class User:
         conn.close()
         return user_id
     
+    @staticmethod
+    def update_password(user_id, password_hash):
+        conn = DatabaseManager.get_connection()
+        conn.execute('UPDATE users SET password = ? WHERE id = ?', (password_hash, user_id))
+        conn.commit()
+        conn.close()
+    
     @staticmethod
     def get_all_users():
         conn = DatabaseManager.get_connection()
-        users = conn.execute('SELECT * FROM users WHERE username != "admin"').fetchall()
+        users = select(conn, UserRecord, f'SELECT {USER_COLUMNS} FROM users WHERE username != "admin"').fetchall()
         conn.close()
         return users
 
@@ -113,81 +100,96 @@ class ParkingLot:
         self.max_spots = max_spots
     
     @staticmethod
-    def get_all_lots():
-        conn = DatabaseManager.get_connection()
-        lots = conn.execute('SELECT * FROM parking_lots').fetchall()
-        conn.close()
-        return lots
+    def get_all_lots(after_id=0, limit=-1):
+        return shard_map.merge(shard_map.gather(lambda conn, shard: select(
+            conn, LotRecord, f'SELECT {LOT_COLUMNS} FROM parking_lots WHERE id > ? ORDER BY id LIMIT ?',
+            (after_id, limit)).fetchall()), key=lambda lot: lot.id, limit=limit)
     
     @staticmethod
     def get_lot_by_id(lot_id):
-        conn = DatabaseManager.get_connection()
-        lot = conn.execute('SELECT * FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()
+        conn = DatabaseManager.get_shard_connection(lot_id)
+        lot = select(conn, LotRecord, f'SELECT {LOT_COLUMNS} FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()
         conn.close()
         return lot
     
     @staticmethod
-    def create_lot(name, price, address, pin_code, max_spots):
-        conn = DatabaseManager.get_connection()
+    def get_totals():
+        # (lots, spots, occupied spots, users) for the admin dashboard. The
+        # main database also counts the users, so one query per shard.
+        totals = shard_map.gather(lambda conn, shard: conn.execute('''
+            SELECT COUNT(*), COALESCE(SUM(total_spots), 0), COALESCE(SUM(occupied_spots), 0),
+                   CASE WHEN ? THEN (SELECT COUNT(*) FROM users WHERE username != "admin") ELSE 0 END
+            FROM parking_lots
+        ''', (shard == 0,)).fetchone())
+        return tuple(sum(column) for column in zip(*totals))
+    
+    @staticmethod
+    def search_lots(limit=20, only_available=True, **filters):
+        results = shard_map.gather(lambda conn, shard: search.search_lots(
+            conn, limit=limit, only_available=only_available, **filters))
+        return shard_map.merge(results, key=search.sort_key(filters.get('order')), limit=max(1, min(limit, search.MAX_RESULTS)))
+    
+    @staticmethod
+    def create_lot(name, price, address, pin_code, max_spots, layout=None):
+        conn = shard_map.connection(shard_map.place_lot())
         cursor = conn.execute('INSERT INTO parking_lots (prime_location_name, price, address, pin_code, maximum_number_of_spots) VALUES (?, ?, ?, ?, ?)',
                             (name, price, address, pin_code, max_spots))
         lot_id = cursor.lastrowid
         
-        for i in range(max_spots):
-            conn.execute('INSERT INTO parking_spots (lot_id) VALUES (?)', (lot_id,))
+        provision_layout(conn, lot_id, layout or build_layout(max_spots))
+        event_log.record(conn, [eventlog.resized(conn, lot_id)])
         
         conn.commit()
         conn.close()
+        api_cache.invalidate_lot(lot_id)
         return lot_id
     
     @staticmethod
     def update_lot(lot_id, name, price, address, pin_code, max_spots):
-        conn = DatabaseManager.get_connection()
-        
-        current_spots = conn.execute('SELECT COUNT(*) as count FROM parking_spots WHERE lot_id = ?', (lot_id,)).fetchone()['count']
+        conn = DatabaseManager.get_shard_connection(lot_id)
         
         conn.execute('UPDATE parking_lots SET prime_location_name = ?, price = ?, address = ?, pin_code = ?, maximum_number_of_spots = ? WHERE id = ?',
                     (name, price, address, pin_code, max_spots, lot_id))
         
-        if max_spots > current_spots:
-            for i in range(max_spots - current_spots):
-                conn.execute('INSERT INTO parking_spots (lot_id) VALUES (?)', (lot_id,))
-        elif max_spots < current_spots:
-            spots_to_remove = conn.execute('SELECT id FROM parking_spots WHERE lot_id = ? AND status = "A" LIMIT ?', 
-                                         (lot_id, current_spots - max_spots)).fetchall()
-            for spot in spots_to_remove:
-                conn.execute('DELETE FROM parking_spots WHERE id = ?', (spot['id'],))
+        if resize_lot(conn, lot_id, max_spots):
+            event_log.record(conn, [eventlog.resized(conn, lot_id)])
         
         conn.commit()
         conn.close()
+        spot_allocator.reset_lot(lot_id)
+        api_cache.invalidate_lot(lot_id)
     
     @staticmethod
     def delete_lot(lot_id):
-        conn = DatabaseManager.get_connection()
-        occupied_count = conn.execute('SELECT COUNT(*) as count FROM parking_spots WHERE lot_id = ? AND status = "O"', (lot_id,)).fetchone()['count']
-        
-        if occupied_count == 0:
-            conn.execute('DELETE FROM parking_spots WHERE lot_id = ?', (lot_id,))
-            conn.execute('DELETE FROM parking_lots WHERE id = ?', (lot_id,))
-            conn.commit()
+        conn = DatabaseManager.get_shard_connection(lot_id)
+        lot = conn.execute('SELECT occupied_spots FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()
+        if lot is None:
             conn.close()
-            return True
-        else:
+            raise ValueError('Parking lot not found')
+        if lot['occupied_spots'] > 0:
+            conn.close()
+            raise ValueError('Cannot delete lot with occupied spots')
+        scheduled = conn.execute('SELECT 1 FROM scheduled_reservations WHERE lot_id = ? AND status = "scheduled" AND end_time > ?',
+                                 (lot_id, datetime.now().strftime(TIME_FORMAT))).fetchone()
+        if scheduled:
             conn.close()
-            return False
+            raise ValueError('Cannot delete lot with upcoming scheduled reservations')
+        
+        conn.execute('DELETE FROM parking_spots WHERE lot_id = ?', (lot_id,))
+        conn.execute('DELETE FROM parking_lots WHERE id = ?', (lot_id,))
+        conn.execute('DELETE FROM lot_prices WHERE lot_id = ?', (lot_id,))
+        event_log.record(conn, [eventlog.resized(conn, lot_id)])
+        conn.commit()
+        conn.close()
+        spot_allocator.reset_lot(lot_id)
+        schedule_index.reset_lot(lot_id)
+        api_cache.invalidate_lot(lot_id)
     
     @staticmethod
     def get_lots_with_availability():
-        conn = DatabaseManager.get_connection()
-        lots = conn.execute('''
-            SELECT pl.*, COUNT(ps.id) as available_spots
-            FROM parking_lots pl
-            LEFT JOIN parking_spots ps ON pl.id = ps.lot_id AND ps.status = "A"
-            GROUP BY pl.id
-            HAVING available_spots > 0
-        ''').fetchall()
-        conn.close()
-        return lots
+        return shard_map.merge(shard_map.gather(lambda conn, shard: select(
+            conn, LotRecord, f'SELECT {LOT_COLUMNS} FROM parking_lots WHERE available_spots > 0 ORDER BY id').fetchall()),
+            key=lambda lot: lot.id)
 
 class ParkingSpot:
     def __init__(self, id=None, lot_id=None, status='A'):
@@ -196,28 +198,68 @@ class ParkingSpot:
         self.status = status
     
     @staticmethod
-    def get_spots_by_lot(lot_id):
-        conn = DatabaseManager.get_connection()
-        spots = conn.execute('''
-            SELECT ps.*, r.user_id, u.username, r.parking_timestamp 
-            FROM parking_spots ps 
+    def get_spots_by_lot(lot_id, after_id=0, limit=-1, status=None, level=None, username=None):
+        conn = DatabaseManager.get_shard_connection(lot_id)
+        query = '''
+            SELECT ps.id, ps.lot_id, ps.status, ps.level, ps.zone, ps.ev_capable, r.user_id, u.username, r.parking_timestamp
+            FROM parking_spots ps
             LEFT JOIN reservations r ON ps.id = r.spot_id AND r.status = "active"
-            LEFT JOIN users u ON r.user_id = u.id 
-            WHERE ps.lot_id = ?
-        ''', (lot_id,)).fetchall()
+            LEFT JOIN users u ON r.user_id = u.id
+            WHERE ps.lot_id = ? AND ps.id > ?
+        '''
+        params = [lot_id, after_id]
+        if status:
+            query += ' AND ps.status = ?'
+            params.append(status)
+        if level is not None:
+            query += ' AND ps.level = ?'
+            params.append(level)
+        if username:
+            query += ' AND u.username = ?'
+            params.append(username)
+        query += ' ORDER BY ps.id LIMIT ?'
+        params.append(limit)
+        spots = select(conn, SpotRecord, query, params).fetchall()
+        conn.close()
+        return spots
+    
+    @staticmethod
+    def get_layout(lot_id):
+        conn = DatabaseManager.get_shard_connection(lot_id)
+        spots = conn.execute('SELECT id, status, level, zone, ev_capable FROM parking_spots WHERE lot_id = ? ORDER BY id',
+                             (lot_id,)).fetchall()
         conn.close()
         return spots
     
     @staticmethod
     def get_available_spot(lot_id):
-        conn = DatabaseManager.get_connection()
+        conn = DatabaseManager.get_shard_connection(lot_id)
         spot = conn.execute('SELECT * FROM parking_spots WHERE lot_id = ? AND status = "A" LIMIT 1', (lot_id,)).fetchone()
         conn.close()
         return spot
     
+    @staticmethod
+    def book_spot(lot_id, user_id, username=None):
+        conn = DatabaseManager.get_shard_connection(lot_id)
+        booking = None
+        if schedule_index.walk_in_capacity(conn, lot_id) > 0:
+            booking = spot_allocator.book(conn, lot_id, user_id, price_table.multiplier(lot_id))
+        elif not spot_allocator.is_loaded(lot_id):
+            # Either held for arrivals or not a lot at all; loading tells
+            # the allocator which, so only real lots get the full mark.
+            spot_allocator.load_lot(conn, lot_id)
+        conn.close()
+        if not booking:
+            spot_allocator.mark_full(lot_id)
+        else:
+            api_cache.invalidate_lot(lot_id)
+            spot_events.publish(lot_id, {'spot_id': booking[0], 'status': 'O', 'user_id': user_id, 'username': username,
+                                         'timestamp': event_timestamp()})
+        return booking
+    
     @staticmethod
     def update_spot_status(spot_id, status):
-        conn = DatabaseManager.get_connection()
+        conn = DatabaseManager.get_shard_connection(spot_id)
         conn.execute('UPDATE parking_spots SET status = ? WHERE id = ?', (status, spot_id))
         conn.commit()
         conn.close()
@@ -234,7 +276,7 @@ class Reservation:
     
     @staticmethod
     def create_reservation(spot_id, user_id):
-        conn = DatabaseManager.get_connection()
+        conn = DatabaseManager.get_shard_connection(spot_id)
         cursor = conn.execute('INSERT INTO reservations (spot_id, user_id) VALUES (?, ?)', (spot_id, user_id))
         reservation_id = cursor.lastrowid
         conn.commit()
@@ -243,52 +285,90 @@ class Reservation:
     
     @staticmethod
     def get_active_reservations(user_id):
-        conn = DatabaseManager.get_connection()
-        reservations = conn.execute('''
-            SELECT r.*, ps.id as spot_number, pl.prime_location_name, pl.price
+        results = shard_map.gather(lambda conn, shard: select(conn, ActiveReservationRecord, '''
+            SELECT r.id, r.spot_id, r.parking_timestamp, ps.id as spot_number, pl.prime_location_name,
+                   COALESCE(r.hourly_price, pl.price)
             FROM reservations r
             JOIN parking_spots ps ON r.spot_id = ps.id
             JOIN parking_lots pl ON ps.lot_id = pl.id
             WHERE r.user_id = ? AND r.status = "active"
-        ''', (user_id,)).fetchall()
-        conn.close()
-        return reservations
+        ''', (user_id,)).fetchall())
+        return [reservation for reservations in results for reservation in reservations]
     
     @staticmethod
-    def get_user_history(user_id, limit=10):
-        conn = DatabaseManager.get_connection()
-        history = conn.execute('''
-            SELECT r.*, ps.id as spot_number, pl.prime_location_name, pl.price
-            FROM reservations r
-            JOIN parking_spots ps ON r.spot_id = ps.id
-            JOIN parking_lots pl ON ps.lot_id = pl.id
-            WHERE r.user_id = ? AND r.status = "completed"
-            ORDER BY r.parking_timestamp DESC LIMIT ?
-        ''', (user_id, limit)).fetchall()
-        conn.close()
-        return history
+    def get_user_history(user_id, limit=10, archive_path=ARCHIVE_DATABASE):
+        # Every shard keeps its own archive next to it.
+        results = shard_map.gather(lambda conn, shard: archive.user_history(
+            conn, shard_map.archive_path(archive_path, shard), user_id, limit))
+        return shard_map.merge(results, key=lambda row: row['parking_timestamp'], limit=limit, reverse=True)
     
     @staticmethod
-    def release_reservation(reservation_id, user_id, total_cost):
-        conn = DatabaseManager.get_connection()
-        reservation = conn.execute('SELECT * FROM reservations WHERE id = ? AND user_id = ?', 
-                                  (reservation_id, user_id)).fetchone()
-        
-        if reservation:
-            conn.execute('UPDATE parking_spots SET status = "A" WHERE id = ?', (reservation['spot_id'],))
-            conn.execute('UPDATE reservations SET leaving_timestamp = ?, parking_cost = ?, status = "completed" WHERE id = ?',
-                        (datetime.now(), total_cost, reservation_id))
-            conn.commit()
-            conn.close()
-            return True
-        else:
+    def get_scheduled(user_id):
+        return shard_map.merge(shard_map.gather(lambda conn, shard: upcoming(conn, user_id)),
+                               key=lambda row: row['start_time'])
+    
+    @staticmethod
+    def release_reservation(reservation_id, user_id, username=None, total_cost=None):
+        # Bills and closes the stay in one statement; triggers free the spot
+        # and complete a checked-in schedule. Returns the cost, or None when
+        # the user has no such active reservation.
+        conn = DatabaseManager.get_shard_connection(reservation_id)
+        leaving_timestamp = datetime.now().isoformat(' ')
+        released = conn.execute('''
+            UPDATE reservations
+            SET status = "completed", leaving_timestamp = ?,
+                parking_cost = COALESCE(?, tariff_quote(reservations.parking_timestamp, ?,
+                                                     COALESCE(reservations.hourly_price, pl.price), pl.tariff))
+            FROM parking_spots ps JOIN parking_lots pl ON ps.lot_id = pl.id
+            WHERE reservations.id = ? AND reservations.user_id = ? AND reservations.status = "active"
+              AND ps.id = reservations.spot_id
+            RETURNING spot_id, (SELECT lot_id FROM parking_spots WHERE id = spot_id), parking_cost, parking_timestamp
+        ''', (leaving_timestamp, total_cost, leaving_timestamp, reservation_id, user_id)).fetchall()
+        if not released:
+            conn.rollback()
             conn.close()
-            return False
+            return None
+        spot_id, lot_id, total_cost, parking_timestamp = released[0]
+        event_log.record(conn, [eventlog.released(lot_id, spot_id, reservation_id, user_id, parking_timestamp,
+                                                  leaving_timestamp, total_cost)])
+        conn.commit()
+        conn.close()
+        
+        spot_allocator.release(lot_id, spot_id)
+        api_cache.invalidate_lot(lot_id)
+        spot_events.publish(lot_id, {'spot_id': spot_id, 'status': 'A', 'user_id': user_id, 'username': username,
+                                     'timestamp': event_timestamp()})
+        return total_cost
+    
+    @staticmethod
+    def book_batch(user_id, count, lot_id=None, adjacent=False):
+        if lot_id is not None or shard_map.count == 1:
+            return fleet.book_batch(DatabaseManager.get_shard_connection(lot_id), user_id, count, lot_id, adjacent)
+        # Roomiest shard first; each shard books its part in its own
+        # transaction, and adjacent batches never leave one lot.
+        free = shard_map.gather(lambda conn, shard: conn.execute(
+            'SELECT COALESCE(SUM(available_spots), 0) FROM parking_lots').fetchone()[0])
+        booked = []
+        for shard in sorted(shard_map.shards, key=lambda shard: -free[shard]):
+            booked += fleet.book_batch(shard_map.connection(shard), user_id, count - len(booked), None, adjacent)
+            if len(booked) == count or (adjacent and booked):
+                break
+        return booked
+    
+    @staticmethod
+    def release_batch(user_id, reservation_ids):
+        by_shard = {}
+        for reservation_id in reservation_ids:
+            by_shard.setdefault(shard_map.shard_of(reservation_id), []).append(reservation_id)
+        released = {}
+        for shard, ids in by_shard.items():
+            released.update(fleet.release_batch(shard_map.connection(shard), user_id, ids))
+        return released
     
     @staticmethod
     def get_reservation_by_id(reservation_id, user_id):
-        conn = DatabaseManager.get_connection()
-        reservation = conn.execute('SELECT * FROM reservations WHERE id = ? AND user_id = ?', 
+        conn = DatabaseManager.get_shard_connection(reservation_id)
+        reservation = conn.execute('SELECT * FROM reservations WHERE id = ? AND user_id = ?',
                                   (reservation_id, user_id)).fetchone()
         conn.close()
-        return reservation
\ No newline at end of file
+        return reservation
@@ -0,0 +1,396 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from models.shards import shard_map
+
+BOOKED = 1
+RELEASED = 2
+RESIZED = 3
+
+DEFAULT_SEGMENT_BYTES = 16 * 1024 * 1024
+DEFAULT_CHECKPOINT_EVENTS = 50000
+CHECKPOINT_FILE = 'checkpoint.json'
+SEGMENT_SUFFIX = '.log'
+EPOCH = datetime(1970, 1, 1)
+
+# Records are fixed size: a CRC32 of the body, then the kind, the record's
+# place in its transaction's batch and the event fields. Timestamps are
+# microseconds since EPOCH, read as the naive times the database stores.
+CRC = struct.Struct('<I')
+BODY = struct.Struct('<BxHH2x8qd')
+RECORD = struct.Struct('<I' + BODY.format[1:])
+RECORD_SIZE = RECORD.size
+
+STATE_QUERY = 'SELECT lsn, segment FROM event_log_state WHERE id = 1'
+
+events_log = logging.getLogger('parking.events')
+
+Event = namedtuple('Event', 'kind lsn at lot_id spot_id reservation_id user_id started spots amount')
+
+class EventLogGap(Exception):
+    pass
+
+def to_micros(moment):
+    if isinstance(moment, str):
+        moment = datetime.fromisoformat(moment)
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+def from_micros(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+def booked(lot_id, spot_id, reservation_id, user_id, parking_timestamp, hourly_price):
+    return Event(BOOKED, 0, to_micros(parking_timestamp), lot_id, spot_id, reservation_id, user_id,
+                 0, 0, hourly_price or 0.0)
+
+def released(lot_id, spot_id, reservation_id, user_id, parking_timestamp, leaving_timestamp, cost):
+    return Event(RELEASED, 0, to_micros(leaving_timestamp), lot_id, spot_id, reservation_id, user_id,
+                 to_micros(parking_timestamp), 0, cost or 0.0)
+
+def resized(conn, lot_id):
+    # The lot as conn's transaction leaves it; no spots once it is deleted.
+    # Added spots take the highest ids, so the last id says which they are.
+    spots, last_id = conn.execute('SELECT COUNT(*), COALESCE(MAX(id), 0) FROM parking_spots WHERE lot_id = ?',
+                                  (lot_id,)).fetchone()
+    return Event(RESIZED, 0, to_micros(datetime.now()), lot_id, last_id, 0, 0, 0, spots, 0.0)
+
+def pack(event, index, count):
+    body = BODY.pack(event.kind, index, count, *event[1:])
+    return CRC.pack(zlib.crc32(body)) + body
+
+def read_segment(path):
+    # Yields (index, count, event) for every intact record. A record whose
+    # CRC does not match is skipped, which leaves its batch incomplete.
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        size -= size % RECORD_SIZE
+        if not size:
+            return
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as view:
+            data = memoryview(view)
+            try:
+                for offset, (crc, kind, index, count, *fields) in zip(range(CRC.size, size, RECORD_SIZE),
+                                                                      RECORD.iter_unpack(data)):
+                    if zlib.crc32(data[offset:offset + BODY.size]) == crc:
+                        yield index, count, Event(kind, *fields)
+            finally:
+                data.release()
+
+def to_ranges(spot_ids):
+    ranges = []
+    for spot_id in sorted(spot_ids):
+        if ranges and ranges[-1][1] == spot_id - 1:
+            ranges[-1][1] = spot_id
+        else:
+            ranges.append([spot_id, spot_id])
+    return ranges
+
+def from_ranges(ranges):
+    return {spot_id for first, last in ranges for spot_id in range(first, last + 1)}
+
+class LotState:
+    __slots__ = ('total', 'occupied', 'free')
+
+    def __init__(self, total=0, occupied=0, free=None):
+        self.total = total
+        self.occupied = occupied
+        # Free spot ids, or None when the log cannot tell them.
+        self.free = free
+
+class LogState:
+    # Everything derived from spot state that the log can rebuild: lot
+    # counters and free spot lists. The usage rollups split every stay over
+    # the hours it covers and reach back past any checkpoint, so they are
+    # rebuilt from the reservations instead; see rollups.run_rollup.
+    def __init__(self, lsn=0, lots=None):
+        self.lsn = lsn
+        self.lots = lots if lots is not None else {}
+
+    def apply(self, event):
+        if event.lsn != self.lsn + 1:
+            raise EventLogGap(f'The log skips from LSN {self.lsn} to {event.lsn}')
+        self.lsn = event.lsn
+        if event.kind == RESIZED:
+            if not event.spots:
+                self.lots.pop(event.lot_id, None)
+                return
+            lot = self.lots.setdefault(event.lot_id, LotState(0, 0, set()))
+            change = event.spots - lot.total
+            if lot.free is not None and change > 0:
+                lot.free.update(range(event.spot_id - change + 1, event.spot_id + 1))
+            elif lot.free is not None and change < 0:
+                # Shrinking removes the newest free spots, as resize_lot does.
+                lot.free.difference_update(sorted(lot.free, reverse=True)[:-change])
+            lot.total = event.spots
+            return
+
+        lot = self.lots.setdefault(event.lot_id, LotState())
+        if event.kind == BOOKED:
+            lot.occupied += 1
+            if lot.free is not None:
+                lot.free.discard(event.spot_id)
+        elif event.kind == RELEASED:
+            lot.occupied -= 1
+            if lot.free is not None:
+                lot.free.add(event.spot_id)
+
+    def counts(self):
+        # {lot_id: (total, available, occupied)}, the shape of the lot counters.
+        return {lot_id: (lot.total, lot.total - lot.occupied, lot.occupied) for lot_id, lot in self.lots.items()}
+
+    def free_spots(self):
+        return {lot_id: lot.free for lot_id, lot in self.lots.items() if lot.free is not None}
+
+    def to_dict(self):
+        return {
+            'lsn': self.lsn,
+            'lots': [[lot_id, lot.total, lot.occupied, None if lot.free is None else to_ranges(lot.free)]
+                     for lot_id, lot in self.lots.items()],
+        }
+
+    @staticmethod
+    def from_dict(data):
+        lots = {lot_id: LotState(total, occupied, None if free is None else from_ranges(free))
+                for lot_id, total, occupied, free in data['lots']}
+        return LogState(data['lsn'], lots)
+
+def snapshot(conn):
+    # Derived state read straight from the tables, one scan of the spots.
+    # Run inside a read transaction so the spots match the LSN.
+    state = LogState(conn.execute(STATE_QUERY).fetchone()[0])
+    for (lot_id,) in conn.execute('SELECT id FROM parking_lots'):
+        state.lots[lot_id] = LotState(0, 0, set())
+    for spot_id, lot_id, status in conn.execute('SELECT id, lot_id, status FROM parking_spots'):
+        lot = state.lots.get(lot_id)
+        if lot is None:
+            continue
+        lot.total += 1
+        if status == 'A':
+            lot.free.add(spot_id)
+        else:
+            lot.occupied += 1
+    return state
+
+class ShardLog:
+    # One shard's segments and checkpoint. Segments are named after the
+    # first LSN written to them.
+    def __init__(self, directory):
+        self.directory = directory
+        self._fd = None
+        self._segment = None
+        self._pid = None
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f'{segment:020d}{SEGMENT_SUFFIX}')
+
+    def segments(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in names
+                      if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+    def _open(self, segment):
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        self._fd = os.open(self.segment_path(segment), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._segment = segment
+        self._pid = os.getpid()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def append(self, lsn, segment, events, segment_bytes, fsync):
+        # Writes events as LSNs lsn + 1 onwards and returns the segment they
+        # went to. The caller holds the shard's write lock.
+        if self._fd is None or self._segment != segment or self._pid != os.getpid():
+            self._open(segment)
+        size = os.fstat(self._fd).st_size
+        if size % RECORD_SIZE:
+            # A crash mid-write left part of a record from a transaction
+            # that never committed; cut it off so records stay aligned.
+            size -= size % RECORD_SIZE
+            os.ftruncate(self._fd, size)
+        if size >= segment_bytes:
+            self._open(lsn + 1)
+        count = len(events)
+        data = memoryview(b''.join(pack(event._replace(lsn=lsn + 1 + index), index, count)
+                                   for index, event in enumerate(events)))
+        while data:
+            data = data[os.write(self._fd, data):]
+        if fsync:
+            os.fsync(self._fd)
+        return self._segment
+
+    def batches(self, after=0):
+        # Complete transaction batches in log order, starting from the
+        # segment that holds LSN after + 1.
+        segments = self.segments()
+        start = max((segment for segment in segments if segment <= after + 1), default=0)
+        batch = []
+        for segment in segments:
+            if segment < start:
+                continue
+            for index, count, event in read_segment(self.segment_path(segment)):
+                if index != len(batch) or (batch and event.lsn != batch[-1].lsn + 1):
+                    # The batch was cut short by a crash or a bad record.
+                    batch = []
+                    if index:
+                        continue
+                batch.append(event)
+                if index == count - 1:
+                    yield batch
+                    batch = []
+
+    def events(self, after, upto):
+        # Committed events with after < lsn <= upto. A transaction that
+        # rolls back after appending leaves a batch whose LSNs the next
+        # writer takes again, so a batch only counts once the batch after
+        # it starts beyond it, or if it is the last one and was committed.
+        pending = None
+        for batch in self.batches(after):
+            if pending is not None and batch[0].lsn > pending[-1].lsn:
+                yield from (event for event in pending if event.lsn > after)
+            pending = batch
+            if batch[0].lsn > upto:
+                pending = None
+                break
+        if pending is not None and pending[-1].lsn <= upto:
+            yield from (event for event in pending if event.lsn > after)
+
+    def load_checkpoint(self):
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT_FILE)) as f:
+                return LogState.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def save_checkpoint(self, state):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state.to_dict(), f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    def prune(self, lsn):
+        # Removes segments holding nothing after lsn; the newest always stays.
+        segments = self.segments()
+        removed = 0
+        for segment, following in zip(segments, segments[1:]):
+            if following - 1 <= lsn:
+                os.remove(self.segment_path(segment))
+                removed += 1
+        return removed
+
+def log_directory(database):
+    return f'{os.path.splitext(database)[0]}-events'
+
+class EventLog:
+    # Append-only log of booked, released and resized events per shard,
+    # written inside the transaction that makes each change. Derived state
+    # is rebuilt from a checkpoint plus the log after it instead of by
+    # scanning the tables.
+    def __init__(self):
+        self._shards = []
+        self._lock = threading.Lock()
+        self.configure([])
+
+    def configure(self, paths, enabled=True, segment_bytes=DEFAULT_SEGMENT_BYTES, fsync=False,
+                  checkpoint_events=DEFAULT_CHECKPOINT_EVENTS):
+        with self._lock:
+            for log in self._shards:
+                log.close()
+            self._shards = [ShardLog(log_directory(path)) for path in paths]
+        self.enabled = enabled
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.checkpoint_events = checkpoint_events
+
+    def shard(self, shard):
+        return self._shards[shard]
+
+    def record(self, conn, events):
+        # Call inside the write transaction making the change, just before
+        # it commits. With logging off the LSN still moves on, so a replay
+        # later finds the gap rather than silently missing events.
+        if not events:
+            return
+        lsn, segment = conn.execute(STATE_QUERY).fetchone()
+        if self.enabled:
+            with self._lock:
+                segment = self._shards[shard_map.shard_of(events[0].lot_id)].append(
+                    lsn, segment, events, self.segment_bytes, self.fsync)
+        conn.execute('UPDATE event_log_state SET lsn = ?, segment = ? WHERE id = 1',
+                     (lsn + len(events), segment))
+
+    def replay(self, conn, shard, state=None):
+        # Applies the log after state, by default the shard's checkpoint, up
+        # to the LSN committed in conn's snapshot.
+        log = self._shards[shard]
+        if state is None:
+            state = log.load_checkpoint()
+            if state is None:
+                raise EventLogGap(f'There is no checkpoint in {log.directory}')
+        upto = conn.execute(STATE_QUERY).fetchone()[0]
+        for event in log.events(state.lsn, upto):
+            state.apply(event)
+        if state.lsn != upto:
+            raise EventLogGap(f'The log ends at LSN {state.lsn} but the database is at {upto}')
+        return state
+
+    def checkpoint(self, conn, shard):
+        # Starts the shard over from a scan of its tables.
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('BEGIN')
+        try:
+            state = snapshot(conn)
+        finally:
+            conn.rollback()
+        self.save_checkpoint(shard, state)
+        return state
+
+    def save_checkpoint(self, shard, state):
+        log = self._shards[shard]
+        log.save_checkpoint(state)
+        return log.prune(state.lsn)
+
+    def recover(self, conn, shard):
+        # Derived state for a starting worker, or None when the log cannot
+        # provide it and the caller should scan the tables instead. Long
+        # replays leave a new checkpoint behind for the next worker.
+        state = self._shards[shard].load_checkpoint()
+        if state is None:
+            return None
+        checkpointed = state.lsn
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('BEGIN')
+        try:
+            state = self.replay(conn, shard, state)
+        except EventLogGap as exc:
+            events_log.warning('Shard %d: %s', shard, exc)
+            return None
+        finally:
+            conn.rollback()
+        if state.lsn - checkpointed >= self.checkpoint_events:
+            self.save_checkpoint(shard, state)
+        return state
+
+event_log = EventLog()
+
+def init_app(app):
+    event_log.configure(shard_map.paths, app.config['EVENT_LOG_ENABLED'], app.config['EVENT_LOG_SEGMENT_BYTES'],
+                        app.config['EVENT_LOG_FSYNC'], app.config['EVENT_LOG_CHECKPOINT_EVENTS'])
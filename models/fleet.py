@@ -0,0 +1,104 @@
+from datetime import datetime
+
+from models import billing, eventlog
+from models.allocator import spot_allocator
+from models.eventlog import event_log
+from models.pricing import price_table
+from models.schedule import schedule_index
+
+MAX_BATCH = 500
+
+def _candidate_lots(conn, lot_id, count, adjacent):
+    if lot_id is not None:
+        return [lot_id]
+    # Fullest-free lots first keeps a fleet together where it can be.
+    rows = conn.execute('SELECT id FROM parking_lots WHERE available_spots >= ? ORDER BY available_spots DESC, id',
+                        (count if adjacent else 1,))
+    return [row[0] for row in rows]
+
+def book_batch(conn, user_id, count, lot_id=None, adjacent=False):
+    # Books up to count spots for one user in a single transaction and
+    # returns (lot_id, spot_id, reservation_id) per booked spot. Adjacent
+    # batches are all-or-nothing and never split across lots.
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    taken = []
+    try:
+        for candidate in _candidate_lots(conn, lot_id, count, adjacent):
+            # Capacity held for scheduled arrivals is off limits to walk-ins.
+            wanted = min(count - len(taken), schedule_index.walk_in_capacity(conn, candidate))
+            if wanted <= 0 or (adjacent and wanted < count):
+                continue
+            spot_ids = spot_allocator.claim_many(conn, candidate, wanted, adjacent)
+            taken.extend((candidate, spot_id) for spot_id in spot_ids)
+            if len(taken) == count or (adjacent and taken):
+                break
+        if not taken:
+            conn.rollback()
+            return []
+
+        now = datetime.now()
+        rows = []
+        for candidate, spot_id in taken:
+            rows.append(conn.execute('''
+                INSERT INTO reservations (spot_id, user_id, hourly_price)
+                SELECT ?, ?, ROUND(price * ?, 2) FROM parking_lots WHERE id = ?
+                RETURNING id, parking_timestamp, hourly_price
+            ''', (spot_id, user_id, price_table.multiplier(candidate, now), candidate)).fetchone())
+        reservation_ids = [row[0] for row in rows]
+        event_log.record(conn, [eventlog.booked(candidate, spot_id, row[0], user_id, row[1], row[2])
+                                for (candidate, spot_id), row in zip(taken, rows)])
+        conn.commit()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        for candidate, spot_id in taken:
+            spot_allocator.release(candidate, spot_id)
+        raise
+    return [(candidate, spot_id, reservation_id)
+            for (candidate, spot_id), reservation_id in zip(taken, reservation_ids)]
+
+def release_batch(conn, user_id, reservation_ids, leaving_timestamp=None):
+    # Releases the user's active reservations among reservation_ids in one
+    # transaction with one billing pass. Returns {id: (lot_id, spot_id, cost)}
+    # for every reservation that was released.
+    if not reservation_ids:
+        return {}
+    leaving_timestamp = leaving_timestamp or datetime.now()
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        placeholders = ','.join('?' * len(reservation_ids))
+        rows = conn.execute(f'''
+            SELECT r.id, r.spot_id, r.parking_timestamp, ps.lot_id, COALESCE(r.hourly_price, pl.price) AS price, pl.tariff
+            FROM reservations r
+            JOIN parking_spots ps ON r.spot_id = ps.id
+            JOIN parking_lots pl ON ps.lot_id = pl.id
+            WHERE r.id IN ({placeholders}) AND r.user_id = ? AND r.status = "active"
+        ''', (*reservation_ids, user_id)).fetchall()
+        if not rows:
+            conn.rollback()
+            return {}
+
+        costs = {key: cost for cost, key in billing.quote_rows(
+            (row['id'], billing.hours_between(row['parking_timestamp'], leaving_timestamp), row['price'], row['tariff'])
+            for row in rows)}
+        conn.executemany('''
+            UPDATE reservations SET leaving_timestamp = ?, parking_cost = ?, status = "completed" WHERE id = ?
+        ''', ((leaving_timestamp, costs[row['id']], row['id']) for row in rows))
+        event_log.record(conn, [eventlog.released(row['lot_id'], row['spot_id'], row['id'], user_id, row['parking_timestamp'],
+                                                  leaving_timestamp, costs[row['id']])
+                                for row in rows])
+        conn.commit()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+
+    released = {}
+    for row in rows:
+        spot_allocator.release(row['lot_id'], row['spot_id'])
+        released[row['id']] = (row['lot_id'], row['spot_id'], costs[row['id']])
+    return released
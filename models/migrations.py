@@ -0,0 +1,303 @@
+import sqlite3
+
+from models.counters import rebuild_counters
+
+MIGRATIONS = [
+    (1, 'create base tables', [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            email TEXT,
+            phone TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS parking_lots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            prime_location_name TEXT NOT NULL,
+            price REAL NOT NULL,
+            address TEXT NOT NULL,
+            pin_code TEXT NOT NULL,
+            maximum_number_of_spots INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS parking_spots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lot_id INTEGER NOT NULL,
+            status TEXT DEFAULT 'A',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (lot_id) REFERENCES parking_lots (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS reservations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            spot_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            parking_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            leaving_timestamp TIMESTAMP,
+            parking_cost REAL,
+            status TEXT DEFAULT 'active',
+            FOREIGN KEY (spot_id) REFERENCES parking_spots (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+    ]),
+    (2, 'index hot spot and reservation lookups', [
+        'CREATE INDEX IF NOT EXISTS idx_parking_spots_lot_status ON parking_spots (lot_id, status)',
+        'CREATE INDEX IF NOT EXISTS idx_reservations_user_status_time ON reservations (user_id, status, parking_timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_reservations_spot_status ON reservations (spot_id, status)',
+    ]),
+    (3, 'add spot level, zone and EV metadata', [
+        lambda conn: add_column(conn, 'parking_spots', 'level', 'INTEGER'),
+        lambda conn: add_column(conn, 'parking_spots', 'zone', 'TEXT'),
+        lambda conn: add_column(conn, 'parking_spots', 'ev_capable', 'INTEGER NOT NULL DEFAULT 0'),
+    ]),
+    (4, 'maintain per-lot occupancy counters', [
+        lambda conn: add_column(conn, 'parking_lots', 'total_spots', 'INTEGER NOT NULL DEFAULT 0'),
+        lambda conn: add_column(conn, 'parking_lots', 'available_spots', 'INTEGER NOT NULL DEFAULT 0'),
+        lambda conn: add_column(conn, 'parking_lots', 'occupied_spots', 'INTEGER NOT NULL DEFAULT 0'),
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_parking_spots_insert AFTER INSERT ON parking_spots
+        BEGIN
+            UPDATE parking_lots SET total_spots = total_spots + 1,
+                available_spots = available_spots + (NEW.status = 'A'),
+                occupied_spots = occupied_spots + (NEW.status = 'O')
+            WHERE id = NEW.lot_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_parking_spots_delete AFTER DELETE ON parking_spots
+        BEGIN
+            UPDATE parking_lots SET total_spots = total_spots - 1,
+                available_spots = available_spots - (OLD.status = 'A'),
+                occupied_spots = occupied_spots - (OLD.status = 'O')
+            WHERE id = OLD.lot_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_parking_spots_status AFTER UPDATE OF status, lot_id ON parking_spots
+        BEGIN
+            UPDATE parking_lots SET total_spots = total_spots - 1,
+                available_spots = available_spots - (OLD.status = 'A'),
+                occupied_spots = occupied_spots - (OLD.status = 'O')
+            WHERE id = OLD.lot_id;
+            UPDATE parking_lots SET total_spots = total_spots + 1,
+                available_spots = available_spots + (NEW.status = 'A'),
+                occupied_spots = occupied_spots + (NEW.status = 'O')
+            WHERE id = NEW.lot_id;
+        END
+        ''',
+        lambda conn: rebuild_counters(conn),
+    ]),
+    (5, 'index spots by lot in id order for keyset pagination', [
+        'CREATE INDEX IF NOT EXISTS idx_parking_spots_lot ON parking_spots (lot_id)',
+    ]),
+    (6, 'add per-lot billing tariffs', [
+        lambda conn: add_column(conn, 'parking_lots', 'tariff', 'TEXT'),
+    ]),
+    (7, 'add occupancy and revenue rollup tables', [
+        '''
+        CREATE TABLE IF NOT EXISTS lot_usage_hourly (
+            lot_id INTEGER NOT NULL,
+            hour TEXT NOT NULL,
+            departures INTEGER NOT NULL DEFAULT 0,
+            occupied_hours REAL NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (lot_id, hour)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS lot_usage_daily (
+            lot_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            departures INTEGER NOT NULL DEFAULT 0,
+            occupied_hours REAL NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (lot_id, day)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name TEXT PRIMARY KEY,
+            watermark_timestamp TEXT NOT NULL,
+            watermark_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_reservations_status_leaving ON reservations (status, leaving_timestamp)',
+    ]),
+    (8, 'index lots for search by pin code, price, availability and text', [
+        'CREATE INDEX IF NOT EXISTS idx_parking_lots_pin_code ON parking_lots (pin_code)',
+        'CREATE INDEX IF NOT EXISTS idx_parking_lots_price ON parking_lots (price)',
+        'CREATE INDEX IF NOT EXISTS idx_parking_lots_available ON parking_lots (available_spots DESC)',
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS lots_fts USING fts5(
+            prime_location_name, address,
+            content='parking_lots', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_parking_lots_fts_insert AFTER INSERT ON parking_lots
+        BEGIN
+            INSERT INTO lots_fts (rowid, prime_location_name, address)
+            VALUES (NEW.id, NEW.prime_location_name, NEW.address);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_parking_lots_fts_delete AFTER DELETE ON parking_lots
+        BEGIN
+            INSERT INTO lots_fts (lots_fts, rowid, prime_location_name, address)
+            VALUES ('delete', OLD.id, OLD.prime_location_name, OLD.address);
+        END
+        ''',
+        # Only name and address changes touch the index; the counter
+        # triggers rewrite parking_lots on every booking.
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_parking_lots_fts_update AFTER UPDATE OF prime_location_name, address ON parking_lots
+        BEGIN
+            INSERT INTO lots_fts (lots_fts, rowid, prime_location_name, address)
+            VALUES ('delete', OLD.id, OLD.prime_location_name, OLD.address);
+            INSERT INTO lots_fts (rowid, prime_location_name, address)
+            VALUES (NEW.id, NEW.prime_location_name, NEW.address);
+        END
+        ''',
+        "INSERT INTO lots_fts (lots_fts) VALUES ('rebuild')",
+    ]),
+    (9, 'add scheduled reservations', [
+        '''
+        CREATE TABLE IF NOT EXISTS scheduled_reservations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lot_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            start_time TIMESTAMP NOT NULL,
+            end_time TIMESTAMP NOT NULL,
+            status TEXT NOT NULL DEFAULT 'scheduled',
+            reservation_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (lot_id) REFERENCES parking_lots (id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (reservation_id) REFERENCES reservations (id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_scheduled_lot_status_end ON scheduled_reservations (lot_id, status, end_time)',
+        'CREATE INDEX IF NOT EXISTS idx_scheduled_user_status_start ON scheduled_reservations (user_id, status, start_time)',
+        'CREATE INDEX IF NOT EXISTS idx_scheduled_reservation ON scheduled_reservations (reservation_id)',
+        # Bumped with every schedule change so each worker can tell when its
+        # in-memory index of a lot is stale.
+        lambda conn: add_column(conn, 'parking_lots', 'schedule_version', 'INTEGER NOT NULL DEFAULT 0'),
+    ]),
+    (10, 'derive spot status from reservations', [
+        # A spot is occupied exactly while it has an active reservation, so
+        # bookings and releases are a single statement on reservations. The
+        # status guards keep claims that already marked the spot from
+        # touching the lot counters twice.
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_reservations_occupy AFTER INSERT ON reservations
+        WHEN NEW.status = 'active'
+        BEGIN
+            UPDATE parking_spots SET status = 'O' WHERE id = NEW.spot_id AND status = 'A';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_reservations_release AFTER UPDATE OF status ON reservations
+        WHEN OLD.status = 'active' AND NEW.status != 'active'
+        BEGIN
+            UPDATE parking_spots SET status = 'A' WHERE id = OLD.spot_id AND status = 'O';
+            UPDATE scheduled_reservations SET status = 'completed'
+            WHERE reservation_id = OLD.id AND status = 'checked_in';
+        END
+        ''',
+    ]),
+    (11, 'add occupancy-based price table and per-reservation hourly price', [
+        # One row per lot holding a multiplier for every hour of the week,
+        # packed as float32s, so workers can load the whole table at once.
+        '''
+        CREATE TABLE IF NOT EXISTS lot_prices (
+            lot_id INTEGER PRIMARY KEY,
+            multipliers BLOB NOT NULL,
+            computed_at TIMESTAMP NOT NULL
+        )
+        ''',
+        # The rate a stay was booked at; billing uses it instead of the
+        # lot's current base price. NULL for stays booked before pricing.
+        lambda conn: add_column(conn, 'reservations', 'hourly_price', 'REAL'),
+    ]),
+    (12, 'add event log state', [
+        # The last LSN written to this shard's event log and the segment it
+        # went to. Updated in the transaction that makes the logged change,
+        # so the database says which log records were committed.
+        '''
+        CREATE TABLE IF NOT EXISTS event_log_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            lsn INTEGER NOT NULL,
+            segment INTEGER NOT NULL
+        )
+        ''',
+        'INSERT OR IGNORE INTO event_log_state (id, lsn, segment) VALUES (1, 0, 1)',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def add_column(conn, table, column, definition):
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def ensure_version_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def current_version(conn):
+    ensure_version_table(conn)
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+def is_current(conn):
+    # A plain read, so workers starting against an up-to-date database
+    # never queue for the write lock.
+    try:
+        return conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] == LATEST_VERSION
+    except sqlite3.OperationalError:
+        return False
+
+def migrate(conn, target=None):
+    if conn.in_transaction:
+        conn.commit()
+    current = current_version(conn)
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        if target is not None and version > target:
+            break
+        # Take the write lock before re-checking, so concurrent workers
+        # starting up together apply each step exactly once.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            done = conn.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone()
+            if not done:
+                for statement in statements:
+                    if callable(statement):
+                        statement(conn)
+                    else:
+                        conn.execute(statement)
+                conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                             (version, description))
+                applied.append((version, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return applied
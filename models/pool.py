@@ -0,0 +1,170 @@
+import queue
+import sqlite3
+import threading
+import time
+
+from flask import g, has_app_context
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_BUSY_TIMEOUT = 5000
+DEFAULT_SYNCHRONOUS = 'NORMAL'
+DEFAULT_CACHE_SIZE = -16000
+DEFAULT_CACHED_STATEMENTS = 256
+
+_statement_observer = None
+_connect_hooks = []
+
+def set_statement_observer(observer):
+    global _statement_observer
+    _statement_observer = observer
+
+def add_connect_hook(hook):
+    # Run against every new connection, e.g. to register SQL functions.
+    if hook not in _connect_hooks:
+        _connect_hooks.append(hook)
+
+class PooledConnection:
+    def __init__(self, pool, conn, bound=False):
+        self._pool = pool
+        self._conn = conn
+        self._bound = bound
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    def _observe(self, sql, method, *args):
+        observer = _statement_observer
+        if observer is None:
+            return method(*args)
+        start = time.perf_counter()
+        error = None
+        try:
+            return method(*args)
+        except sqlite3.Error as exc:
+            error = exc
+            raise
+        finally:
+            observer(sql, time.perf_counter() - start, error)
+
+    def execute(self, sql, parameters=()):
+        return self._observe(sql, self._conn.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._observe(sql, self._conn.executemany, sql, seq_of_parameters)
+
+    def commit(self):
+        return self._observe('COMMIT', self._conn.commit)
+
+    def close(self):
+        # Connections bound to an app context are handed back on teardown,
+        # so routes can keep calling close() as they always have.
+        if not self._bound:
+            self.release()
+
+    def release(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+class ConnectionPool:
+    def __init__(self, database, size=DEFAULT_POOL_SIZE, busy_timeout=DEFAULT_BUSY_TIMEOUT,
+                 synchronous=DEFAULT_SYNCHRONOUS, cache_size=DEFAULT_CACHE_SIZE,
+                 cached_statements=DEFAULT_CACHED_STATEMENTS, setup=None):
+        self.database = database
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.cached_statements = cached_statements
+        self.setup = setup
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        # Each connection keeps its compiled statements keyed by SQL text, so
+        # queries written as constant strings are prepared once per connection.
+        conn = sqlite3.connect(self.database, timeout=self.busy_timeout / 1000, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+        conn.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+        for hook in _connect_hooks:
+            hook(conn)
+        if self.setup is not None:
+            self.setup(conn)
+        return conn
+
+    def acquire(self, bound=False):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        return PooledConnection(self, conn, bound)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def configure_pool(database, **options):
+    with _pools_lock:
+        old_pool = _pools.get(database)
+        _pools[database] = ConnectionPool(database, **options)
+    if old_pool is not None:
+        old_pool.close_all()
+    return _pools[database]
+
+def get_pool(database):
+    pool = _pools.get(database)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(database)
+            if pool is None:
+                pool = _pools[database] = ConnectionPool(database)
+    return pool
+
+def get_connection(database):
+    pool = get_pool(database)
+    if not has_app_context():
+        return pool.acquire()
+
+    connections = g.setdefault('_db_connections', {})
+    conn = connections.get(database)
+    if conn is None:
+        conn = connections[database] = pool.acquire(bound=True)
+    return conn
+
+def release_connections(exception=None):
+    connections = g.pop('_db_connections', None)
+    if connections:
+        for conn in connections.values():
+            conn.release()
+
+def init_app(app):
+    configure_pool(app.config['DATABASE'],
+                   size=app.config['DATABASE_POOL_SIZE'],
+                   busy_timeout=app.config['DATABASE_BUSY_TIMEOUT'],
+                   synchronous=app.config['DATABASE_SYNCHRONOUS'],
+                   cache_size=app.config['DATABASE_CACHE_SIZE'],
+                   cached_statements=app.config['DATABASE_CACHED_STATEMENTS'])
+    app.teardown_appcontext(release_connections)
@@ -0,0 +1,215 @@
+import array
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from models import pool, rollups
+from models.shards import shard_map
+
+HOURS_PER_WEEK = 7 * 24
+DEFAULT_INTERVAL = 900
+DEFAULT_WINDOW_DAYS = 28
+DEFAULT_BANDS = '0.5:0.9,0.75:1.0,0.9:1.25,-:1.5'
+# How far the hour we are in leans on the lot's current occupancy rather
+# than on its history for that hour of the week.
+LIVE_WEIGHT = 0.5
+# Workers pick up prices another worker computed at least this often.
+RELOAD_SECONDS = 60
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+HOUR_FORMAT = '%Y-%m-%d %H:00'
+
+pricing_log = logging.getLogger('parking.pricing')
+
+def bucket_of(moment):
+    return moment.weekday() * 24 + moment.hour
+
+def parse_bands(text):
+    # "UP_TO_OCCUPANCY:MULTIPLIER" pairs, e.g. "0.5:0.9,-:1.5".
+    bands = []
+    for band in text.split(','):
+        upto, _, multiplier = band.strip().partition(':')
+        bands.append((None if upto in ('', '-') else float(upto), float(multiplier)))
+    return bands
+
+class PricingPolicy:
+    # Bands are (up_to_occupancy, multiplier) pairs checked in order, where
+    # occupancy is the share of a lot's spots in use and None means "no
+    # upper bound". Hours with no occupancy data keep the base price.
+    def __init__(self, bands=None):
+        self.bands = [(None if upto is None else float(upto), float(multiplier))
+                      for upto, multiplier in (bands or parse_bands(DEFAULT_BANDS))]
+
+    def multiplier(self, occupancy):
+        if occupancy is None:
+            return 1.0
+        for upto, multiplier in self.bands:
+            if upto is None or occupancy <= upto:
+                return multiplier
+        return 1.0
+
+def occupancy_profile(conn, now, window_days):
+    # Average share of each lot's spots in use for every hour of the week
+    # across the window, read from the hourly usage rollups.
+    end = now.replace(minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=window_days)
+    samples = [0] * HOURS_PER_WEEK
+    hour = start
+    while hour < end:
+        samples[bucket_of(hour)] += 1
+        hour += timedelta(hours=1)
+
+    profiles = {}
+    rows = conn.execute('''
+        SELECT h.lot_id, h.hour, h.occupied_hours, pl.total_spots
+        FROM lot_usage_hourly h
+        JOIN parking_lots pl ON h.lot_id = pl.id
+        WHERE h.hour >= ? AND h.hour < ? AND pl.total_spots > 0
+    ''', (start.strftime(HOUR_FORMAT), end.strftime(HOUR_FORMAT)))
+    for lot_id, hour, occupied_hours, total_spots in rows:
+        profile = profiles.setdefault(lot_id, [0.0] * HOURS_PER_WEEK)
+        profile[bucket_of(datetime.strptime(hour, HOUR_FORMAT))] += occupied_hours / total_spots
+    for profile in profiles.values():
+        for bucket, count in enumerate(samples):
+            profile[bucket] = profile[bucket] / count if count else None
+    return profiles
+
+def compute_multipliers(conn, policy, now, window_days):
+    profiles = occupancy_profile(conn, now, window_days)
+    current = bucket_of(now)
+    multipliers = {}
+    for lot_id, total_spots, occupied_spots in conn.execute('SELECT id, total_spots, occupied_spots FROM parking_lots'):
+        profile = profiles.get(lot_id) or [None] * HOURS_PER_WEEK
+        values = array.array('f', (policy.multiplier(occupancy) for occupancy in profile))
+        if total_spots:
+            live = occupied_spots / total_spots
+            history = profile[current]
+            values[current] = policy.multiplier(live if history is None else
+                                                LIVE_WEIGHT * live + (1 - LIVE_WEIGHT) * history)
+        multipliers[lot_id] = values
+    return multipliers
+
+def reprice(conn, policy, window_days=DEFAULT_WINDOW_DAYS, now=None):
+    # Rewrites the shard's price table inside the caller's transaction and
+    # returns the number of lots priced.
+    now = now or datetime.now()
+    multipliers = compute_multipliers(conn, policy, now, window_days)
+    computed_at = now.strftime(TIME_FORMAT)
+    conn.execute('DELETE FROM lot_prices WHERE lot_id NOT IN (SELECT id FROM parking_lots)')
+    conn.executemany('''
+        INSERT INTO lot_prices (lot_id, multipliers, computed_at) VALUES (?, ?, ?)
+        ON CONFLICT (lot_id) DO UPDATE SET multipliers = excluded.multipliers, computed_at = excluded.computed_at
+    ''', ((lot_id, values.tobytes(), computed_at) for lot_id, values in multipliers.items()))
+    return len(multipliers)
+
+def read_multipliers(conn):
+    multipliers = {}
+    for lot_id, blob in conn.execute('SELECT lot_id, multipliers FROM lot_prices'):
+        values = array.array('f')
+        values.frombytes(blob)
+        multipliers[lot_id] = values
+    return multipliers
+
+class PriceTable:
+    # Lot id -> one multiplier per hour of the week. Lookups are a dict get
+    # and an index, and a refresh swaps in a whole new map at once.
+    def __init__(self):
+        self._multipliers = {}
+
+    def multiplier(self, lot_id, moment=None):
+        values = self._multipliers.get(lot_id)
+        if values is None:
+            return 1.0
+        return values[bucket_of(moment or datetime.now())]
+
+    def price(self, lot_id, base_price, moment=None):
+        return round(base_price * self.multiplier(lot_id, moment), 2)
+
+    def publish(self, multipliers):
+        self._multipliers = multipliers
+
+    def clear(self):
+        self._multipliers = {}
+
+class PricingEngine:
+    def __init__(self, table):
+        self.table = table
+        self._thread = None
+        self._lock = threading.Lock()
+        self.configure()
+
+    def configure(self, paths=('parking_app.db',), policy=None, interval=DEFAULT_INTERVAL,
+                  window_days=DEFAULT_WINDOW_DAYS):
+        self.paths = list(paths)
+        self.policy = policy or PricingPolicy()
+        self.interval = interval
+        self.window_days = window_days
+
+    def _is_stale(self, conn, now):
+        computed_at = conn.execute('SELECT MAX(computed_at) FROM lot_prices').fetchone()[0]
+        return computed_at is None or computed_at <= (now - timedelta(seconds=self.interval)).strftime(TIME_FORMAT)
+
+    def _refresh_shard(self, conn, now, force, rollup):
+        if not force and not self._is_stale(conn, now):
+            return 0
+        if conn.in_transaction:
+            conn.commit()
+        if rollup:
+            # The occupancy window is read from the hourly rollups, so fold
+            # in the stays that ended since the last run first.
+            rollups.run_rollup(conn)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Re-check under the write lock, so one worker per interval
+            # does the work and the rest just load its result.
+            if not force and not self._is_stale(conn, now):
+                conn.rollback()
+                return 0
+            repriced = reprice(conn, self.policy, self.window_days, now)
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        return repriced
+
+    def refresh(self, force=False, now=None, rollup=True):
+        # Reprices every shard whose table is older than the interval, then
+        # publishes all shards' prices. Returns the number of lots repriced.
+        now = now or datetime.now()
+        multipliers = {}
+        repriced = 0
+        for path in self.paths:
+            conn = pool.get_pool(path).acquire()
+            try:
+                repriced += self._refresh_shard(conn, now, force, rollup)
+                multipliers.update(read_multipliers(conn))
+            finally:
+                conn.release()
+        self.table.publish(multipliers)
+        return repriced
+
+    def start(self):
+        # Started after the first request rather than at import, so CLI
+        # commands and scripts that import the app never run it.
+        if self._thread is not None or self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pricing', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                pricing_log.exception('Repricing failed')
+            time.sleep(min(self.interval, RELOAD_SECONDS))
+
+price_table = PriceTable()
+pricing_engine = PricingEngine(price_table)
+
+def init_app(app):
+    pricing_engine.configure(shard_map.paths, PricingPolicy(parse_bands(app.config['PRICING_BANDS'])),
+                             app.config['PRICING_INTERVAL'], app.config['PRICING_WINDOW_DAYS'])
@@ -0,0 +1,73 @@
+def build_layout(max_spots, levels=1, ev_spots=0, zone=None):
+    if max_spots < 0 or levels < 1 or not 0 <= ev_spots <= max_spots:
+        raise ValueError('A lot needs at least one level and no more EV spots than spots')
+    layout = []
+    per_level, extra = divmod(max_spots, levels)
+    ev_remaining = ev_spots
+    for level in range(1, levels + 1):
+        count = per_level + (1 if level <= extra else 0)
+        ev_count = min(ev_remaining, count)
+        ev_remaining -= ev_count
+        if ev_count:
+            layout.append({'count': ev_count, 'level': level, 'zone': zone, 'ev_capable': True})
+        if count - ev_count:
+            layout.append({'count': count - ev_count, 'level': level, 'zone': zone, 'ev_capable': False})
+    return layout
+
+def provision_spots(conn, lot_id, count, level=None, zone=None, ev_capable=False):
+    if count <= 0:
+        return 0
+    # One set-based statement per block instead of one INSERT per spot.
+    conn.execute('''
+        WITH RECURSIVE seq(n) AS (
+            SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < ?
+        )
+        INSERT INTO parking_spots (lot_id, level, zone, ev_capable)
+        SELECT ?, ?, ?, ? FROM seq
+    ''', (count, lot_id, level, zone, int(ev_capable)))
+    return count
+
+def provision_layout(conn, lot_id, layout):
+    total = 0
+    for block in layout:
+        total += provision_spots(conn, lot_id, block['count'], block.get('level'),
+                                 block.get('zone'), block.get('ev_capable', False))
+    return total
+
+def provision_spot_list(conn, lot_id, spots):
+    conn.executemany('INSERT INTO parking_spots (lot_id, level, zone, ev_capable) VALUES (?, ?, ?, ?)',
+                     ((lot_id, spot.get('level'), spot.get('zone'), int(spot.get('ev_capable', False)))
+                      for spot in spots))
+
+def grow_lot(conn, lot_id, count):
+    # New spots fill the emptiest levels first and take each level's zone.
+    # A lot laid out without levels keeps growing without them.
+    levels = conn.execute('''
+        SELECT level, COUNT(*), MAX(zone) FROM parking_spots
+        WHERE lot_id = ? AND level IS NOT NULL GROUP BY level ORDER BY level
+    ''', (lot_id,)).fetchall()
+    if not levels:
+        return provision_spots(conn, lot_id, count)
+    sizes = [size for _, size, _ in levels]
+    added = [0] * len(levels)
+    for _ in range(count):
+        emptiest = min(range(len(levels)), key=lambda i: (sizes[i] + added[i], i))
+        added[emptiest] += 1
+    for (level, _, zone), extra in zip(levels, added):
+        provision_spots(conn, lot_id, extra, level, zone)
+    return count
+
+def resize_lot(conn, lot_id, max_spots):
+    current_spots = conn.execute('SELECT COUNT(*) FROM parking_spots WHERE lot_id = ?', (lot_id,)).fetchone()[0]
+    if max_spots > current_spots:
+        return grow_lot(conn, lot_id, max_spots - current_spots)
+    if max_spots < current_spots:
+        # Only free spots can go; the newest are removed first.
+        removed = conn.execute('''
+            DELETE FROM parking_spots WHERE id IN (
+                SELECT id FROM parking_spots WHERE lot_id = ? AND status = "A"
+                ORDER BY id DESC LIMIT ?
+            )
+        ''', (lot_id, current_spots - max_spots)).rowcount
+        return -removed
+    return 0
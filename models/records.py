@@ -0,0 +1,47 @@
+class Record:
+    # Query results as slotted objects: no per-row dict or key map, field
+    # access by attribute in templates, and row['name'] / row[0] still work
+    # for code written against sqlite3.Row. Each subclass lists its fields in
+    # the order of the SELECT that fills it.
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            key = self.__slots__[key]
+        return getattr(self, key)
+
+    def keys(self):
+        return self.__slots__
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+    @classmethod
+    def factory(cls, cursor, row):
+        return cls(*row)
+
+class UserRecord(Record):
+    __slots__ = ('id', 'username', 'password', 'email', 'phone')
+
+class LotRecord(Record):
+    __slots__ = ('id', 'prime_location_name', 'price', 'address', 'pin_code', 'maximum_number_of_spots',
+                 'total_spots', 'available_spots', 'occupied_spots', 'tariff')
+
+class SpotRecord(Record):
+    __slots__ = ('id', 'lot_id', 'status', 'level', 'zone', 'ev_capable', 'user_id', 'username', 'parking_timestamp')
+
+class ActiveReservationRecord(Record):
+    __slots__ = ('id', 'spot_id', 'parking_timestamp', 'spot_number', 'prime_location_name', 'price')
+
+USER_COLUMNS = 'id, username, password, email, phone'
+LOT_COLUMNS = ', '.join(LotRecord.__slots__)
+
+def select(conn, record, sql, parameters=()):
+    cursor = conn.execute(sql, parameters)
+    cursor.row_factory = record.factory
+    return cursor
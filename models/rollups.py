@@ -0,0 +1,161 @@
+from datetime import datetime, timedelta
+
+from models import archive
+
+WATERMARK_NAME = 'lot_usage'
+# Releases stamp leaving_timestamp before their write commits, and may wait
+# up to the busy timeout for the lock in between. Rows younger than this
+# (and never younger than the connection's busy timeout) are left for the
+# next run, so the watermark cannot pass a release that has yet to commit.
+DEFAULT_LAG_SECONDS = 60
+
+def get_watermark(conn):
+    row = conn.execute('SELECT watermark_timestamp, watermark_id FROM rollup_state WHERE name = ?',
+                       (WATERMARK_NAME,)).fetchone()
+    if row is None:
+        return '', 0
+    return row[0], row[1]
+
+def _split_hours(start, end):
+    # Yields (hour_bucket_start, hours_in_bucket) for every hour the stay overlaps.
+    bucket = start.replace(minute=0, second=0, microsecond=0)
+    while bucket < end:
+        next_bucket = bucket + timedelta(hours=1)
+        overlap = (min(end, next_bucket) - max(start, bucket)).total_seconds() / 3600
+        if overlap > 0:
+            yield bucket, overlap
+        bucket = next_bucket
+
+def _fold(rows):
+    hourly = {}
+    daily = {}
+    for row in rows:
+        lot_id = row[2]
+        start = datetime.fromisoformat(row[3])
+        end = datetime.fromisoformat(row[4])
+        revenue = row[5] or 0.0
+        for bucket, hours in _split_hours(start, end):
+            hour_key = (lot_id, bucket.strftime('%Y-%m-%d %H:00'))
+            day_key = (lot_id, bucket.strftime('%Y-%m-%d'))
+            hourly.setdefault(hour_key, [0, 0.0, 0.0])[1] += hours
+            daily.setdefault(day_key, [0, 0.0, 0.0])[1] += hours
+        # Departures and revenue are booked to the bucket the car left in.
+        for totals in (hourly.setdefault((lot_id, end.strftime('%Y-%m-%d %H:00')), [0, 0.0, 0.0]),
+                       daily.setdefault((lot_id, end.strftime('%Y-%m-%d')), [0, 0.0, 0.0])):
+            totals[0] += 1
+            totals[2] += revenue
+    return hourly, daily
+
+def _upsert(conn, table, key_column, totals):
+    conn.executemany(f'''
+        INSERT INTO {table} (lot_id, {key_column}, departures, occupied_hours, revenue)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (lot_id, {key_column}) DO UPDATE SET
+            departures = departures + excluded.departures,
+            occupied_hours = occupied_hours + excluded.occupied_hours,
+            revenue = revenue + excluded.revenue
+    ''', ((lot_id, key, *values) for (lot_id, key), values in totals.items()))
+
+def settled_before(conn, lag=DEFAULT_LAG_SECONDS):
+    busy_timeout = conn.execute('PRAGMA busy_timeout').fetchone()[0] / 1000
+    return (datetime.now() - timedelta(seconds=max(lag, busy_timeout))).isoformat(' ')
+
+def _fold_archive(conn, chunk_size):
+    # Archived rows were folded before they moved, so a rebuild has to fold
+    # them again from the archive, which keeps the lot they belonged to.
+    folded = 0
+    after = 0
+    while True:
+        rows = conn.execute(f'''
+            SELECT leaving_timestamp, id, lot_id, parking_timestamp, leaving_timestamp, parking_cost
+            FROM {archive.ARCHIVE_SCHEMA}.reservations
+            WHERE id > ? AND status = "completed" AND leaving_timestamp IS NOT NULL AND lot_id IS NOT NULL
+            ORDER BY id
+            LIMIT ?
+        ''', (after, chunk_size)).fetchall()
+        if not rows:
+            return folded
+        hourly, daily = _fold(rows)
+        _upsert(conn, 'lot_usage_hourly', 'hour', hourly)
+        _upsert(conn, 'lot_usage_daily', 'day', daily)
+        after = rows[-1][1]
+        folded += len(rows)
+
+def run_rollup(conn, chunk_size=20000, rebuild=False, lag=DEFAULT_LAG_SECONDS, archive_path=None):
+    folded = 0
+    archived = False
+    if rebuild:
+        archived = archive_path is not None and archive.attach_archive(conn, archive_path)
+        conn.execute('DELETE FROM lot_usage_hourly')
+        conn.execute('DELETE FROM lot_usage_daily')
+        conn.execute('DELETE FROM rollup_state WHERE name = ?', (WATERMARK_NAME,))
+        if archived:
+            folded += _fold_archive(conn, chunk_size)
+        conn.commit()
+
+    watermark_timestamp, watermark_id = get_watermark(conn)
+    cutoff = settled_before(conn, lag)
+    # A row caught between archive's copy and delete is in both files.
+    skip_archived = f'AND r.id NOT IN (SELECT id FROM {archive.ARCHIVE_SCHEMA}.reservations)' if archived else ''
+    while True:
+        rows = conn.execute(f'''
+            SELECT r.leaving_timestamp, r.id, ps.lot_id, r.parking_timestamp, r.leaving_timestamp, r.parking_cost
+            FROM main.reservations r
+            JOIN main.parking_spots ps ON r.spot_id = ps.id
+            WHERE r.status = "completed" AND r.leaving_timestamp IS NOT NULL AND r.leaving_timestamp < ?
+              AND (r.leaving_timestamp > ? OR (r.leaving_timestamp = ? AND r.id > ?)) {skip_archived}
+            ORDER BY r.leaving_timestamp, r.id
+            LIMIT ?
+        ''', (cutoff, watermark_timestamp, watermark_timestamp, watermark_id, chunk_size)).fetchall()
+        if not rows:
+            break
+
+        hourly, daily = _fold(rows)
+        watermark_timestamp, watermark_id = rows[-1][0], rows[-1][1]
+        # Rollup rows and the watermark move together, so a crash mid-run
+        # never double counts a chunk.
+        _upsert(conn, 'lot_usage_hourly', 'hour', hourly)
+        _upsert(conn, 'lot_usage_daily', 'day', daily)
+        conn.execute('''
+            INSERT INTO rollup_state (name, watermark_timestamp, watermark_id, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (name) DO UPDATE SET
+                watermark_timestamp = excluded.watermark_timestamp,
+                watermark_id = excluded.watermark_id,
+                updated_at = excluded.updated_at
+        ''', (WATERMARK_NAME, watermark_timestamp, watermark_id))
+        conn.commit()
+        folded += len(rows)
+    return folded
+
+def lot_report(conn, lot_id, granularity='daily', start=None, end=None):
+    table, key_column = ('lot_usage_hourly', 'hour') if granularity == 'hourly' else ('lot_usage_daily', 'day')
+    query = f'SELECT {key_column} AS bucket, departures, occupied_hours, revenue FROM {table} WHERE lot_id = ?'
+    params = [lot_id]
+    if start:
+        query += f' AND {key_column} >= ?'
+        params.append(start)
+    if end:
+        query += f' AND {key_column} < ?'
+        params.append(end)
+    query += f' ORDER BY {key_column}'
+    return conn.execute(query, params).fetchall()
+
+def summary_report(conn, start=None, end=None):
+    query = '''
+        SELECT pl.id AS lot_id, pl.prime_location_name, pl.total_spots,
+               COALESCE(SUM(d.departures), 0) AS departures,
+               COALESCE(SUM(d.occupied_hours), 0) AS occupied_hours,
+               COALESCE(SUM(d.revenue), 0) AS revenue
+        FROM parking_lots pl
+        LEFT JOIN lot_usage_daily d ON d.lot_id = pl.id
+    '''
+    params = []
+    if start:
+        query += ' AND d.day >= ?'
+        params.append(start)
+    if end:
+        query += ' AND d.day < ?'
+        params.append(end)
+    query += ' GROUP BY pl.id ORDER BY pl.id'
+    return conn.execute(query, params).fetchall()
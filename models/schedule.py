@@ -0,0 +1,294 @@
+import threading
+from array import array
+from datetime import datetime, timedelta
+
+from models import eventlog
+from models.allocator import LOCK_STRIPES, spot_allocator
+from models.eventlog import event_log
+from models.pricing import price_table
+
+SLOT_MINUTES = 15
+DEFAULT_HORIZON_DAYS = 14
+DEFAULT_HOLD_MINUTES = 60
+CHECK_IN_GRACE_MINUTES = 15
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+EPOCH = datetime(2000, 1, 1)
+
+def to_slot(moment):
+    return int((moment - EPOCH).total_seconds() // (SLOT_MINUTES * 60))
+
+def from_slot(slot):
+    return EPOCH + timedelta(minutes=slot * SLOT_MINUTES)
+
+def slot_window(start, end):
+    # Windows snap outwards to whole slots: [floor(start), ceil(end)).
+    end_slot = to_slot(end)
+    if from_slot(end_slot) < end:
+        end_slot += 1
+    return to_slot(start), end_slot
+
+def parse_time(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+class SlotTree:
+    # Segment tree over a fixed run of time slots supporting "add n to every
+    # slot in [lo, hi)" and "largest value in [lo, hi)", both O(log n). Each
+    # node keeps the adds that covered it whole plus the max below it, so no
+    # lazy push-down is needed.
+    def __init__(self, base, slots):
+        self.base = base
+        self.size = 1 << max(1, (slots - 1).bit_length())
+        self._max = array('i', bytes(8 * self.size))
+        self._add = array('i', bytes(8 * self.size))
+
+    def covers(self, slot):
+        return slot <= self.base + self.size
+
+    def add(self, start, end, delta):
+        lo = max(start - self.base, 0)
+        hi = min(end - self.base, self.size)
+        if lo < hi:
+            self._update(1, 0, self.size, lo, hi, delta)
+
+    def _update(self, node, node_lo, node_hi, lo, hi, delta):
+        if lo <= node_lo and node_hi <= hi:
+            self._max[node] += delta
+            self._add[node] += delta
+            return
+        mid = (node_lo + node_hi) // 2
+        if lo < mid:
+            self._update(2 * node, node_lo, mid, lo, hi, delta)
+        if mid < hi:
+            self._update(2 * node + 1, mid, node_hi, lo, hi, delta)
+        self._max[node] = self._add[node] + max(self._max[2 * node], self._max[2 * node + 1])
+
+    def peak(self, start, end):
+        lo = max(start - self.base, 0)
+        hi = min(end - self.base, self.size)
+        if lo >= hi:
+            return 0
+        return self._query(1, 0, self.size, lo, hi)
+
+    def _query(self, node, node_lo, node_hi, lo, hi):
+        if lo <= node_lo and node_hi <= hi:
+            return self._max[node]
+        mid = (node_lo + node_hi) // 2
+        if hi <= mid:
+            best = self._query(2 * node, node_lo, mid, lo, hi)
+        elif lo >= mid:
+            best = self._query(2 * node + 1, mid, node_hi, lo, hi)
+        else:
+            best = max(self._query(2 * node, node_lo, mid, lo, hi),
+                       self._query(2 * node + 1, mid, node_hi, lo, hi))
+        return self._add[node] + best
+
+class LotSchedule:
+    __slots__ = ('tree', 'version')
+
+    def __init__(self, tree, version):
+        self.tree = tree
+        self.version = version
+
+class ScheduleIndex:
+    # Scheduled reservations hold capacity in a lot, not a particular spot:
+    # walk-in stays have no end time, so the spot is picked at check-in.
+    # Cars already parked are assumed to leave within hold_minutes, which is
+    # also how long before an arrival its capacity is closed to walk-ins.
+    def __init__(self, horizon_days=DEFAULT_HORIZON_DAYS, hold_minutes=DEFAULT_HOLD_MINUTES):
+        self._lots = {}
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._lock = threading.Lock()
+        self.configure(horizon_days, hold_minutes)
+
+    def configure(self, horizon_days=DEFAULT_HORIZON_DAYS, hold_minutes=DEFAULT_HOLD_MINUTES):
+        self.horizon_days = horizon_days
+        self.hold_minutes = hold_minutes
+        self.horizon_slots = horizon_days * 24 * 60 // SLOT_MINUTES
+        self.hold_slots = -(-hold_minutes // SLOT_MINUTES)
+        with self._lock:
+            self._lots = {}
+
+    def _lot_lock(self, lot_id):
+        return self._locks[hash(lot_id) % LOCK_STRIPES]
+
+    def _load(self, conn, lot_id, version, now):
+        # Twice the horizon, so the tree stays usable while time moves on.
+        tree = SlotTree(to_slot(now), 2 * self.horizon_slots)
+        rows = conn.execute('''
+            SELECT start_time, end_time FROM scheduled_reservations
+            WHERE lot_id = ? AND status = "scheduled" AND end_time > ?
+        ''', (lot_id, now.strftime(TIME_FORMAT)))
+        for row in rows:
+            tree.add(*slot_window(parse_time(row[0]), parse_time(row[1])), 1)
+        schedule = LotSchedule(tree, version)
+        self._lots[lot_id] = schedule
+        return schedule
+
+    def _lot(self, conn, lot_id, now):
+        lot = conn.execute('SELECT total_spots, available_spots, occupied_spots, schedule_version FROM parking_lots WHERE id = ?',
+                           (lot_id,)).fetchone()
+        if lot is None:
+            return None, None
+        with self._lot_lock(lot_id):
+            schedule = self._lots.get(lot_id)
+            if (schedule is None or schedule.version != lot['schedule_version']
+                    or not schedule.tree.covers(to_slot(now) + self.horizon_slots)):
+                schedule = self._load(conn, lot_id, lot['schedule_version'], now)
+        return lot, schedule
+
+    def _apply(self, lot_id, old_version, start, end, delta):
+        # Keeps the cached tree in step with a change this process just
+        # committed; if another worker got in between, reload next time.
+        with self._lot_lock(lot_id):
+            schedule = self._lots.get(lot_id)
+            if schedule is None:
+                return
+            if schedule.version != old_version:
+                self._lots.pop(lot_id, None)
+                return
+            schedule.tree.add(*slot_window(start, end), delta)
+            schedule.version = old_version + 1
+
+    def _free(self, lot, schedule, start, end, now):
+        start_slot, end_slot = slot_window(start, end)
+        held = schedule.tree.peak(start_slot, end_slot)
+        parked = lot['occupied_spots'] if start_slot < to_slot(now) + self.hold_slots else 0
+        return max(0, lot['total_spots'] - held - parked)
+
+    def free_spots(self, conn, lot_id, start, end, now=None):
+        now = now or datetime.now()
+        lot, schedule = self._lot(conn, lot_id, now)
+        if lot is None:
+            return None
+        return self._free(lot, schedule, max(start, now), end, now)
+
+    def walk_in_capacity(self, conn, lot_id, now=None):
+        # Free spots a walk-in may take without eating into capacity held
+        # for scheduled arrivals due within hold_minutes.
+        now = now or datetime.now()
+        lot, schedule = self._lot(conn, lot_id, now)
+        if lot is None:
+            return 0
+        slot = to_slot(now)
+        return max(0, lot['available_spots'] - schedule.tree.peak(slot, slot + self.hold_slots))
+
+    def validate_window(self, start, end, now=None):
+        now = now or datetime.now()
+        if end <= start:
+            raise ValueError('The reservation must end after it starts')
+        if end <= now:
+            raise ValueError('The reservation window is already over')
+        if end > now + timedelta(days=self.horizon_days):
+            raise ValueError(f'Reservations open {self.horizon_days} days ahead')
+
+    def reserve(self, conn, lot_id, user_id, start, end, now=None):
+        now = now or datetime.now()
+        self.validate_window(start, end, now)
+        start = max(start, now)
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Read inside the write lock so the check sees every other worker's holds.
+            lot, schedule = self._lot(conn, lot_id, now)
+            if lot is None or self._free(lot, schedule, start, end, now) <= 0:
+                conn.rollback()
+                return None
+            cursor = conn.execute('''
+                INSERT INTO scheduled_reservations (lot_id, user_id, start_time, end_time) VALUES (?, ?, ?, ?)
+            ''', (lot_id, user_id, start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT)))
+            conn.execute('UPDATE parking_lots SET schedule_version = schedule_version + 1 WHERE id = ?', (lot_id,))
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        self._apply(lot_id, lot['schedule_version'], start, end, 1)
+        return cursor.lastrowid
+
+    def _claim_row(self, conn, schedule_id, user_id):
+        return conn.execute('''
+            SELECT sr.lot_id, sr.start_time, sr.end_time, pl.schedule_version
+            FROM scheduled_reservations sr JOIN parking_lots pl ON sr.lot_id = pl.id
+            WHERE sr.id = ? AND sr.user_id = ? AND sr.status = "scheduled"
+        ''', (schedule_id, user_id)).fetchone()
+
+    def cancel(self, conn, schedule_id, user_id):
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self._claim_row(conn, schedule_id, user_id)
+            if row is None:
+                conn.rollback()
+                return None
+            conn.execute('UPDATE scheduled_reservations SET status = "cancelled" WHERE id = ?', (schedule_id,))
+            conn.execute('UPDATE parking_lots SET schedule_version = schedule_version + 1 WHERE id = ?', (row['lot_id'],))
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        self._apply(row['lot_id'], row['schedule_version'], parse_time(row['start_time']), parse_time(row['end_time']), -1)
+        return row['lot_id']
+
+    def check_in(self, conn, schedule_id, user_id, now=None):
+        # Turns a held slot into an ordinary active reservation in one
+        # transaction. Returns (lot_id, spot_id, reservation_id), or None.
+        now = now or datetime.now()
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        spot_ids = []
+        try:
+            row = self._claim_row(conn, schedule_id, user_id)
+            if row is None:
+                conn.rollback()
+                return None
+            start, end = parse_time(row['start_time']), parse_time(row['end_time'])
+            if now < start - timedelta(minutes=CHECK_IN_GRACE_MINUTES):
+                raise ValueError(f'Check-in opens {CHECK_IN_GRACE_MINUTES} minutes before {start:%Y-%m-%d %H:%M}')
+            if now >= end:
+                raise ValueError('This reservation has expired')
+            spot_ids = spot_allocator.claim_many(conn, row['lot_id'], 1)
+            if not spot_ids:
+                conn.rollback()
+                return None
+            # Held slots are charged at the rate for the hour they start in.
+            reservation = conn.execute('''
+                INSERT INTO reservations (spot_id, user_id, hourly_price)
+                SELECT ?, ?, ROUND(price * ?, 2) FROM parking_lots WHERE id = ?
+                RETURNING id, parking_timestamp, hourly_price
+            ''', (spot_ids[0], user_id, price_table.multiplier(row['lot_id'], start), row['lot_id'])).fetchone()
+            reservation_id = reservation[0]
+            conn.execute('UPDATE scheduled_reservations SET status = "checked_in", reservation_id = ? WHERE id = ?',
+                         (reservation_id, schedule_id))
+            conn.execute('UPDATE parking_lots SET schedule_version = schedule_version + 1 WHERE id = ?', (row['lot_id'],))
+            event_log.record(conn, [eventlog.booked(row['lot_id'], spot_ids[0], reservation_id, user_id, reservation[1], reservation[2])])
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            for spot_id in spot_ids:
+                spot_allocator.release(row['lot_id'], spot_id)
+            raise
+        # From here on the car counts as parked, not as a hold.
+        self._apply(row['lot_id'], row['schedule_version'], start, end, -1)
+        return row['lot_id'], spot_ids[0], reservation_id
+
+    def reset_lot(self, lot_id):
+        with self._lot_lock(lot_id):
+            self._lots.pop(lot_id, None)
+
+def upcoming(conn, user_id, now=None):
+    now = now or datetime.now()
+    return conn.execute('''
+        SELECT sr.*, pl.prime_location_name, pl.price FROM scheduled_reservations sr
+        JOIN parking_lots pl ON sr.lot_id = pl.id
+        WHERE sr.user_id = ? AND sr.status = "scheduled" AND sr.end_time > ?
+        ORDER BY sr.start_time
+    ''', (user_id, now.strftime(TIME_FORMAT))).fetchall()
+
+schedule_index = ScheduleIndex()
@@ -0,0 +1,68 @@
+import re
+
+from models.records import LotRecord, LOT_COLUMNS, select
+
+ORDERINGS = {
+    'price': 'price ASC, id ASC',
+    'price_desc': 'price DESC, id ASC',
+    'available': 'available_spots DESC, id ASC',
+}
+
+SORT_KEYS = {
+    'price': lambda lot: (lot.price, lot.id),
+    'price_desc': lambda lot: (-lot.price, lot.id),
+    'available': lambda lot: (-lot.available_spots, lot.id),
+}
+
+MAX_RESULTS = 100
+
+def fts_query(text):
+    # Quoting keeps FTS5 operators in user input from being parsed as
+    # syntax. Only the last word is a prefix, so a half-typed query still
+    # matches without every earlier word fanning out to its completions.
+    words = re.findall(r'\w+', text or '')
+    if not words:
+        return ''
+    return ' '.join([f'"{word}"' for word in words[:-1]] + [f'"{words[-1]}"*'])
+
+def sort_key(order):
+    # Python twin of ORDERINGS, for merging results from several shards.
+    return SORT_KEYS.get(order, SORT_KEYS['price'])
+
+def pin_range(prefix):
+    # A half-open range lets the pin_code index serve prefix lookups
+    # without depending on case_sensitive_like.
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def search_lots(conn, text=None, pin_prefix=None, min_price=None, max_price=None,
+                order='price', limit=20, only_available=True):
+    clauses = []
+    params = []
+    match = fts_query(text)
+    if match:
+        clauses.append('id IN (SELECT rowid FROM lots_fts WHERE lots_fts MATCH ?)')
+        params.append(match)
+    if pin_prefix:
+        low, high = pin_range(pin_prefix)
+        clauses.append('pin_code >= ? AND pin_code < ?')
+        params.extend((low, high))
+    # Ranked by free spots, walking the availability index and filtering
+    # on price finds the top rows sooner than sorting a wide price range.
+    price = '+price' if order == 'available' else 'price'
+    if min_price is not None:
+        clauses.append(f'{price} >= ?')
+        params.append(min_price)
+    if max_price is not None:
+        clauses.append(f'{price} <= ?')
+        params.append(max_price)
+    if only_available:
+        clauses.append('available_spots > 0')
+
+    where = ' AND '.join(clauses) if clauses else '1'
+    params.append(max(1, min(limit, MAX_RESULTS)))
+    return select(conn, LotRecord, f'''
+        SELECT {LOT_COLUMNS} FROM parking_lots
+        WHERE {where}
+        ORDER BY {ORDERINGS.get(order, ORDERINGS['price'])}
+        LIMIT ?
+    ''', params).fetchall()
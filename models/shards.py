@@ -0,0 +1,140 @@
+import heapq
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from models import migrations, pool
+
+# Every shard hands out lot, spot, reservation and schedule ids from its own
+# range, so an id alone says which file holds the row. Shard 0 is the main
+# database and starts at 0, which keeps unsharded ids as they are.
+SHARD_ID_BITS = 40
+SHARDED_TABLES = ('parking_lots', 'parking_spots', 'reservations', 'scheduled_reservations')
+ACCOUNTS_SCHEMA = 'accounts'
+
+def shard_path(path, shard):
+    if shard == 0:
+        return path
+    stem, ext = os.path.splitext(path)
+    return f'{stem}-{shard}{ext}'
+
+def id_base(shard):
+    return shard << SHARD_ID_BITS
+
+def reserve_id_range(conn, shard):
+    base = id_base(shard)
+    for table in SHARDED_TABLES:
+        updated = conn.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?',
+                               (base, table, base)).rowcount
+        if not updated and not conn.execute('SELECT 1 FROM sqlite_sequence WHERE name = ?', (table,)).fetchone():
+            conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, base))
+
+def attach_accounts(main_path):
+    # Users stay on the main database. Other shards read them through a
+    # temp view, which shadows the shard's own empty users table.
+    def setup(conn):
+        conn.execute(f'ATTACH DATABASE ? AS {ACCOUNTS_SCHEMA}', (main_path,))
+        conn.execute(f'CREATE TEMP VIEW IF NOT EXISTS users AS SELECT * FROM {ACCOUNTS_SCHEMA}.users')
+    return setup
+
+class ShardMap:
+    def __init__(self, database='parking_app.db', count=1):
+        self._executor = None
+        self._lock = threading.Lock()
+        self.configure(database, count)
+
+    def configure(self, database, count=1):
+        if count < 1 or count > 1 << (63 - SHARD_ID_BITS):
+            raise ValueError(f'Unsupported shard count: {count}')
+        self.database = database
+        self.paths = [shard_path(database, shard) for shard in range(count)]
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = ThreadPoolExecutor(max_workers=count, thread_name_prefix='shard') if count > 1 else None
+
+    @property
+    def count(self):
+        return len(self.paths)
+
+    @property
+    def shards(self):
+        return range(len(self.paths))
+
+    def shard_of(self, record_id):
+        # Ids from a shard that is not configured fall back to the main
+        # database, where the lookup then simply finds nothing.
+        shard = (record_id or 0) >> SHARD_ID_BITS
+        return shard if 0 <= shard < len(self.paths) else 0
+
+    def connection(self, shard=0):
+        return pool.get_connection(self.paths[shard])
+
+    def connection_for(self, record_id):
+        return self.connection(self.shard_of(record_id))
+
+    def archive_path(self, path, shard):
+        return shard_path(path, shard)
+
+    def gather(self, query):
+        # Runs query(conn, shard) on every shard and returns the results in
+        # shard order. Other shards are read in parallel, each on a pooled
+        # connection of its own, since worker threads have no app context.
+        if self._executor is None:
+            return [query(self.connection(0), 0)]
+
+        def run(shard):
+            conn = pool.get_pool(self.paths[shard]).acquire()
+            try:
+                return query(conn, shard)
+            finally:
+                conn.release()
+        return list(self._executor.map(run, self.shards))
+
+    def merge(self, results, key=None, limit=-1, reverse=False):
+        # Each shard's result must already be sorted by key.
+        merged = heapq.merge(*results, key=key, reverse=reverse)
+        return list(merged) if limit < 0 else [row for row, _ in zip(merged, range(limit))]
+
+    def place_lot(self):
+        # New lots go to the shard with the fewest spots, which spreads
+        # bookings, and so write locks, evenly.
+        if len(self.paths) == 1:
+            return 0
+        spots = self.gather(lambda conn, shard: tuple(conn.execute(
+            'SELECT COALESCE(SUM(total_spots), 0), COUNT(*) FROM parking_lots').fetchone()))
+        return min(self.shards, key=lambda shard: (spots[shard], shard))
+
+    def migrate(self):
+        # Returns [(shard, [(version, description), ...])] for every shard.
+        # Shards are migrated on plain connections so the accounts view
+        # does not stand in for their own users table.
+        applied = []
+        for shard, path in enumerate(self.paths):
+            conn = sqlite3.connect(path)
+            conn.row_factory = sqlite3.Row
+            try:
+                if migrations.is_current(conn):
+                    applied.append((shard, []))
+                    continue
+                applied.append((shard, migrations.migrate(conn)))
+                if shard:
+                    reserve_id_range(conn, shard)
+                    conn.commit()
+            finally:
+                conn.close()
+        return applied
+
+shard_map = ShardMap()
+
+def init_app(app):
+    shard_map.configure(app.config['DATABASE'], app.config['DATABASE_SHARDS'])
+    for path in shard_map.paths[1:]:
+        pool.configure_pool(path,
+                            size=app.config['DATABASE_POOL_SIZE'],
+                            busy_timeout=app.config['DATABASE_BUSY_TIMEOUT'],
+                            synchronous=app.config['DATABASE_SYNCHRONOUS'],
+                            cache_size=app.config['DATABASE_CACHE_SIZE'],
+                            cached_statements=app.config['DATABASE_CACHED_STATEMENTS'],
+                            setup=attach_accounts(app.config['DATABASE']))
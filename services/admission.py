@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import deque
+
+from models.allocator import spot_allocator
+
+DEFAULT_RATE = 0.5
+DEFAULT_BURST = 5
+DEFAULT_QUEUE_DEPTH = 32
+DEFAULT_QUEUE_TIMEOUT = 5.0
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, message, retry_after=None):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBuckets:
+    # One bucket per key, refilled at rate tokens a second up to burst.
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        # Returns 0 when a token was taken, else the seconds until one is due.
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / self.rate
+            if len(self._buckets) > 10000:
+                # Buckets that have refilled completely carry no state.
+                refill = self.burst / self.rate
+                self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < refill}
+            self._buckets[key] = (tokens - 1, now)
+            return 0
+
+class BookingAdmission:
+    # Sits in front of walk-in bookings. Users are rate limited, lots this
+    # worker knows to be full are turned away without touching the
+    # database, and the rest wait in a bounded first-come queue per lot so
+    # only one booking per lot contends for the write lock at a time.
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, queue_depth=DEFAULT_QUEUE_DEPTH,
+                 queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self._queues = {}
+        self._lock = threading.Lock()
+        self.observer = None
+        self.configure(rate, burst, queue_depth, queue_timeout)
+
+    def configure(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, queue_depth=DEFAULT_QUEUE_DEPTH,
+                  queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.buckets = TokenBuckets(rate, burst)
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+
+    def _observe(self, outcome, waited=0.0):
+        if self.observer is not None:
+            self.observer(outcome, waited)
+
+    def _reject(self, reason, message, retry_after=None):
+        self._observe(reason)
+        return AdmissionRejected(reason, message, retry_after)
+
+    def _enqueue(self, lot_id):
+        with self._lock:
+            waiters = self._queues.setdefault(lot_id, deque())
+            if len(waiters) > self.queue_depth:
+                return None
+            turn = threading.Event()
+            waiters.append(turn)
+            if len(waiters) == 1:
+                turn.set()
+        return turn
+
+    def _leave(self, lot_id, turn):
+        with self._lock:
+            waiters = self._queues[lot_id]
+            if waiters[0] is turn:
+                waiters.popleft()
+                if waiters:
+                    waiters[0].set()
+            else:
+                waiters.remove(turn)
+            if not waiters:
+                del self._queues[lot_id]
+
+    def queued(self, lot_id):
+        return max(0, len(self._queues.get(lot_id, ())) - 1)
+
+    def acquire(self, user_id, lot_id):
+        # Returns a turn to pass to release() once the booking is done, or
+        # raises AdmissionRejected.
+        if spot_allocator.known_full(lot_id):
+            raise self._reject('full', 'No available spots in this lot!')
+        retry_after = self.buckets.take(user_id)
+        if retry_after:
+            raise self._reject('rate_limited', 'You are booking too quickly, please try again shortly!', retry_after)
+
+        started = time.monotonic()
+        turn = self._enqueue(lot_id)
+        if turn is None:
+            raise self._reject('queue_full', 'This lot is very busy right now, please try again shortly!',
+                               self.queue_timeout)
+        if not turn.wait(self.queue_timeout):
+            with self._lock:
+                # The turn may have come up just as the wait ran out.
+                timed_out = not turn.is_set()
+            if timed_out:
+                self._leave(lot_id, turn)
+                raise self._reject('queue_timeout', 'This lot is very busy right now, please try again shortly!',
+                                   self.queue_timeout)
+        # The lot may have filled up while we waited.
+        if spot_allocator.known_full(lot_id):
+            self._leave(lot_id, turn)
+            raise self._reject('full', 'No available spots in this lot!')
+        self._observe('admitted', time.monotonic() - started)
+        return turn
+
+    def release(self, lot_id, turn):
+        self._leave(lot_id, turn)
+
+booking_admission = BookingAdmission()
+
+def init_app(app):
+    booking_admission.configure(app.config['BOOKING_RATE'], app.config['BOOKING_BURST'],
+                                app.config['BOOKING_QUEUE_DEPTH'], app.config['BOOKING_QUEUE_TIMEOUT'])
+    spot_allocator.full_ttl = app.config['BOOKING_FULL_TTL']
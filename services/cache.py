@@ -0,0 +1,49 @@
+import hashlib
+import threading
+import time
+
+class CacheEntry:
+    __slots__ = ('body', 'etag', 'expires_at')
+
+    def __init__(self, body, etag, expires_at):
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+
+class ResponseCache:
+    def __init__(self, ttl=5.0):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at < time.monotonic():
+            return None
+        return entry
+
+    def set(self, key, body):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        # Content-derived tags stay valid across TTL refreshes and workers.
+        etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+        entry = CacheEntry(body, etag, time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_lot(self, lot_id):
+        with self._lock:
+            self._entries.pop(('lots',), None)
+            self._entries.pop(('availability', lot_id), None)
+            self._entries.pop(('spots', lot_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+api_cache = ResponseCache()
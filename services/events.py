@@ -0,0 +1,85 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+class Subscription:
+    def __init__(self, lot_id, maxsize):
+        self.lot_id = lot_id
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class SpotEventBus:
+    def __init__(self, history=2000, subscriber_queue_size=500):
+        # Event ids are "<epoch>-<seq>" so ids from a previous process are
+        # recognised as unusable and the client gets a fresh snapshot.
+        self.epoch = str(int(time.time()))
+        self.subscriber_queue_size = subscriber_queue_size
+        self._seq = 0
+        self._history = deque(maxlen=history)
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def event_id(self, seq):
+        return f'{self.epoch}-{seq}'
+
+    def parse_event_id(self, event_id):
+        epoch, _, seq = (event_id or '').partition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def current_seq(self):
+        return self._seq
+
+    def publish(self, lot_id, data):
+        with self._lock:
+            self._seq += 1
+            event = (self._seq, lot_id, data)
+            self._history.append(event)
+            subscribers = list(self._subscribers.get(lot_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                subscription.overflowed = True
+        return event[0]
+
+    def subscribe(self, lot_id):
+        subscription = Subscription(lot_id, self.subscriber_queue_size)
+        with self._lock:
+            self._subscribers.setdefault(lot_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.lot_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.lot_id]
+
+    def replay(self, lot_id, after_seq):
+        with self._lock:
+            if after_seq > self._seq:
+                return None
+            if after_seq < self._seq and (not self._history or self._history[0][0] > after_seq + 1):
+                return None
+            return [event for event in self._history if event[0] > after_seq and event[1] == lot_id]
+
+def format_event(event_id, data, event=None):
+    lines = []
+    if event:
+        lines.append(f'event: {event}')
+    lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data, separators=(",", ":"))}')
+    return '\n'.join(lines) + '\n\n'
+
+spot_events = SpotEventBus()
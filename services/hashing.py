@@ -0,0 +1,123 @@
+import hashlib
+import hmac
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+class HashingBusy(Exception):
+    pass
+
+def canonical_method(method):
+    # How werkzeug spells a method in the hashes it writes, with defaults
+    # filled in: 'pbkdf2' and 'pbkdf2:sha256:600000' name the same thing.
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f'scrypt:{n}:{r}:{p}'
+    if name == 'pbkdf2':
+        if len(args) > 2:
+            raise ValueError("'pbkdf2' takes 2 arguments.")
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    return method
+
+class PasswordHasher:
+    def __init__(self, method=DEFAULT_METHOD, workers=None, max_pending=64, cache_ttl=300, timeout=30):
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.configure(method, workers, max_pending, cache_ttl, timeout)
+        # Verified logins are remembered under a keyed digest that includes
+        # the stored hash, so a password change invalidates them at once.
+        self._cache_key = os.urandom(32)
+        self._verified = {}
+        self._verified_lock = threading.Lock()
+
+    def configure(self, method=DEFAULT_METHOD, workers=None, max_pending=64, cache_ttl=300, timeout=30):
+        self.shutdown()
+        self.method = method
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_pending = max_pending
+        self.cache_ttl = cache_ttl
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._canonical_method = canonical_method(method)
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    methods = multiprocessing.get_all_start_methods()
+                    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    def _run(self, function, *args):
+        if self.workers <= 0:
+            return function(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            return self._get_executor().submit(function, *args).result(timeout=self.timeout)
+        finally:
+            self._slots.release()
+
+    def _cache_token(self, username, stored_hash, password):
+        message = '\0'.join((username, stored_hash, password)).encode('utf-8')
+        return hmac.new(self._cache_key, message, hashlib.sha256).digest()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def hash_many(self, passwords, method=None):
+        # For bulk imports. Hashes go to the pool a few per worker at a time,
+        # so a login queued behind an import waits for one wave, not all of it.
+        method = method or self.method
+        if self.workers <= 0:
+            return [generate_password_hash(password, method) for password in passwords]
+        hashes = []
+        wave = self.workers * 4
+        for start in range(0, len(passwords), wave):
+            batch = passwords[start:start + wave]
+            hashes.extend(self._get_executor().map(generate_password_hash, batch, itertools.repeat(method),
+                                                   timeout=self.timeout))
+        return hashes
+
+    def verify(self, username, stored_hash, password):
+        token = self._cache_token(username, stored_hash, password)
+        now = time.monotonic()
+        expires_at = self._verified.get(token)
+        if expires_at is not None and expires_at > now:
+            return True
+
+        valid = self._run(check_password_hash, stored_hash, password)
+        if valid and self.cache_ttl > 0:
+            with self._verified_lock:
+                if len(self._verified) > 10000:
+                    self._verified = {key: value for key, value in self._verified.items() if value > now}
+                self._verified[token] = now + self.cache_ttl
+        return valid
+
+    def needs_rehash(self, stored_hash):
+        return stored_hash.split('$', 1)[0] != self._canonical_method
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+password_hasher = PasswordHasher()
+
+def init_app(app):
+    password_hasher.configure(app.config['PASSWORD_HASH_METHOD'],
+                              app.config['PASSWORD_HASH_WORKERS'],
+                              app.config['PASSWORD_HASH_MAX_PENDING'],
+                              app.config['PASSWORD_VERIFY_CACHE_TTL'])
@@ -0,0 +1,180 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, has_request_context, request
+
+from models import pool
+from services.admission import booking_admission
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+slow_query_log = logging.getLogger('parking.slow_queries')
+
+_whitespace = re.compile(r'\s+')
+_placeholder_list = re.compile(r'\?(\s*,\s*\?)+')
+
+def normalize_sql(sql, limit=120):
+    sql = _placeholder_list.sub('?, ...', _whitespace.sub(' ', sql).strip())
+    return sql if len(sql) <= limit else sql[:limit - 3] + '...'
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+class HistogramFamily:
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            child = self.children.get(labels)
+            if child is None:
+                child = self.children[labels] = Histogram(self.buckets)
+            child.observe(value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            children = [(labels, list(child.counts), child.total, child.count)
+                        for labels, child in self.children.items()]
+        for labels, counts, total, count in children:
+            label_text = format_labels(self.label_names, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label_text}{"," if label_text else ""}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label_text}{"," if label_text else ""}le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return lines
+
+class CounterFamily:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            lines.append(f'{self.name}{{{format_labels(self.label_names, labels)}}} {value}')
+        return lines
+
+def format_labels(names, values):
+    return ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values))
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Metrics:
+    def __init__(self, slow_query_seconds=0.1):
+        self.slow_query_seconds = slow_query_seconds
+        self.request_latency = HistogramFamily(
+            'parking_http_request_duration_seconds', 'Time to build a response, by route.',
+            ('method', 'route', 'status'), LATENCY_BUCKETS)
+        self.queries_per_request = HistogramFamily(
+            'parking_db_queries_per_request', 'SQL statements executed per request.',
+            ('route',), QUERY_COUNT_BUCKETS)
+        self.statement_latency = HistogramFamily(
+            'parking_db_statement_duration_seconds', 'Time spent executing each SQL statement.',
+            ('statement',), LATENCY_BUCKETS)
+        self.lock_wait = HistogramFamily(
+            'parking_db_lock_wait_seconds', 'Time spent in BEGIN IMMEDIATE and COMMIT waiting for the write lock.',
+            ('operation',), LATENCY_BUCKETS)
+        self.db_errors = CounterFamily(
+            'parking_db_errors_total', 'SQL statements that raised, by kind.', ('kind',))
+        self.slow_queries = CounterFamily(
+            'parking_db_slow_queries_total', 'SQL statements slower than the slow query threshold.', ('statement',))
+        self.admission = CounterFamily(
+            'parking_booking_admission_total', 'Walk-in booking attempts by admission outcome.', ('outcome',))
+        self.admission_wait = HistogramFamily(
+            'parking_booking_queue_wait_seconds', 'Time admitted bookings spent queued behind others for the lot.',
+            (), LATENCY_BUCKETS)
+        self._families = (self.request_latency, self.queries_per_request, self.statement_latency,
+                          self.lock_wait, self.db_errors, self.slow_queries, self.admission, self.admission_wait)
+        self._normalized = {}
+
+    def statement_label(self, sql):
+        label = self._normalized.get(sql)
+        if label is None:
+            label = normalize_sql(sql)
+            # Statements are parametrised, so this stays bounded in practice.
+            if len(self._normalized) < 10000:
+                self._normalized[sql] = label
+        return label
+
+    def observe_statement(self, sql, elapsed, error):
+        label = self.statement_label(sql)
+        self.statement_latency.observe((label,), elapsed)
+        keyword = label.split(' ', 1)[0].upper()
+        if keyword in ('BEGIN', 'COMMIT'):
+            self.lock_wait.observe((keyword,), elapsed)
+        if error is not None:
+            locked = isinstance(error, sqlite3.OperationalError) and 'locked' in str(error)
+            self.db_errors.inc(('locked' if locked else type(error).__name__,))
+        if elapsed >= self.slow_query_seconds:
+            self.slow_queries.inc((label,))
+            slow_query_log.warning('slow query (%.1f ms): %s', elapsed * 1000, label)
+        if has_request_context():
+            g._query_count = g.get('_query_count', 0) + 1
+
+    def observe_admission(self, outcome, waited):
+        self.admission.inc((outcome,))
+        if outcome == 'admitted':
+            self.admission_wait.observe((), waited)
+
+    def before_request(self):
+        g._request_started = time.perf_counter()
+        g._query_count = 0
+
+    def after_request(self, response):
+        started = g.pop('_request_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            self.request_latency.observe((request.method, route, str(response.status_code)),
+                                         time.perf_counter() - started)
+            self.queries_per_request.observe((route,), g.pop('_query_count', 0))
+        return response
+
+    def render(self):
+        lines = []
+        for family in self._families:
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+def init_app(app):
+    metrics = Metrics(app.config['SLOW_QUERY_MS'] / 1000)
+    pool.set_statement_observer(metrics.observe_statement)
+    booking_admission.observer = metrics.observe_admission
+    app.before_request(metrics.before_request)
+    app.after_request(metrics.after_request)
+    app.add_url_rule('/metrics', 'metrics',
+                     lambda: Response(metrics.render(), mimetype='text/plain; version=0.0.4'))
+    app.extensions['parking_metrics'] = metrics
+    return metrics
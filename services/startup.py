@@ -0,0 +1,59 @@
+import logging
+import threading
+import time
+
+startup_log = logging.getLogger('parking.startup')
+
+class Startup:
+    # Per-process start-up work, run on the first request rather than at
+    # import so a new worker is accepting connections as soon as it loads.
+    # The bootstrap runs once before that request is served; warm-up tasks
+    # then run in a background thread while requests keep flowing.
+    def __init__(self):
+        self.bootstrap = None
+        self.tasks = []
+
+    def warmup(self, task):
+        self.tasks.append(task)
+        return task
+
+    def init_app(self, app):
+        state = app.extensions['parking_startup'] = AppStartup(self, app)
+        app.before_request(state.before_request)
+        return state
+
+class AppStartup:
+    # One app's run of the start-up work; warm-up tasks run in its app context.
+    def __init__(self, startup, app):
+        self.startup = startup
+        self.app = app
+        self.warm = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            # Left unset if the bootstrap fails, so the next request retries.
+            if self.startup.bootstrap is not None:
+                self.startup.bootstrap()
+            self._started = True
+        threading.Thread(target=self._warm_up, name='warmup', daemon=True).start()
+
+    def _warm_up(self):
+        with self.app.app_context():
+            for task in self.startup.tasks:
+                started = time.perf_counter()
+                try:
+                    task()
+                except Exception:
+                    startup_log.exception('Warm-up task %s failed', task.__name__)
+                else:
+                    startup_log.info('Warm-up task %s took %.1f ms', task.__name__,
+                                     (time.perf_counter() - started) * 1000)
+        self.warm.set()
+
+startup = Startup()
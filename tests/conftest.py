@@ -0,0 +1,81 @@
+import pytest
+
+import app as parking_app
+from models import pool
+from models.database import ParkingLot, User
+from models.provisioning import build_layout
+from models.shards import shard_map
+
+TEST_CONFIG = {
+    'TESTING': True,
+    'SECRET_KEY': 'test',
+    'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+    'PASSWORD_HASH_WORKERS': 0,
+    'METRICS_ENABLED': False,
+    'WARMUP_ENABLED': False,
+    'PRICING_INTERVAL': 0,
+    'BOOKING_RATE': 0,
+}
+
+def make_app(tmp_path, **config):
+    app = parking_app.create_app({
+        **TEST_CONFIG,
+        'DATABASE': str(tmp_path / 'parking_app.db'),
+        'ARCHIVE_DATABASE': str(tmp_path / 'parking_archive.db'),
+        **config,
+    })
+    parking_app.init_database()
+    return app
+
+@pytest.fixture
+def app_config():
+    # Overridden by modules that need other settings.
+    return {}
+
+@pytest.fixture
+def app(tmp_path, monkeypatch, app_config):
+    monkeypatch.chdir(tmp_path)
+    app = make_app(tmp_path, **app_config)
+    yield app
+    for path in shard_map.paths:
+        pool.get_pool(path).close_all()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def log_in(client, user_id, username, is_admin=False):
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['username'] = username
+        session['is_admin'] = is_admin
+
+@pytest.fixture
+def admin_client(client):
+    log_in(client, User.get_by_username('admin').id, 'admin', is_admin=True)
+    return client
+
+@pytest.fixture
+def user(app):
+    return User.create_user('driver', 'unused', 'driver@example.com', '555-0100'), 'driver'
+
+@pytest.fixture
+def user_client(client, user):
+    log_in(client, *user)
+    return client
+
+def create_lot(spots=5, name='Central', price=10.0, address='1 Main Road', pin_code='560001', levels=1, ev_spots=0):
+    return ParkingLot.create_lot(name, price, address, pin_code, spots, build_layout(spots, levels, ev_spots))
+
+def create_users(count, prefix='user'):
+    return [User.create_user(f'{prefix}{n}', 'unused', None, None) for n in range(count)]
+
+def lot_counters(conn, lot_id):
+    return tuple(conn.execute('SELECT total_spots, available_spots, occupied_spots FROM parking_lots WHERE id = ?',
+                              (lot_id,)).fetchone())
+
+@pytest.fixture
+def db(app):
+    conn = pool.get_pool(shard_map.paths[0]).acquire()
+    yield conn
+    conn.release()
@@ -0,0 +1,145 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import create_lot, create_users
+from models.allocator import spot_allocator
+from models.database import ParkingSpot
+from models.schedule import schedule_index
+from services import admission
+from services.admission import AdmissionRejected, BookingAdmission, TokenBuckets
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, 'monotonic', lambda: now[0])
+    return now
+
+def test_token_buckets_allow_a_burst_then_refill(clock):
+    buckets = TokenBuckets(rate=0.5, burst=2)
+
+    assert buckets.take('driver') == 0
+    assert buckets.take('driver') == 0
+    assert buckets.take('driver') == pytest.approx(2.0)
+    # Other users have buckets of their own.
+    assert buckets.take('other') == 0
+
+    clock[0] += 1
+    assert buckets.take('driver') == pytest.approx(1.0)
+    clock[0] += 1
+    assert buckets.take('driver') == 0
+
+def test_zero_rate_disables_rate_limiting():
+    buckets = TokenBuckets(rate=0, burst=1)
+    assert all(buckets.take('driver') == 0 for _ in range(10))
+
+def test_known_full_lots_are_rejected_without_queueing(app, db):
+    gate = BookingAdmission(rate=0.001, burst=1)
+    lot_id = create_lot(spots=1)
+    spot_allocator.load_lot(db, lot_id)
+    spot_allocator.mark_full(lot_id)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        gate.acquire('driver', lot_id)
+
+    assert rejected.value.reason == 'full'
+    assert gate.queued(lot_id) == 0
+    # The rejection did not cost the user their token.
+    gate.release(8, gate.acquire('driver', 8))
+
+def test_rate_limited_users_are_told_when_to_retry(app):
+    gate = BookingAdmission(rate=0.25, burst=1)
+    gate.release(1, gate.acquire('driver', 1))
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        gate.acquire('driver', 1)
+
+    assert rejected.value.reason == 'rate_limited'
+    assert rejected.value.retry_after == pytest.approx(4.0, abs=0.1)
+
+def test_waiters_are_served_in_arrival_order(app):
+    gate = BookingAdmission(rate=0, queue_depth=5, queue_timeout=5)
+    first = gate.acquire('holder', 1)
+    served = []
+
+    def book(user):
+        turn = gate.acquire(user, 1)
+        served.append(user)
+        gate.release(1, turn)
+
+    threads = []
+    for n in range(3):
+        threads.append(threading.Thread(target=book, args=(f'user{n}',)))
+        threads[-1].start()
+        while gate.queued(1) < n + 1:
+            time.sleep(0.001)
+    gate.release(1, first)
+    for thread in threads:
+        thread.join()
+
+    assert served == ['user0', 'user1', 'user2']
+    assert gate.queued(1) == 0
+
+def test_a_full_queue_turns_bookings_away(app):
+    gate = BookingAdmission(rate=0, queue_depth=0, queue_timeout=3)
+    turn = gate.acquire('holder', 1)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        gate.acquire('driver', 1)
+
+    assert rejected.value.reason == 'queue_full'
+    assert rejected.value.retry_after == 3
+    gate.release(1, turn)
+    gate.release(1, gate.acquire('driver', 1))
+
+def test_waits_give_up_after_the_queue_timeout(app):
+    gate = BookingAdmission(rate=0, queue_timeout=0.05)
+    turn = gate.acquire('holder', 1)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        gate.acquire('driver', 1)
+
+    assert rejected.value.reason == 'queue_timeout'
+    assert gate.queued(1) == 0
+    gate.release(1, turn)
+
+@pytest.mark.parametrize('app_config', [{'BOOKING_RATE': 0.01, 'BOOKING_BURST': 2}])
+def test_json_bookings(user_client):
+    lot_id = create_lot(spots=1)
+
+    response = user_client.post('/user/book_parking', json={'lot_id': lot_id})
+    assert response.status_code == 201
+    assert response.get_json()['lot_id'] == lot_id
+
+    # The lot is now known to be full, so this does not use up a token.
+    response = user_client.post('/user/book_parking', json={'lot_id': lot_id})
+    assert response.status_code == 409
+    assert response.get_json() == {'error': 'No available spots in this lot!', 'reason': 'full'}
+
+    other_lot = create_lot(spots=2)
+    response = user_client.post('/user/book_parking', json={'lot_id': other_lot})
+    assert response.status_code == 201
+
+    response = user_client.post('/user/book_parking', json={'lot_id': other_lot})
+    assert response.status_code == 429
+    assert response.get_json()['reason'] == 'rate_limited'
+    assert int(response.headers['Retry-After']) == 100
+
+def test_json_booking_of_an_unknown_lot(user_client):
+    for _ in range(2):
+        response = user_client.post('/user/book_parking', json={'lot_id': 999})
+        assert response.status_code == 404
+
+    assert not spot_allocator.known_full(999)
+    assert 999 not in spot_allocator._full_until
+
+def test_lots_held_for_arrivals_are_marked_full(app, db):
+    lot_id = create_lot(spots=1)
+    walk_in, arriving = create_users(2)
+    now = datetime.now()
+    schedule_index.reserve(db, lot_id, arriving, now + timedelta(minutes=30), now + timedelta(hours=2))
+
+    assert ParkingSpot.book_spot(lot_id, walk_in) is None
+    assert spot_allocator.known_full(lot_id)
@@ -0,0 +1,101 @@
+import threading
+
+from conftest import create_lot, create_users
+from models import pool
+from models.allocator import SpotAllocator, spot_allocator
+from models.database import ParkingLot, ParkingSpot, Reservation
+from models.shards import shard_map
+
+def book_concurrently(book, user_ids):
+    results = [None] * len(user_ids)
+    start = threading.Barrier(len(user_ids))
+
+    def run(index, user_id):
+        start.wait()
+        results[index] = book(user_id)
+
+    threads = [threading.Thread(target=run, args=(index, user_id)) for index, user_id in enumerate(user_ids)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def active_spots(conn, lot_id):
+    return [row[0] for row in conn.execute('''
+        SELECT r.spot_id FROM reservations r JOIN parking_spots ps ON r.spot_id = ps.id
+        WHERE ps.lot_id = ? AND r.status = "active"
+    ''', (lot_id,))]
+
+def test_concurrent_bookings_never_share_a_spot(app, db):
+    lot_id = create_lot(spots=5)
+    user_ids = create_users(20)
+
+    results = book_concurrently(lambda user_id: ParkingSpot.book_spot(lot_id, user_id), user_ids)
+
+    booked = [result for result in results if result]
+    assert len(booked) == 5
+    assert len({spot_id for spot_id, _ in booked}) == 5
+    assert sorted(active_spots(db, lot_id)) == sorted(spot_id for spot_id, _ in booked)
+    assert db.execute('SELECT COUNT(*) FROM parking_spots WHERE lot_id = ? AND status = "A"',
+                      (lot_id,)).fetchone()[0] == 0
+
+def test_workers_with_stale_free_lists_never_share_a_spot(app, db):
+    # Two allocators stand in for two worker processes, each with its own
+    # free list, so every spot is offered twice.
+    lot_id = create_lot(spots=4)
+    user_ids = create_users(12)
+    workers = [SpotAllocator(), SpotAllocator()]
+
+    def book(user_id):
+        conn = pool.get_pool(shard_map.paths[0]).acquire()
+        try:
+            return workers[user_id % 2].book(conn, lot_id, user_id)
+        finally:
+            conn.release()
+
+    results = book_concurrently(book, user_ids)
+
+    booked = [result for result in results if result]
+    assert len(booked) == 4
+    assert len({spot_id for spot_id, _ in booked}) == 4
+    assert len(active_spots(db, lot_id)) == 4
+
+def test_released_spot_is_handed_out_again(app, db):
+    lot_id = create_lot(spots=1)
+    first, second = create_users(2)
+    spot_id, reservation_id = ParkingSpot.book_spot(lot_id, first)
+    assert ParkingSpot.book_spot(lot_id, second) is None
+
+    assert Reservation.release_reservation(reservation_id, first) is not None
+    assert ParkingSpot.book_spot(lot_id, second)[0] == spot_id
+
+def test_lowest_spot_ids_go_first(app):
+    lot_id = create_lot(spots=3)
+    first, second = create_users(2)
+    spots = [ParkingSpot.book_spot(lot_id, user_id)[0] for user_id in (first, second)]
+    assert spots == sorted(spots)
+    assert spot_allocator.available(lot_id) == 1
+
+def test_unknown_lots_leave_nothing_behind(app, db):
+    user_id, = create_users(1)
+    lot_id = create_lot(spots=1)
+    ParkingSpot.book_spot(lot_id, user_id)
+
+    assert spot_allocator.book(db, 999, user_id) is None
+    assert spot_allocator.claim_many(db, 999, 2) == []
+    assert not spot_allocator.is_loaded(999)
+    # A full lot is still known, just with nothing free.
+    assert spot_allocator.load_lot(db, lot_id)
+    assert spot_allocator.is_loaded(lot_id) and spot_allocator.available(lot_id) == 0
+
+def test_deleting_a_lot_drops_what_was_kept_for_it(app, db):
+    lot_id = create_lot(spots=1)
+    spot_allocator.load_lot(db, lot_id)
+    spot_allocator.mark_full(lot_id)
+
+    ParkingLot.delete_lot(lot_id)
+
+    assert not spot_allocator.is_loaded(lot_id)
+    assert lot_id not in spot_allocator._full_until
+    assert not spot_allocator.load_lot(db, lot_id)
@@ -0,0 +1,47 @@
+from conftest import create_lot, create_users
+from models.database import ParkingSpot
+
+def test_availability_is_served_with_an_etag(client):
+    lot_id = create_lot(spots=3)
+    response = client.get(f'/api/v1/lots/{lot_id}/availability')
+
+    assert response.status_code == 200
+    assert response.get_json() == {'lot_id': lot_id, 'total_spots': 3, 'available_spots': 3, 'occupied_spots': 0}
+    assert response.headers['ETag']
+    assert response.cache_control.max_age is not None
+
+def test_matching_etag_gets_not_modified(client):
+    lot_id = create_lot(spots=3)
+    etag = client.get(f'/api/v1/lots/{lot_id}/availability').headers['ETag']
+
+    response = client.get(f'/api/v1/lots/{lot_id}/availability', headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+def test_booking_invalidates_the_cached_responses(client):
+    lot_id = create_lot(spots=3)
+    user_id, = create_users(1)
+    etag = client.get(f'/api/v1/lots/{lot_id}/availability').headers['ETag']
+    client.get('/api/v1/lots')
+
+    ParkingSpot.book_spot(lot_id, user_id)
+
+    response = client.get(f'/api/v1/lots/{lot_id}/availability', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['available_spots'] == 2
+    assert client.get('/api/v1/lots').get_json()['lots'][0]['occupied_spots'] == 1
+
+def test_lot_listing_and_spot_layout(client):
+    lot_id = create_lot(spots=2, ev_spots=1)
+
+    lots = client.get('/api/v1/lots').get_json()['lots']
+    assert [(lot['id'], lot['total_spots']) for lot in lots] == [(lot_id, 2)]
+
+    spots = client.get(f'/api/v1/lots/{lot_id}/spots').get_json()['spots']
+    assert [(spot['status'], spot['ev_capable']) for spot in spots] == [('A', True), ('A', False)]
+
+def test_unknown_lot_is_not_found(client):
+    assert client.get('/api/v1/lots/999/availability').status_code == 404
+    assert client.get('/api/v1/lots/999/spots').status_code == 404
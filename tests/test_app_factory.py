@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+import app as parking_app
+from conftest import TEST_CONFIG, create_lot, make_app
+from models import migrations, pool
+from models.allocator import spot_allocator
+from models.database import ParkingSpot, User
+from models.pricing import price_table
+from models.shards import shard_map
+from services.cache import api_cache
+
+@pytest.fixture
+def new_app(tmp_path, monkeypatch):
+    # create_app() alone, without the schema set up ahead of time.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('PARKING_SETTINGS', raising=False)
+    apps = []
+
+    def build(**config):
+        apps.append(parking_app.create_app({
+            **TEST_CONFIG,
+            'DATABASE': str(tmp_path / 'parking_app.db'),
+            'ARCHIVE_DATABASE': str(tmp_path / 'parking_archive.db'),
+            **config,
+        }))
+        return apps[-1]
+    yield build
+    for path in shard_map.paths:
+        pool.get_pool(path).close_all()
+
+def test_settings_come_from_defaults_file_environment_then_arguments(tmp_path, monkeypatch):
+    settings = tmp_path / 'settings.py'
+    settings.write_text("PAGE_SIZE = 7\nSEARCH_LIMIT = 9\nAPI_CACHE_TTL = 1.5\n")
+    monkeypatch.setenv('PARKING_SETTINGS', str(settings))
+    monkeypatch.setenv('SEARCH_LIMIT', '11')
+    monkeypatch.setenv('WARMUP_ENABLED', '0')
+
+    app = parking_app.create_app({'API_CACHE_TTL': 3.0, 'DATABASE': str(tmp_path / 'parking_app.db')})
+
+    assert app.config['PAGE_SIZE'] == 7
+    assert app.config['SEARCH_LIMIT'] == 11
+    assert app.config['WARMUP_ENABLED'] is False
+    assert app.config['API_CACHE_TTL'] == api_cache.ttl == 3.0
+    assert app.config['BOOKING_BURST'] == parking_app.SETTINGS['BOOKING_BURST'][1]
+
+def test_creating_an_app_does_not_touch_the_database(new_app, tmp_path):
+    new_app()
+    assert not os.path.exists(tmp_path / 'parking_app.db')
+
+def test_the_first_request_brings_the_schema_up(new_app, tmp_path):
+    app = new_app()
+
+    assert app.test_client().get('/').status_code == 200
+
+    conn = pool.get_pool(str(tmp_path / 'parking_app.db')).acquire()
+    assert migrations.is_current(conn)
+    conn.release()
+    with app.app_context():
+        assert User.get_by_username('admin') is not None
+
+def test_warm_up_runs_after_the_first_request(new_app, tmp_path):
+    make_app(tmp_path)
+    lot_id = create_lot(spots=3)
+    app = new_app(WARMUP_ENABLED=True)
+    assert not spot_allocator.is_loaded(lot_id)
+
+    app.test_client().get('/')
+
+    assert app.extensions['parking_startup'].warm.wait(5)
+    assert spot_allocator.available(lot_id) == 3
+
+def test_apps_are_independent(new_app, tmp_path):
+    first = new_app(PAGE_SIZE=3)
+    second = new_app(PAGE_SIZE=4)
+
+    assert first is not second
+    assert first.config['PAGE_SIZE'] == 3 and second.config['PAGE_SIZE'] == 4
+    assert first.extensions['parking_startup'] is not second.extensions['parking_startup']
+    assert first.test_client().get('/').status_code == second.test_client().get('/').status_code == 200
+
+def test_caches_do_not_carry_over_to_a_new_app(new_app, tmp_path):
+    make_app(tmp_path)
+    lot_id = create_lot(spots=1)
+    ParkingSpot.book_spot(lot_id, User.create_user('driver', 'unused', None, None))
+    price_table.publish({lot_id: [2.0] * 168})
+    api_cache.set(('lots',), b'[]')
+    assert spot_allocator.is_loaded(lot_id)
+
+    new_app()
+
+    assert not spot_allocator.is_loaded(lot_id)
+    assert not spot_allocator.known_full(lot_id)
+    assert price_table.multiplier(lot_id) == 1.0
+    assert api_cache.get(('lots',)) is None
+
+def test_metrics_follow_the_setting(new_app):
+    with_metrics = new_app(METRICS_ENABLED=True)
+    assert with_metrics.test_client().get('/metrics').status_code == 200
+    assert pool._statement_observer is not None
+
+    without_metrics = new_app(METRICS_ENABLED=False)
+    assert without_metrics.test_client().get('/metrics').status_code == 404
+    assert pool._statement_observer is None
+
+def test_commands_sit_at_the_top_level_of_the_cli(new_app):
+    app = new_app()
+    assert {'migrate', 'reprice', 'rollup', 'check-counters'} <= set(app.cli.commands)
+
+    result = app.test_cli_runner().invoke(args=['migrate'])
+    assert result.exit_code == 0
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import create_lot, create_users
+from models import archive, rollups
+from models.database import Reservation
+
+@pytest.fixture
+def spot(app, db):
+    lot_id = create_lot(spots=1, price=10.0)
+    user_id, = create_users(1)
+    spot_id = db.execute('SELECT id FROM parking_spots WHERE lot_id = ?', (lot_id,)).fetchone()[0]
+    return lot_id, spot_id, user_id
+
+@pytest.fixture
+def archive_path(app):
+    return app.config['ARCHIVE_DATABASE']
+
+def add_history(db, spot):
+    # Two stays old enough to archive and one from today.
+    _, spot_id, user_id = spot
+    today = datetime.now().replace(microsecond=0) - timedelta(minutes=10)
+    db.executemany('''
+        INSERT INTO reservations (spot_id, user_id, parking_timestamp, leaving_timestamp, parking_cost, status)
+        VALUES (?, ?, ?, ?, ?, 'completed')
+    ''', [(spot_id, user_id, '2023-01-01 08:00:00', '2023-01-01 10:00:00', 20.0),
+          (spot_id, user_id, '2023-02-01 08:00:00', '2023-02-01 09:00:00', 10.0),
+          (spot_id, user_id, str(today - timedelta(hours=1)), str(today), 10.0)])
+    db.commit()
+
+def totals(db, lot_id):
+    return [tuple(row) for row in rollups.lot_report(db, lot_id, 'daily')]
+
+def hot_count(db):
+    return db.execute('SELECT COUNT(*) FROM main.reservations').fetchone()[0]
+
+def test_only_folded_stays_are_archived(db, spot, archive_path):
+    add_history(db, spot)
+    assert archive.archive_reservations(db, archive_path, older_than_days=90) == 0
+
+    rollups.run_rollup(db)
+    assert archive.archive_reservations(db, archive_path, older_than_days=90, chunk_size=1) == 2
+    assert hot_count(db) == 1
+    assert db.execute('SELECT COUNT(*) FROM archive.reservations WHERE lot_id = ?', (spot[0],)).fetchone()[0] == 2
+
+def test_rollup_totals_survive_archive_and_rebuild(db, spot, archive_path):
+    add_history(db, spot)
+    rollups.run_rollup(db)
+    before = totals(db, spot[0])
+    archive.archive_reservations(db, archive_path, older_than_days=90)
+
+    assert totals(db, spot[0]) == before
+    rollups.run_rollup(db, rebuild=True, archive_path=archive_path)
+    assert totals(db, spot[0]) == before
+
+def test_rebuild_counts_a_stay_caught_mid_archive_once(db, spot, archive_path):
+    add_history(db, spot)
+    rollups.run_rollup(db)
+    before = totals(db, spot[0])
+    archive.archive_reservations(db, archive_path, older_than_days=90)
+    # As if a run stopped between copying a row and deleting it.
+    db.execute('''
+        INSERT INTO main.reservations (id, spot_id, user_id, parking_timestamp, leaving_timestamp, parking_cost, status)
+        SELECT id, spot_id, user_id, parking_timestamp, leaving_timestamp, parking_cost, status
+        FROM archive.reservations LIMIT 1
+    ''')
+    db.commit()
+
+    rollups.run_rollup(db, rebuild=True, archive_path=archive_path)
+    assert totals(db, spot[0]) == before
+
+def test_rebuild_command_folds_archived_history(admin_client, db, spot, archive_path):
+    add_history(db, spot)
+    runner = admin_client.application.test_cli_runner()
+    runner.invoke(args=['rollup'])
+    result = runner.invoke(args=['archive', '--older-than', '90'])
+    assert f'Moved 2 reservations to {archive_path}' in result.output
+
+    result = runner.invoke(args=['rollup', '--rebuild'])
+    assert 'Folded 3 completed reservations' in result.output
+
+def test_history_includes_archived_stays(db, spot, archive_path):
+    add_history(db, spot)
+    rollups.run_rollup(db)
+    archive.archive_reservations(db, archive_path, older_than_days=90)
+
+    history = Reservation.get_user_history(spot[2], archive_path=archive_path)
+
+    stamps = [row['parking_timestamp'] for row in history]
+    assert len(stamps) == 3 and stamps[1:] == ['2023-02-01 08:00:00', '2023-01-01 08:00:00']
+    assert {row['prime_location_name'] for row in history} == {'Central'}
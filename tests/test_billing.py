@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import create_lot, create_users
+from models import billing
+from models.billing import Tariff
+from models.database import Reservation
+
+TIERED = Tariff('exact', [(2, 1.0), (None, 0.5)])
+CAPPED = Tariff('exact', daily_cap=100)
+
+@pytest.mark.parametrize('tariff, hours, expected', [
+    (Tariff(), 2.5, 25.0),
+    (Tariff('hour'), 2.1, 30.0),
+    (Tariff('hour'), 0, 0.0),
+    (TIERED, 4, 30.0),
+    (TIERED, 1, 10.0),
+    # A capped full day, then six hours of the next.
+    (CAPPED, 30, 160.0),
+    (Tariff(), -1, 0.0),
+])
+def test_quote(tariff, hours, expected):
+    assert tariff.quote(hours, 10.0) == pytest.approx(expected)
+
+@pytest.mark.parametrize('with_numpy', [True, False])
+def test_batch_quotes_match_single_quotes(monkeypatch, with_numpy):
+    if not with_numpy:
+        monkeypatch.setattr(billing, '_numpy', False)
+    elif billing.numpy_module() is None:
+        pytest.skip('numpy is not installed')
+    hours = [0, 0.5, 2, 23.9, 24, 49.5]
+    prices = [10.0, 12.5, 8.0, 10.0, 20.0, 5.0]
+    for tariff in (Tariff(), Tariff('hour'), TIERED, CAPPED):
+        assert list(tariff.quote_many(hours, prices)) == pytest.approx(
+            [tariff.quote(h, p) for h, p in zip(hours, prices)])
+
+def test_tariff_round_trips_through_json():
+    tariff = Tariff.from_json(TIERED.to_json())
+    assert (tariff.rounding, tariff.tiers, tariff.daily_cap) == (TIERED.rounding, TIERED.tiers, TIERED.daily_cap)
+    assert Tariff.from_json(None) is billing.DEFAULT_TARIFF
+
+def test_unknown_rounding_is_rejected():
+    with pytest.raises(ValueError):
+        Tariff('minute')
+
+def completed_stay(db, spot_id, user_id, hours, hourly_price=None):
+    return db.execute('''
+        INSERT INTO reservations (spot_id, user_id, parking_timestamp, leaving_timestamp, status, hourly_price)
+        VALUES (?, ?, '2024-01-01 08:00:00', datetime('2024-01-01 08:00:00', ?), 'completed', ?)
+    ''', (spot_id, user_id, f'+{hours * 60} minutes', hourly_price)).lastrowid
+
+def test_settle_reprices_completed_stays_with_the_lot_tariff(app, db):
+    lot_id = create_lot(spots=1, price=10.0)
+    user_id, = create_users(1)
+    spot_id = db.execute('SELECT id FROM parking_spots WHERE lot_id = ?', (lot_id,)).fetchone()[0]
+    short = completed_stay(db, spot_id, user_id, 1)
+    long = completed_stay(db, spot_id, user_id, 4, hourly_price=12.0)
+    db.commit()
+    runner = app.test_cli_runner()
+    runner.invoke(args=['set-tariff', str(lot_id), '--tier', '2:1.0', '--tier', '-:0.5'])
+
+    dry_run = runner.invoke(args=['settle', '--dry-run'])
+    assert 'Would settle 2 reservations totalling ₹46.00' in dry_run.output
+    assert db.execute('SELECT COUNT(*) FROM reservations WHERE parking_cost IS NOT NULL').fetchone()[0] == 0
+
+    assert billing.settle_reservations(db, chunk_size=1) == (2, pytest.approx(46.0))
+    costs = dict(db.execute('SELECT id, parking_cost FROM reservations').fetchall())
+    # The long stay is billed at the rate it was booked at.
+    assert costs == {short: pytest.approx(10.0), long: pytest.approx(36.0)}
+
+def test_release_bills_with_the_lot_tariff(app, db):
+    lot_id = create_lot(spots=1, price=10.0)
+    user_id, = create_users(1)
+    spot_id = db.execute('SELECT id FROM parking_spots WHERE lot_id = ?', (lot_id,)).fetchone()[0]
+    db.execute('UPDATE parking_lots SET tariff = ? WHERE id = ?', (Tariff('hour').to_json(), lot_id))
+    arrived = (datetime.now() - timedelta(minutes=90)).strftime('%Y-%m-%d %H:%M:%S')
+    reservation_id = db.execute('INSERT INTO reservations (spot_id, user_id, parking_timestamp) VALUES (?, ?, ?)',
+                                (spot_id, user_id, arrived)).lastrowid
+    db.commit()
+
+    # An hour and a half, rounded up to two.
+    assert Reservation.release_reservation(reservation_id, user_id) == pytest.approx(20.0)
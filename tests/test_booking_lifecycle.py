@@ -0,0 +1,56 @@
+import random
+import sqlite3
+
+import pytest
+
+from benchmarks import booking_lifecycle
+
+def result(p95_ms=10.0, throughput_rps=100.0, double_bookings=0):
+    return {'double_bookings': double_bookings,
+            'routes': {'POST /user/book_parking': {'p95_ms': p95_ms, 'throughput_rps': throughput_rps}}}
+
+def test_percentile():
+    samples = [5, 1, 4, 2, 3]
+    assert booking_lifecycle.percentile(samples, 0.5) == 3
+    assert booking_lifecycle.percentile(samples, 0.99) == 5
+    assert booking_lifecycle.percentile([], 0.5) == 0.0
+
+@pytest.mark.parametrize('current, regressed', [
+    (result(), False),
+    (result(p95_ms=10.9), False),
+    (result(p95_ms=11.5), True),
+    (result(throughput_rps=85), True),
+    (result(double_bookings=1), True),
+])
+def test_compare_flags_regressions_beyond_the_threshold(current, regressed):
+    assert bool(booking_lifecycle.compare(current, result(), 0.10)) == regressed
+
+@pytest.fixture
+def seeded(tmp_path):
+    database = str(tmp_path / 'bench.db')
+    lot_ids, users = booking_lifecycle.seed(database, lots=2, spots_per_lot=4, users=3, history=20,
+                                            rng=random.Random(1))
+    conn = sqlite3.connect(database)
+    yield database, conn, lot_ids, users
+    conn.close()
+
+def test_seed_builds_lots_users_and_history(seeded):
+    _, conn, lot_ids, users = seeded
+    assert len(lot_ids) == 2 and users == 3
+    assert conn.execute('SELECT SUM(total_spots) FROM parking_lots').fetchone()[0] == 8
+    assert conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 4
+    assert conn.execute('SELECT COUNT(*) FROM reservations WHERE status = "completed"').fetchone()[0] == 20
+
+def test_double_bookings_and_inconsistent_spots_are_counted(seeded):
+    database, conn, _, _ = seeded
+    assert booking_lifecycle.count_double_bookings(database) == (0, 0)
+
+    conn.execute('INSERT INTO reservations (spot_id, user_id) VALUES (1, 2)')
+    conn.commit()
+    assert booking_lifecycle.count_double_bookings(database) == (0, 0)
+
+    # A second active stay on the same spot, and a spot marked taken with none.
+    conn.execute('INSERT INTO reservations (spot_id, user_id) VALUES (1, 3)')
+    conn.execute('UPDATE parking_spots SET status = "O" WHERE id = 2')
+    conn.commit()
+    assert booking_lifecycle.count_double_bookings(database) == (1, 1)
@@ -0,0 +1,122 @@
+import csv
+import io
+import json
+
+from datetime import datetime
+
+import pytest
+
+from conftest import create_lot, create_users
+from models import archive, bulk
+from models.database import User
+from models.shards import SHARD_ID_BITS, shard_map
+from services.hashing import password_hasher
+
+def ndjson(records):
+    return ''.join(json.dumps(record) + '\n' for record in records)
+
+def export(client, kind, fmt='ndjson'):
+    response = client.get(f'/admin/export/{kind}?format={fmt}')
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+def upload(client, kind, text, filename='data.ndjson'):
+    return client.post(f'/admin/import/{kind}', data={'file': (io.BytesIO(text.encode()), filename)},
+                       content_type='multipart/form-data')
+
+def stay(spot_id, user_id, day, **fields):
+    return {'spot_id': spot_id, 'user_id': user_id, 'parking_timestamp': f'2024-01-{day:02d} 08:00:00',
+            'leaving_timestamp': f'2024-01-{day:02d} 10:00:00', 'parking_cost': 20.0, **fields}
+
+def test_lots_round_trip_through_export_and_import(admin_client, db):
+    create_lot(spots=3, name='Central')
+    create_lot(spots=2, name='Riverside', price=25.0)
+    exported = export(admin_client, 'lots')
+    db.execute('DELETE FROM parking_spots')
+    db.execute('DELETE FROM parking_lots')
+    db.commit()
+
+    response = upload(admin_client, 'lots', exported)
+
+    assert response.get_json() == {'kind': 'lots', 'imported': 2, 'skipped': 0}
+    rows = db.execute('SELECT prime_location_name, price, total_spots FROM parking_lots ORDER BY id').fetchall()
+    assert [tuple(row) for row in rows] == [('Central', 10.0, 3), ('Riverside', 25.0, 2)]
+
+def test_csv_export_has_a_header_and_one_row_per_lot(admin_client):
+    create_lot(spots=3, name='Central, East')
+    rows = list(csv.reader(io.StringIO(export(admin_client, 'lots', 'csv'))))
+    assert rows[0] == bulk.EXPORT_COLUMNS['lots']
+    assert [row[1] for row in rows[1:]] == ['Central, East']
+
+def test_imported_passwords_are_hashed_and_never_exported(admin_client):
+    response = upload(admin_client, 'users', ndjson([
+        {'username': 'driver', 'password': 'secret', 'email': 'd@example.com'},
+        {'username': 'admin', 'password': 'hijack'},
+    ]))
+
+    assert response.get_json()['imported'] == 1
+    stored = User.get_by_username('driver').password
+    assert stored.startswith('pbkdf2:sha256:1000$')
+    assert password_hasher.verify('driver', stored, 'secret')
+    assert password_hasher.verify('admin', User.get_by_username('admin').password, 'admin123')
+    assert 'password' not in export(admin_client, 'users')
+
+def test_reservation_import_is_idempotent(admin_client, db):
+    lot_id = create_lot(spots=1)
+    user_id, = create_users(1)
+    spot_id = db.execute('SELECT id FROM parking_spots WHERE lot_id = ?', (lot_id,)).fetchone()[0]
+    records = ndjson([stay(spot_id, user_id, 1, id=500), stay(spot_id, user_id, 2), stay(999, user_id, 3)])
+
+    assert upload(admin_client, 'reservations', records).get_json() == \
+        {'kind': 'reservations', 'imported': 2, 'skipped': 1}
+    assert upload(admin_client, 'reservations', records).get_json()['imported'] == 0
+    assert db.execute('SELECT COUNT(*) FROM reservations').fetchone()[0] == 2
+
+def test_bad_records_are_rejected_with_their_position(admin_client, db):
+    lot_id = create_lot(spots=1)
+    user_id, = create_users(1)
+    spot_id = db.execute('SELECT id FROM parking_spots WHERE lot_id = ?', (lot_id,)).fetchone()[0]
+
+    response = upload(admin_client, 'reservations', ndjson([stay(spot_id, user_id, 1, status='active')]))
+
+    assert response.status_code == 400
+    assert 'Chunk starting at record 1' in response.get_json()['error']
+    assert admin_client.get('/admin/export/bogus').status_code == 404
+
+def test_reservation_export_includes_archived_history_first(admin_client, db):
+    lot_id = create_lot(spots=1)
+    user_id, = create_users(1)
+    spot_id = db.execute('SELECT id FROM parking_spots WHERE lot_id = ?', (lot_id,)).fetchone()[0]
+    recent = str(datetime.now().replace(microsecond=0))
+    upload(admin_client, 'reservations', ndjson([stay(spot_id, user_id, 1, leaving_timestamp=recent),
+                                                 stay(spot_id, user_id, 2, parking_timestamp='2023-01-01 08:00:00',
+                                                      leaving_timestamp='2023-01-01 10:00:00')]))
+    archive.archive_reservations(db, admin_client.application.config['ARCHIVE_DATABASE'], 90, require_rollup=False)
+    assert db.execute('SELECT id FROM main.reservations').fetchall()[0][0] == 1
+
+    exported = [json.loads(line) for line in export(admin_client, 'reservations').splitlines()]
+
+    assert [record['id'] for record in exported] == [2, 1]
+    assert exported[0]['lot_id'] == lot_id
+
+@pytest.mark.parametrize('app_config', [{'DATABASE_SHARDS': 2}])
+def test_sharded_import_keeps_ids_in_the_spot_shard(admin_client, app_config):
+    create_lot(spots=1, name='Main')
+    far_lot = create_lot(spots=1, name='Far')
+    assert shard_map.shard_of(far_lot) == 1
+    user_id, = create_users(1)
+    conn = shard_map.connection(1)
+    try:
+        spot_id = conn.execute('SELECT id FROM parking_spots WHERE lot_id = ?', (far_lot,)).fetchone()[0]
+    finally:
+        conn.close()
+    # One id from the main database's range and one from the shard's own.
+    own_id = (1 << SHARD_ID_BITS) + 500
+    records = ndjson([stay(spot_id, user_id, 1, id=7), stay(spot_id, user_id, 2, id=own_id)])
+
+    assert upload(admin_client, 'reservations', records).get_json()['imported'] == 2
+    assert upload(admin_client, 'reservations', records).get_json()['imported'] == 0
+
+    ids = [record['id'] for record in map(json.loads, export(admin_client, 'reservations').splitlines())]
+    assert len(ids) == 2 and own_id in ids
+    assert all(shard_map.shard_of(reservation_id) == 1 for reservation_id in ids)
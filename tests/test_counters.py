@@ -0,0 +1,72 @@
+from conftest import create_lot, create_users, lot_counters
+from models import counters
+from models.database import ParkingLot, ParkingSpot, Reservation
+
+def assert_consistent(db, lot_id, expected):
+    assert lot_counters(db, lot_id) == expected
+    assert counters.find_drift(db) == []
+
+def test_counters_follow_bookings_and_releases(app, db):
+    lot_id = create_lot(spots=3)
+    assert_consistent(db, lot_id, (3, 3, 0))
+
+    first, second = create_users(2)
+    _, reservation_id = ParkingSpot.book_spot(lot_id, first)
+    ParkingSpot.book_spot(lot_id, second)
+    assert_consistent(db, lot_id, (3, 1, 2))
+
+    Reservation.release_reservation(reservation_id, first)
+    assert_consistent(db, lot_id, (3, 2, 1))
+
+def test_counters_follow_batch_bookings_and_releases(app, db):
+    lot_id = create_lot(spots=5)
+    user_id, = create_users(1)
+    booked = Reservation.book_batch(user_id, 4, lot_id)
+    assert_consistent(db, lot_id, (5, 1, 4))
+
+    Reservation.release_batch(user_id, [reservation_id for _, _, reservation_id in booked[:3]])
+    assert_consistent(db, lot_id, (5, 4, 1))
+
+def test_counters_stay_consistent_after_resize(app, db):
+    lot_id = create_lot(spots=4)
+    user_id, = create_users(1)
+    ParkingSpot.book_spot(lot_id, user_id)
+
+    ParkingLot.update_lot(lot_id, 'Central', 10.0, '1 Main Road', '560001', 6)
+    assert_consistent(db, lot_id, (6, 5, 1))
+
+    # The occupied spot survives a shrink below it.
+    ParkingLot.update_lot(lot_id, 'Central', 10.0, '1 Main Road', '560001', 0)
+    assert_consistent(db, lot_id, (1, 0, 1))
+
+def test_counters_stay_consistent_after_delete(app, db):
+    kept = create_lot(spots=2)
+    deleted = create_lot(spots=3, name='Riverside')
+    user_id, = create_users(1)
+    ParkingSpot.book_spot(kept, user_id)
+
+    ParkingLot.delete_lot(deleted)
+
+    assert db.execute('SELECT COUNT(*) FROM parking_spots WHERE lot_id = ?', (deleted,)).fetchone()[0] == 0
+    assert_consistent(db, kept, (2, 1, 1))
+    assert counters.get_totals(db) == (2, 1, 1)
+
+def test_cannot_delete_a_lot_with_parked_cars(admin_client, db):
+    lot_id = create_lot(spots=2)
+    user_id, = create_users(1)
+    ParkingSpot.book_spot(lot_id, user_id)
+
+    response = admin_client.get(f'/admin/delete_lot/{lot_id}', follow_redirects=True)
+
+    assert b'Cannot delete lot with occupied spots' in response.data
+    assert_consistent(db, lot_id, (2, 1, 1))
+
+def test_drift_is_found_and_repaired(app, db):
+    lot_id = create_lot(spots=3)
+    db.execute('UPDATE parking_lots SET available_spots = 7 WHERE id = ?', (lot_id,))
+    db.commit()
+
+    assert counters.find_drift(db) == [(lot_id, (3, 7, 0), (3, 3, 0))]
+    result = app.test_cli_runner().invoke(args=['check-counters', '--repair'])
+    assert 'Rebuilt counters for 1 lot(s)' in result.output
+    assert_consistent(db, lot_id, (3, 3, 0))
@@ -0,0 +1,119 @@
+import pytest
+
+from conftest import create_lot, create_users, log_in
+from models.database import ParkingLot, ParkingSpot, Reservation
+from models.records import LotRecord
+
+# Unknown on shard 0, in the range of a shard that is not configured, and
+# too large for an SQLite integer.
+BAD_IDS = [999, 2 ** 45, 2 ** 64]
+
+def flashes(client):
+    with client.session_transaction() as session:
+        return [message for category, message in session.pop('_flashes', [])]
+
+def test_records_read_by_attribute_name_and_index(app):
+    lot_id = create_lot(spots=3, name='Central')
+    lot = ParkingLot.get_lot_by_id(lot_id)
+
+    assert isinstance(lot, LotRecord)
+    assert not hasattr(lot, '__dict__')
+    assert lot.prime_location_name == lot['prime_location_name'] == lot[1] == 'Central'
+    assert dict(lot)['available_spots'] == 3
+
+def test_reservations_drive_spot_status(app, db):
+    lot_id = create_lot(spots=1)
+    user_id, = create_users(1)
+
+    spot_id, reservation_id = ParkingSpot.book_spot(lot_id, user_id)
+    assert db.execute('SELECT status FROM parking_spots WHERE id = ?', (spot_id,)).fetchone()[0] == 'O'
+    assert ParkingSpot.book_spot(lot_id, user_id) is None
+
+    assert Reservation.release_reservation(reservation_id, user_id) is not None
+    assert db.execute('SELECT status FROM parking_spots WHERE id = ?', (spot_id,)).fetchone()[0] == 'A'
+    # Releasing twice bills nothing.
+    assert Reservation.release_reservation(reservation_id, user_id) is None
+
+def test_release_is_refused_for_another_user(app):
+    lot_id = create_lot(spots=1)
+    owner, other = create_users(2)
+    _, reservation_id = ParkingSpot.book_spot(lot_id, owner)
+
+    assert Reservation.release_reservation(reservation_id, other) is None
+    assert [reservation.id for reservation in Reservation.get_active_reservations(owner)] == [reservation_id]
+
+@pytest.mark.parametrize('bad_id', BAD_IDS)
+@pytest.mark.parametrize('method, path', [
+    ('GET', '/admin/edit_lot/{}'),
+    ('POST', '/admin/edit_lot/{}'),
+    ('GET', '/admin/delete_lot/{}'),
+    ('GET', '/admin/view_spots/{}'),
+])
+def test_admin_pages_report_unknown_lots(admin_client, method, path, bad_id):
+    response = admin_client.open(path.format(bad_id), method=method, data={
+        'name': 'X', 'price': '1', 'address': 'A', 'pin_code': '1', 'max_spots': '2'})
+
+    if bad_id > 2 ** 63:
+        assert response.status_code == 404
+    else:
+        assert response.status_code == 302
+        assert flashes(admin_client) == ['Parking lot not found!']
+
+def test_deleting_an_unknown_lot_is_refused(app):
+    with pytest.raises(ValueError, match='not found'):
+        ParkingLot.delete_lot(999)
+
+@pytest.mark.parametrize('bad_id', BAD_IDS)
+@pytest.mark.parametrize('path', [
+    '/api/v1/lots/{}/availability',
+    '/api/v1/lots/{}/spots',
+    '/api/v1/reports/lots/{}',
+])
+def test_apis_answer_404_for_unknown_lots(admin_client, path, bad_id):
+    response = admin_client.get(path.format(bad_id))
+    assert response.status_code == 404
+
+@pytest.mark.parametrize('bad_id', BAD_IDS)
+def test_query_string_ids_out_of_range_are_ignored(admin_client, bad_id):
+    lot_id = create_lot(spots=2)
+
+    assert admin_client.get(f'/admin/dashboard?after={bad_id}').status_code == 200
+    assert admin_client.get(f'/admin/view_spots/{lot_id}?after={bad_id}&level={bad_id}').status_code == 200
+    assert admin_client.get(f'/admin/reports?lot_id={bad_id}').status_code == 200
+
+@pytest.mark.parametrize('bad_id', BAD_IDS)
+def test_user_routes_report_unknown_ids(user_client, bad_id):
+    response = user_client.post('/user/book_parking', json={'lot_id': bad_id})
+    assert response.status_code == 404
+
+    response = user_client.post('/user/book_parking', data={'lot_id': str(bad_id)})
+    assert response.status_code == 302
+    assert flashes(user_client) == ['Parking lot not found!']
+
+    response = user_client.get(f'/user/release_spot/{bad_id}')
+    assert response.status_code == (404 if bad_id > 2 ** 63 else 302)
+    if response.status_code == 302:
+        assert flashes(user_client) == ['Reservation not found!']
+
+@pytest.mark.parametrize('bad_id, status', [(999, 409), (2 ** 45, 409), (2 ** 64, 400)])
+def test_batch_apis_reject_unknown_ids(user_client, bad_id, status):
+    create_lot(spots=2)
+
+    response = user_client.post('/api/v1/bookings/batch', json={'count': 1, 'lot_id': bad_id})
+    assert response.status_code == status
+    assert response.get_json().get('booked', 0) == 0
+
+    response = user_client.post('/api/v1/bookings/release', json={'reservation_ids': [bad_id]})
+    assert response.status_code == (400 if status == 400 else 200)
+    assert response.get_json().get('released', 0) == 0
+
+def test_release_of_someone_elses_reservation_is_reported(client, user):
+    lot_id = create_lot(spots=1)
+    owner, = create_users(1)
+    _, reservation_id = ParkingSpot.book_spot(lot_id, owner)
+    log_in(client, *user)
+
+    client.get(f'/user/release_spot/{reservation_id}')
+
+    assert flashes(client) == ['Reservation not found!']
+    assert Reservation.get_active_reservations(owner)
@@ -0,0 +1,153 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from conftest import create_lot, create_users
+from models import counters, eventlog
+from models.database import ParkingLot, ParkingSpot, Reservation
+from models.eventlog import EventLogGap, LogState, event_log
+
+def churn():
+    # Bookings, releases, a batch, a grown and a shrunk lot and a deleted one.
+    users = create_users(3)
+    busy, resized, doomed = (create_lot(spots=spots) for spots in (4, 3, 2))
+    stays = [ParkingSpot.book_spot(busy, user_id)[1] for user_id in users]
+    Reservation.release_reservation(stays[1], users[1])
+    ParkingSpot.book_spot(resized, users[1])
+    ParkingLot.update_lot(resized, 'Resized', 10.0, '1 Main Road', '560001', 6)
+    ParkingLot.update_lot(busy, 'Busy', 10.0, '1 Main Road', '560001', 3)
+    Reservation.book_batch(users[2], 2, resized)
+    ParkingLot.delete_lot(doomed)
+    return busy, resized, users
+
+def assert_replay_matches(conn, state):
+    assert counters.compare_counts(conn, state.counts()) == []
+    free = {}
+    for spot_id, lot_id in conn.execute('SELECT id, lot_id FROM parking_spots WHERE status = "A"'):
+        free.setdefault(lot_id, set()).add(spot_id)
+    assert {lot_id: spots for lot_id, spots in state.free_spots().items() if spots} == free
+
+def segment_paths():
+    log = event_log.shard(0)
+    return [log.segment_path(segment) for segment in log.segments()]
+
+def test_records_round_trip(tmp_path):
+    at = datetime(2024, 5, 1, 9, 30)
+    event = eventlog.booked(1, 2, 3, 4, at, 12.5)._replace(lsn=7)
+    path = tmp_path / 'segment.log'
+    path.write_bytes(eventlog.pack(event, 0, 1))
+
+    assert list(eventlog.read_segment(path)) == [(0, 1, event)]
+    assert eventlog.from_micros(event.at) == at
+
+def test_ranges_round_trip():
+    assert eventlog.to_ranges({5, 1, 2, 3, 7, 8}) == [[1, 3], [5, 5], [7, 8]]
+    assert eventlog.from_ranges([[1, 3], [7, 8]]) == {1, 2, 3, 7, 8}
+
+def test_replay_from_the_start_equals_the_tables(app, db):
+    churn()
+
+    state = event_log.replay(db, 0, LogState())
+
+    assert_replay_matches(db, state)
+    assert state.lsn == db.execute(eventlog.STATE_QUERY).fetchone()[0]
+
+def test_replay_from_a_checkpoint_equals_the_tables(app, db):
+    busy, resized, users = churn()
+    event_log.checkpoint(db, 0)
+    _, stay = ParkingSpot.book_spot(busy, users[1])
+    ParkingLot.update_lot(resized, 'Resized', 10.0, '1 Main Road', '560001', 8)
+    Reservation.release_reservation(stay, users[1])
+
+    assert_replay_matches(db, event_log.replay(db, 0))
+
+def test_a_torn_tail_is_ignored(app, db):
+    lot_id = create_lot(spots=3)
+    user_id, = create_users(1)
+    ParkingSpot.book_spot(lot_id, user_id)
+    last, = segment_paths()
+    # A crash part way through writing a transaction that never committed.
+    with open(last, 'ab') as f:
+        f.write(b'\x01' * (eventlog.RECORD_SIZE // 2))
+
+    assert_replay_matches(db, event_log.replay(db, 0, LogState()))
+    ParkingSpot.book_spot(lot_id, user_id)
+    assert_replay_matches(db, event_log.replay(db, 0, LogState()))
+    assert os.path.getsize(last) % eventlog.RECORD_SIZE == 0
+
+def test_rolled_back_batches_do_not_count(app, db):
+    lot_id = create_lot(spots=3)
+    user_id, = create_users(1)
+    event_log.record(db, [eventlog.booked(lot_id, 999, 999, user_id, datetime.now(), 10.0)])
+    db.rollback()
+    ParkingSpot.book_spot(lot_id, user_id)
+
+    assert_replay_matches(db, event_log.replay(db, 0, LogState()))
+
+def test_a_gap_in_the_log_falls_back_to_a_scan(app, db):
+    lot_id = create_lot(spots=3)
+    user_id, = create_users(1)
+    event_log.checkpoint(db, 0)
+    event_log.enabled = False
+    ParkingSpot.book_spot(lot_id, user_id)
+    event_log.enabled = True
+
+    with pytest.raises(EventLogGap):
+        event_log.replay(db, 0)
+    assert event_log.recover(db, 0) is None
+
+def test_recover_without_a_checkpoint(app, db):
+    create_lot(spots=1)
+    assert event_log.recover(db, 0) is None
+
+    event_log.checkpoint(db, 0)
+    assert event_log.recover(db, 0).counts() == eventlog.snapshot(db).counts()
+
+@pytest.mark.parametrize('app_config', [{'EVENT_LOG_SEGMENT_BYTES': eventlog.RECORD_SIZE * 2}])
+def test_checkpoints_prune_old_segments(app, db):
+    lot_id = create_lot(spots=4)
+    for user_id in create_users(4):
+        ParkingSpot.book_spot(lot_id, user_id)
+    assert len(segment_paths()) >= 3
+
+    assert event_log.checkpoint(db, 0).lsn == 5
+    assert len(segment_paths()) == 1
+    assert_replay_matches(db, event_log.replay(db, 0))
+
+def test_checkpoint_and_replay_commands(app, db):
+    runner = app.test_cli_runner()
+    busy, resized, users = churn()
+    result = runner.invoke(args=['replay'])
+    assert result.exit_code != 0 and 'No checkpoint yet' in result.output
+
+    assert 'Checkpointed 2 lots' in runner.invoke(args=['checkpoint']).output
+    ParkingSpot.book_spot(busy, users[1])
+    assert 'All lot counters match the event log' in runner.invoke(args=['replay']).output
+
+    db.execute('UPDATE parking_lots SET available_spots = 3 WHERE id = ?', (busy,))
+    db.commit()
+    result = runner.invoke(args=['replay', '--repair'])
+    assert f'Lot {busy}: stored' in result.output
+    assert 'Rebuilt counters for 1 lot(s)' in result.output
+    assert counters.compare_counts(db, event_log.replay(db, 0).counts()) == []
+
+def test_repair_rebuilds_the_usage_rollups(app, db):
+    lot_id = create_lot(spots=2)
+    user_id, = create_users(1)
+    spot_id = db.execute('SELECT MIN(id) FROM parking_spots WHERE lot_id = ?', (lot_id,)).fetchone()[0]
+    db.execute('''
+        INSERT INTO reservations (spot_id, user_id, parking_timestamp, leaving_timestamp, parking_cost, status)
+        VALUES (?, ?, '2024-03-01 09:00:00', '2024-03-01 11:00:00', 20.0, 'completed')
+    ''', (spot_id, user_id))
+    db.execute("INSERT INTO lot_usage_daily (lot_id, day, departures) VALUES (?, '2024-03-01', 5)", (lot_id,))
+    db.commit()
+    runner = app.test_cli_runner()
+    runner.invoke(args=['checkpoint'])
+
+    result = runner.invoke(args=['replay', '--repair'])
+
+    assert 'Rebuilt the usage rollups from 1 completed reservations' in result.output
+    row = db.execute('SELECT departures, occupied_hours, revenue FROM lot_usage_daily WHERE lot_id = ?',
+                     (lot_id,)).fetchone()
+    assert tuple(row) == (1, 2.0, 20.0)
@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+
+from conftest import create_lot, create_users
+from models import fleet
+from models.database import Reservation
+
+def book(client, **body):
+    return client.post('/api/v1/bookings/batch', json=body)
+
+def test_batch_reservation_ids_match_their_spots(user_client, db, user):
+    lot_id = create_lot(spots=5)
+    response = book(user_client, count=3, lot_id=lot_id)
+
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [result['status'] for result in results] == ['booked'] * 3
+    for result in results:
+        row = db.execute('SELECT spot_id, user_id, status FROM reservations WHERE id = ?',
+                         (result['reservation_id'],)).fetchone()
+        assert tuple(row) == (result['spot_id'], user[0], 'active')
+
+def test_partial_batches_report_the_shortfall(user_client):
+    lot_id = create_lot(spots=2)
+    response = book(user_client, count=3, lot_id=lot_id)
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert (body['requested'], body['booked']) == (3, 2)
+    assert body['results'][-1] == {'status': 'unavailable'}
+
+def test_adjacent_batches_take_a_consecutive_run_in_one_lot(user_client, db):
+    small = create_lot(spots=2, name='Small')
+    big = create_lot(spots=6, name='Big')
+    other, = create_users(1)
+    # Break up the big lot's first run.
+    Reservation.book_batch(other, 1, big)
+    Reservation.book_batch(other, 1, small)
+
+    results = book(user_client, count=4, adjacent=True).get_json()['results']
+
+    spot_ids = [result['spot_id'] for result in results]
+    assert {result['lot_id'] for result in results} == {big}
+    assert spot_ids == list(range(spot_ids[0], spot_ids[0] + 4))
+
+    response = book(user_client, count=2, adjacent=True)
+    assert response.status_code == 409
+    assert response.get_json()['booked'] == 0
+
+@pytest.mark.parametrize('body', [
+    {'count': 0},
+    {'count': fleet.MAX_BATCH + 1},
+    {'count': '2'},
+    {'count': 2, 'lot_id': 'one'},
+])
+def test_bad_batch_requests_are_rejected(user_client, body):
+    assert book(user_client, **body).status_code == 400
+
+def test_batches_need_a_signed_in_driver(app, admin_client):
+    assert book(admin_client, count=1).status_code == 403
+    assert book(app.test_client(), count=1).status_code == 403
+
+def test_release_batch_releases_only_the_callers_stays(user_client, db, user):
+    lot_id = create_lot(spots=3)
+    other, = create_users(1)
+    [(_, _, theirs)] = Reservation.book_batch(other, 1, lot_id)
+    mine = [result['reservation_id'] for result in book(user_client, count=2, lot_id=lot_id).get_json()['results']]
+
+    response = user_client.post('/api/v1/bookings/release', json={'reservation_ids': mine + [theirs, mine[0]]})
+
+    body = response.get_json()
+    assert body['released'] == 2
+    assert [result['status'] for result in body['results']] == ['released', 'released', 'not_found', 'released']
+    assert db.execute('SELECT status FROM reservations WHERE id = ?', (theirs,)).fetchone()[0] == 'active'
+    assert db.execute('SELECT available_spots FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()[0] == 2
+
+    assert user_client.post('/api/v1/bookings/release', json={'reservation_ids': []}).status_code == 400
+
+def test_concurrent_batches_never_share_a_spot(app, db):
+    lot_id = create_lot(spots=10)
+    user_ids = create_users(6)
+    booked = []
+    lock = threading.Lock()
+
+    def run(user_id):
+        result = Reservation.book_batch(user_id, 3, lot_id)
+        with lock:
+            booked.extend(result)
+
+    threads = [threading.Thread(target=run, args=(user_id,)) for user_id in user_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    spot_ids = [spot_id for _, spot_id, _ in booked]
+    assert len(spot_ids) == 10 == len(set(spot_ids))
+    assert db.execute('SELECT COUNT(*) FROM reservations WHERE status = "active"').fetchone()[0] == 10
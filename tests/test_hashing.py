@@ -0,0 +1,100 @@
+import pytest
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from models.database import User
+from services import hashing
+from services.hashing import HashingBusy, PasswordHasher, password_hasher
+
+METHOD = 'pbkdf2:sha256:1000'
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(METHOD, workers=0)
+    yield hasher
+    hasher.shutdown()
+
+def test_hashes_with_the_configured_method(hasher):
+    stored = hasher.hash('secret')
+    assert stored.startswith(f'{METHOD}$')
+    assert hasher.verify('driver', stored, 'secret')
+    assert not hasher.verify('driver', stored, 'wrong')
+
+def test_verified_logins_are_cached_until_the_hash_changes(hasher, monkeypatch):
+    stored = hasher.hash('secret')
+    checks = []
+    def counting_check(stored_hash, password):
+        checks.append(password)
+        return check_password_hash(stored_hash, password)
+    monkeypatch.setattr(hashing, 'check_password_hash', counting_check)
+
+    assert hasher.verify('driver', stored, 'secret')
+    assert hasher.verify('driver', stored, 'secret')
+    assert len(checks) == 1
+
+    assert hasher.verify('driver', hasher.hash('secret'), 'secret')
+    assert len(checks) == 2
+
+def test_needs_rehash_compares_the_canonical_method(hasher):
+    assert not hasher.needs_rehash(generate_password_hash('x', METHOD))
+    assert hasher.needs_rehash(generate_password_hash('x', 'pbkdf2:sha256:2000'))
+    assert not PasswordHasher('pbkdf2', workers=0).needs_rehash(generate_password_hash('x', 'pbkdf2'))
+
+@pytest.mark.parametrize('method', ['scrypt', 'scrypt:16384:8:1', 'pbkdf2', 'pbkdf2:sha512', METHOD])
+def test_canonical_method_matches_what_werkzeug_writes(method):
+    assert hashing.canonical_method(method) == generate_password_hash('x', method).split('$', 1)[0]
+
+def test_needs_rehash_does_not_hash(hasher, monkeypatch):
+    stored = hasher.hash('secret')
+    def no_hashing(*args):
+        raise AssertionError('hashed on the request thread')
+    monkeypatch.setattr(hashing, 'generate_password_hash', no_hashing)
+
+    assert not hasher.needs_rehash(stored)
+    assert hasher.needs_rehash('scrypt:32768:8:1$salt$digest')
+
+def test_hash_many_on_the_process_pool():
+    hasher = PasswordHasher(METHOD, workers=1)
+    try:
+        hashes = hasher.hash_many(['a', 'b', 'c'])
+    finally:
+        hasher.shutdown()
+    assert [check_password_hash(stored, password) for stored, password in zip(hashes, 'abc')] == [True] * 3
+
+def test_full_pool_refuses_instead_of_queueing():
+    hasher = PasswordHasher(METHOD, workers=1, max_pending=1)
+    hasher._slots.acquire()
+    try:
+        with pytest.raises(HashingBusy):
+            hasher.hash('secret')
+    finally:
+        hasher._slots.release()
+        hasher.shutdown()
+
+def test_busy_login_and_registration_answer_503(client, monkeypatch):
+    User.create_user('driver', generate_password_hash('secret', METHOD), None, None)
+    def busy(*args):
+        raise HashingBusy()
+    monkeypatch.setattr(password_hasher, 'verify', busy)
+    monkeypatch.setattr(password_hasher, 'hash', busy)
+
+    response = client.post('/login', data={'username': 'driver', 'password': 'secret'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '2'
+
+    response = client.post('/register', data={'username': 'new', 'password': 'secret', 'email': '', 'phone': ''})
+    assert response.status_code == 503
+    assert not User.username_exists('new')
+
+def test_login_upgrades_an_outdated_hash(client):
+    User.create_user('driver', generate_password_hash('secret', 'pbkdf2:sha256:2000'), None, None)
+
+    response = client.post('/login', data={'username': 'driver', 'password': 'secret'})
+
+    assert response.status_code == 302
+    assert User.get_by_username('driver').password.startswith(f'{METHOD}$')
+
+def test_registered_users_can_log_in(client):
+    client.post('/register', data={'username': 'driver', 'password': 'secret', 'email': 'd@example.com', 'phone': '1'})
+    response = client.post('/login', data={'username': 'driver', 'password': 'secret'})
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/user/dashboard')
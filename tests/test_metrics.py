@@ -0,0 +1,49 @@
+import sqlite3
+
+import pytest
+
+from conftest import create_lot
+from services import metrics
+
+@pytest.fixture
+def app_config():
+    return {'METRICS_ENABLED': True}
+
+def test_normalize_sql_collapses_whitespace_and_placeholder_lists():
+    assert metrics.normalize_sql('SELECT *\n   FROM t WHERE id IN (?, ?,?)') == 'SELECT * FROM t WHERE id IN (?, ...)'
+    assert len(metrics.normalize_sql('SELECT ' + 'x, ' * 100, limit=40)) == 40
+
+def test_histogram_renders_cumulative_buckets():
+    family = metrics.HistogramFamily('latency', 'Latency.', ('route',), (0.1, 1.0))
+    for value in (0.05, 0.5, 2.0):
+        family.observe(('/',), value)
+    lines = family.render()
+    assert 'latency_bucket{route="/",le="0.1"} 1' in lines
+    assert 'latency_bucket{route="/",le="1.0"} 2' in lines
+    assert 'latency_bucket{route="/",le="+Inf"} 3' in lines
+    assert 'latency_count{route="/"} 3' in lines
+
+def test_labels_are_escaped():
+    assert metrics.format_labels(('statement',), ('say "hi"\n',)) == 'statement="say \\"hi\\"\\n"'
+
+def test_requests_and_their_queries_are_recorded(client):
+    lot_id = create_lot(spots=2)
+    client.get(f'/api/v1/lots/{lot_id}/availability')
+    client.get('/api/v1/lots/999/availability')
+
+    body = client.get('/metrics').get_data(as_text=True)
+
+    route = 'route="/api/v1/lots/<int:lot_id>/availability"'
+    assert f'parking_http_request_duration_seconds_count{{method="GET",{route},status="200"}} 1' in body
+    assert f'parking_http_request_duration_seconds_count{{method="GET",{route},status="404"}} 1' in body
+    assert f'parking_db_queries_per_request_count{{{route}}} 2' in body
+    assert 'parking_db_statement_duration_seconds_count{statement="SELECT ' in body
+
+def test_errors_and_slow_statements_are_counted(app):
+    recorder = app.extensions['parking_metrics']
+    recorder.observe_statement('UPDATE t SET x = 1', 0.001, sqlite3.OperationalError('database is locked'))
+    recorder.observe_statement('SELECT 1', 10.0, None)
+
+    body = recorder.render()
+    assert 'parking_db_errors_total{kind="locked"} 1' in body
+    assert 'parking_db_slow_queries_total{statement="SELECT 1"} 1' in body
@@ -0,0 +1,69 @@
+import sqlite3
+
+import pytest
+
+from models import migrations
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'migrate.db')
+    conn.row_factory = sqlite3.Row
+    yield conn
+    conn.close()
+
+def query_plan(conn, sql, params=()):
+    return ' '.join(row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params))
+
+def test_migrates_an_empty_database_to_the_latest_version(conn):
+    applied = migrations.migrate(conn)
+
+    assert [version for version, _ in applied] == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.current_version(conn) == migrations.LATEST_VERSION
+    assert migrations.is_current(conn)
+
+def test_migrating_again_is_a_no_op(conn):
+    migrations.migrate(conn)
+    assert migrations.migrate(conn) == []
+    assert conn.execute('SELECT COUNT(*) FROM schema_version').fetchone()[0] == len(migrations.MIGRATIONS)
+
+def test_stops_at_the_target_version(conn):
+    migrations.migrate(conn, target=3)
+    assert migrations.current_version(conn) == 3
+    assert not migrations.is_current(conn)
+
+    applied = migrations.migrate(conn)
+    assert applied[0][0] == 4
+    assert migrations.is_current(conn)
+
+def test_upgrades_a_database_created_before_migrations(conn):
+    # The original schema, written without a schema_version table.
+    for statement in migrations.MIGRATIONS[0][2]:
+        conn.execute(statement)
+    conn.execute("INSERT INTO users (username, password) VALUES ('driver', 'x')")
+    conn.execute("INSERT INTO parking_lots (prime_location_name, price, address, pin_code, maximum_number_of_spots) "
+                 "VALUES ('Central', 10, '1 Main Road', '560001', 3)")
+    conn.executemany('INSERT INTO parking_spots (lot_id, status) VALUES (1, ?)', [('O',), ('A',), ('A',)])
+    conn.execute("INSERT INTO reservations (spot_id, user_id) VALUES (1, 1)")
+    conn.commit()
+
+    migrations.migrate(conn)
+
+    lot = conn.execute('SELECT total_spots, available_spots, occupied_spots FROM parking_lots WHERE id = 1').fetchone()
+    assert tuple(lot) == (3, 2, 1)
+    assert conn.execute('SELECT COUNT(*) FROM reservations WHERE status = "active"').fetchone()[0] == 1
+    assert conn.execute("SELECT rowid FROM lots_fts WHERE lots_fts MATCH 'central'").fetchone()[0] == 1
+
+def test_hot_lookups_use_their_indexes(conn):
+    migrations.migrate(conn)
+
+    assert 'idx_reservations_user_status_time' in query_plan(
+        conn, 'SELECT * FROM reservations WHERE user_id = ? AND status = "active"', (1,))
+    assert 'idx_reservations_spot_status' in query_plan(
+        conn, 'SELECT * FROM reservations WHERE spot_id = ? AND status = "active"', (1,))
+    assert 'idx_parking_spots_lot_status' in query_plan(
+        conn, 'SELECT id FROM parking_spots WHERE lot_id = ? AND status = "A"', (1,))
+
+def test_migrate_command_reports_the_schema_version(app):
+    result = app.test_cli_runner().invoke(args=['migrate'])
+    assert result.exit_code == 0
+    assert f'Schema is at version {migrations.LATEST_VERSION}' in result.output
@@ -0,0 +1,53 @@
+import pytest
+
+from conftest import create_lot, create_users
+from models.database import ParkingLot, ParkingSpot
+
+@pytest.fixture
+def app_config():
+    return {'PAGE_SIZE': 2}
+
+def walk(fetch):
+    seen = []
+    after = 0
+    while True:
+        page = fetch(after)
+        if not page:
+            return seen
+        seen.extend(row.id for row in page)
+        after = page[-1].id
+
+def test_lot_pages_cover_every_lot_once(app):
+    lot_ids = [create_lot(spots=1, name=f'Lot {n}') for n in range(5)]
+    assert walk(lambda after: ParkingLot.get_all_lots(after, 2)) == lot_ids
+
+def test_spot_pages_cover_every_spot_once_with_filters(app, db):
+    lot_id = create_lot(spots=7)
+    first, second = create_users(2)
+    taken = [ParkingSpot.book_spot(lot_id, first)[0], ParkingSpot.book_spot(lot_id, second)[0]]
+    spot_ids = [row[0] for row in db.execute('SELECT id FROM parking_spots WHERE lot_id = ? ORDER BY id', (lot_id,))]
+
+    assert walk(lambda after: ParkingSpot.get_spots_by_lot(lot_id, after, 3)) == spot_ids
+    assert walk(lambda after: ParkingSpot.get_spots_by_lot(lot_id, after, 3, status='A')) == \
+        [spot_id for spot_id in spot_ids if spot_id not in taken]
+    occupied = ParkingSpot.get_spots_by_lot(lot_id, username='user1')
+    assert [(spot.id, spot.username) for spot in occupied] == [(taken[1], 'user1')]
+
+def test_admin_dashboard_links_to_the_next_page(admin_client):
+    lot_ids = [create_lot(spots=1, name=f'Lot {n}') for n in range(3)]
+
+    first = admin_client.get('/admin/dashboard').data
+    assert b'Lot 0' in first and b'Lot 1' in first and b'Lot 2' not in first
+    assert f'/admin/dashboard?after={lot_ids[1]}'.encode() in first
+
+    second = admin_client.get(f'/admin/dashboard?after={lot_ids[1]}').data
+    assert b'Lot 2' in second and b'Lot 0' not in second
+
+def test_spot_page_keeps_its_filters_in_the_next_link(admin_client, db):
+    lot_id = create_lot(spots=5)
+    spot_ids = [row[0] for row in db.execute('SELECT id FROM parking_spots WHERE lot_id = ? ORDER BY id', (lot_id,))]
+
+    page = admin_client.get(f'/admin/view_spots/{lot_id}?status=A').data.decode()
+
+    assert f'after={spot_ids[1]}' in page
+    assert 'status=A' in page
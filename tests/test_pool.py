@@ -0,0 +1,95 @@
+import sqlite3
+
+import pytest
+
+from models import pool
+from models.pool import ConnectionPool
+
+@pytest.fixture
+def connections(tmp_path):
+    created = ConnectionPool(str(tmp_path / 'pool.db'), size=2, busy_timeout=1234, synchronous='FULL')
+    yield created
+    created.close_all()
+
+def raw(conn):
+    return conn._conn
+
+def test_new_connections_get_the_pragmas(connections):
+    conn = connections.acquire()
+
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == 1234
+    # 2 is FULL.
+    assert conn.execute('PRAGMA synchronous').fetchone()[0] == 2
+    conn.release()
+
+def test_idle_connections_are_reused(connections):
+    first = connections.acquire()
+    underlying = raw(first)
+    first.release()
+
+    second = connections.acquire()
+    assert raw(second) is underlying
+    second.release()
+
+def test_release_rolls_back_an_open_transaction(connections):
+    conn = connections.acquire()
+    conn.execute('CREATE TABLE t (x INTEGER)')
+    conn.commit()
+    conn.execute('INSERT INTO t VALUES (1)')
+    assert conn.in_transaction
+    conn.release()
+
+    conn = connections.acquire()
+    assert not conn.in_transaction
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    conn.release()
+
+def test_the_pool_keeps_at_most_size_idle_connections(connections):
+    held = [connections.acquire() for _ in range(3)]
+    underlying = [raw(conn) for conn in held]
+    for conn in held:
+        conn.release()
+
+    assert connections._idle.qsize() == 2
+    kept = [raw(connections.acquire()) for _ in range(2)]
+    assert set(map(id, kept)) == set(map(id, underlying[:2]))
+    # The connection that did not fit was closed.
+    with pytest.raises(sqlite3.ProgrammingError):
+        underlying[2].execute('SELECT 1')
+
+def test_close_does_nothing_on_a_bound_connection(connections):
+    conn = connections.acquire(bound=True)
+    conn.close()
+    assert conn.execute('SELECT 1').fetchone()[0] == 1
+    assert connections._idle.qsize() == 0
+
+    conn.release()
+    assert connections._idle.qsize() == 1
+
+def test_unbound_close_returns_the_connection(connections):
+    conn = connections.acquire()
+    conn.close()
+    conn.close()
+    assert connections._idle.qsize() == 1
+
+def test_a_request_shares_one_connection_and_returns_it_on_teardown(app):
+    database = app.config['DATABASE']
+    connections = pool.get_pool(database)
+    connections.close_all()
+
+    with app.app_context():
+        conn = pool.get_connection(database)
+        assert pool.get_connection(database) is conn
+        conn.close()
+        assert connections._idle.qsize() == 0
+        underlying = raw(conn)
+
+    assert connections._idle.qsize() == 1
+    with app.app_context():
+        assert raw(pool.get_connection(database)) is underlying
+
+def test_connections_outside_an_app_context_are_unbound(app):
+    conn = pool.get_connection(app.config['DATABASE'])
+    assert not conn._bound
+    conn.close()
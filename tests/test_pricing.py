@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import create_lot, create_users
+from models import pricing
+from models.database import ParkingSpot
+from models.pricing import PricingPolicy, price_table, pricing_engine
+
+NOW = datetime(2024, 6, 12, 18, 30)
+
+def test_parse_bands():
+    assert pricing.parse_bands('0.5:0.9, -:1.5') == [(0.5, 0.9), (None, 1.5)]
+    assert pricing.parse_bands(':2') == [(None, 2.0)]
+
+def test_policy_picks_the_first_band_that_fits():
+    policy = PricingPolicy()
+    assert policy.multiplier(None) == 1.0
+    assert policy.multiplier(0.2) == 0.9
+    assert policy.multiplier(0.5) == 0.9
+    assert policy.multiplier(0.8) == 1.25
+    assert policy.multiplier(1.0) == 1.5
+    assert PricingPolicy([(0.5, 0.8)]).multiplier(0.9) == 1.0
+
+def test_price_table_lookups():
+    table = pricing.PriceTable()
+    values = [1.0] * pricing.HOURS_PER_WEEK
+    values[pricing.bucket_of(NOW)] = 1.5
+    table.publish({7: values})
+
+    assert table.multiplier(7, NOW) == 1.5
+    assert table.multiplier(7, NOW + timedelta(hours=1)) == 1.0
+    assert table.multiplier(8, NOW) == 1.0
+    assert table.price(7, 10.0, NOW) == 15.0
+
+def add_usage(conn, lot_id, moment, occupied_hours, weeks=4):
+    hour = moment.replace(minute=0)
+    conn.executemany('INSERT INTO lot_usage_hourly (lot_id, hour, occupied_hours) VALUES (?, ?, ?)',
+                     [(lot_id, (hour - timedelta(weeks=week)).strftime(pricing.HOUR_FORMAT), occupied_hours)
+                      for week in range(1, weeks + 1)])
+    conn.commit()
+
+def test_reprice_follows_occupancy_history(app, db):
+    lot_id = create_lot(spots=2)
+    busy_hour = NOW + timedelta(hours=2)
+    add_usage(db, lot_id, busy_hour, occupied_hours=2)
+    add_usage(db, lot_id, busy_hour + timedelta(hours=1), occupied_hours=1.5)
+
+    assert pricing_engine.refresh(force=True, now=NOW) == 1
+
+    assert price_table.multiplier(lot_id, busy_hour) == 1.5
+    assert price_table.multiplier(lot_id, busy_hour + timedelta(hours=1)) == 1.0
+    assert price_table.multiplier(lot_id, busy_hour + timedelta(hours=5)) == pytest.approx(0.9)
+    # The hour we are in leans on the empty lot right now.
+    assert price_table.multiplier(lot_id, NOW) == pytest.approx(0.9)
+
+def add_stay(conn, lot_id, start, end):
+    user_id, = create_users(1)
+    spot_id = conn.execute('SELECT MIN(id) FROM parking_spots WHERE lot_id = ?', (lot_id,)).fetchone()[0]
+    conn.execute('''
+        INSERT INTO reservations (spot_id, user_id, parking_timestamp, leaving_timestamp, parking_cost, status)
+        VALUES (?, ?, ?, ?, 10.0, 'completed')
+    ''', (spot_id, user_id, start, end))
+    conn.commit()
+
+def test_refresh_folds_new_stays_into_the_rollups_first(app, db):
+    lot_id = create_lot(spots=1)
+    add_stay(db, lot_id, '2024-06-05 20:00:00', '2024-06-05 21:00:00')
+
+    pricing_engine.refresh(force=True, now=NOW)
+
+    assert db.execute('SELECT occupied_hours FROM lot_usage_hourly WHERE lot_id = ? AND hour = ?',
+                      (lot_id, '2024-06-05 20:00')).fetchone()[0] == 1.0
+
+def test_refresh_can_leave_the_rollups_alone(app, db):
+    lot_id = create_lot(spots=1)
+    add_stay(db, lot_id, '2024-06-05 20:00:00', '2024-06-05 21:00:00')
+
+    pricing_engine.refresh(force=True, now=NOW, rollup=False)
+
+    assert db.execute('SELECT COUNT(*) FROM lot_usage_hourly').fetchone()[0] == 0
+
+def test_lots_without_history_keep_the_base_price(app):
+    lot_id = create_lot(spots=2)
+    pricing_engine.refresh(force=True, now=NOW)
+
+    assert price_table.multiplier(lot_id, NOW + timedelta(hours=1)) == 1.0
+    assert price_table.multiplier(lot_id, NOW) == pytest.approx(0.9)
+
+def test_refresh_skips_fresh_tables(app, monkeypatch):
+    monkeypatch.setattr(pricing_engine, 'interval', 900)
+    create_lot(spots=1)
+    assert pricing_engine.refresh(force=True, now=NOW) == 1
+    assert pricing_engine.refresh(now=NOW + timedelta(seconds=1)) == 0
+
+def test_deleted_lots_drop_out_of_the_table(app, db):
+    lot_id = create_lot(spots=1)
+    pricing_engine.refresh(force=True, now=NOW)
+    db.execute('DELETE FROM parking_lots WHERE id = ?', (lot_id,))
+    db.commit()
+
+    assert pricing_engine.refresh(force=True, now=NOW) == 0
+    assert db.execute('SELECT COUNT(*) FROM lot_prices').fetchone()[0] == 0
+
+def test_bookings_record_the_price_they_used(app, db):
+    lot_id = create_lot(spots=2, price=10.0)
+    user_id, = create_users(1)
+    price_table.publish({lot_id: [1.25] * pricing.HOURS_PER_WEEK})
+
+    _, reservation_id = ParkingSpot.book_spot(lot_id, user_id)
+
+    hourly_price = db.execute('SELECT hourly_price FROM reservations WHERE id = ?', (reservation_id,)).fetchone()[0]
+    assert hourly_price == 12.5
+
+@pytest.mark.parametrize('args', [['reprice'], ['reprice', '--skip-rollup']])
+def test_reprice_command(app, args):
+    create_lot(spots=1)
+    create_lot(spots=1)
+
+    result = app.test_cli_runner().invoke(args=args)
+
+    assert result.exit_code == 0
+    assert 'Repriced 2 lots from 28 days of occupancy' in result.output
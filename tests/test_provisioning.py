@@ -0,0 +1,95 @@
+import pytest
+
+from conftest import create_lot, create_users
+from models.database import ParkingLot, ParkingSpot
+from models.provisioning import build_layout, provision_layout, resize_lot
+
+def spot_ids(conn, lot_id):
+    return [row[0] for row in conn.execute('SELECT id FROM parking_spots WHERE lot_id = ? ORDER BY id', (lot_id,))]
+
+def test_layout_spreads_spots_over_levels_and_ev_first():
+    layout = build_layout(7, levels=3, ev_spots=2)
+
+    assert sum(block['count'] for block in layout) == 7
+    per_level = {}
+    for block in layout:
+        per_level[block['level']] = per_level.get(block['level'], 0) + block['count']
+    assert per_level == {1: 3, 2: 2, 3: 2}
+    assert [block['count'] for block in layout if block['ev_capable']] == [2]
+
+@pytest.mark.parametrize('max_spots, levels, ev_spots', [(5, 0, 0), (5, -1, 0), (5, 1, -1), (5, 1, 6), (-1, 1, 0)])
+def test_layout_rejects_impossible_lots(max_spots, levels, ev_spots):
+    with pytest.raises(ValueError):
+        build_layout(max_spots, levels, ev_spots)
+
+def test_provisions_every_block_of_a_layout(app, db):
+    lot_id = create_lot(spots=0)
+    assert provision_layout(db, lot_id, build_layout(6, levels=2, ev_spots=1)) == 6
+    rows = db.execute('SELECT level, ev_capable FROM parking_spots WHERE lot_id = ?', (lot_id,)).fetchall()
+    assert sorted(tuple(row) for row in rows) == [(1, 0), (1, 0), (1, 1), (2, 0), (2, 0), (2, 0)]
+
+def test_create_lot_form_builds_levels_and_ev_spots(admin_client, db):
+    response = admin_client.post('/admin/create_lot', data={
+        'name': 'Levels', 'price': '20', 'address': '2 Side Street', 'pin_code': '560002',
+        'max_spots': '4', 'levels': '2', 'ev_spots': '1'})
+    assert response.status_code == 302
+
+    lot_id = db.execute("SELECT id FROM parking_lots WHERE prime_location_name = 'Levels'").fetchone()[0]
+    rows = db.execute('SELECT level, ev_capable FROM parking_spots WHERE lot_id = ?', (lot_id,)).fetchall()
+    assert sorted(tuple(row) for row in rows) == [(1, 0), (1, 1), (2, 0), (2, 0)]
+
+@pytest.mark.parametrize('levels, ev_spots', [('0', '0'), ('-1', '0'), ('1', '-1'), ('1', '5')])
+def test_create_lot_form_rejects_impossible_layouts(admin_client, db, levels, ev_spots):
+    response = admin_client.post('/admin/create_lot', data={
+        'name': 'Broken', 'price': '20', 'address': '2 Side Street', 'pin_code': '560002',
+        'max_spots': '4', 'levels': levels, 'ev_spots': ev_spots})
+
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/admin/create_lot')
+    assert db.execute('SELECT COUNT(*) FROM parking_lots').fetchone()[0] == 0
+
+def test_growing_a_lot_fills_its_emptiest_levels(app, db):
+    lot_id = create_lot(spots=5, levels=2)
+    db.execute("UPDATE parking_spots SET zone = 'B' WHERE lot_id = ? AND level = 2", (lot_id,))
+
+    assert resize_lot(db, lot_id, 10) == 5
+    db.commit()
+
+    rows = db.execute('SELECT level, zone, COUNT(*) FROM parking_spots WHERE lot_id = ? GROUP BY level, zone',
+                      (lot_id,)).fetchall()
+    assert [tuple(row) for row in rows] == [(1, None, 5), (2, 'B', 5)]
+
+def test_growing_a_lot_adds_spots_with_the_highest_ids(app, db):
+    lot_id = create_lot(spots=3)
+    before = spot_ids(db, lot_id)
+
+    assert resize_lot(db, lot_id, 5) == 2
+    db.commit()
+
+    after = spot_ids(db, lot_id)
+    assert after[:3] == before and min(after[3:]) > max(before)
+
+def test_shrinking_a_lot_removes_only_free_spots_newest_first(app, db):
+    lot_id = create_lot(spots=4)
+    ids = spot_ids(db, lot_id)
+    user_id, = create_users(1)
+    # Park in the newest spot so the shrink has to step around it.
+    db.execute('INSERT INTO reservations (spot_id, user_id) VALUES (?, ?)', (ids[-1], user_id))
+    db.commit()
+
+    assert resize_lot(db, lot_id, 1) == -3
+    db.commit()
+    assert spot_ids(db, lot_id) == [ids[-1]]
+
+    assert resize_lot(db, lot_id, 0) == 0
+
+def test_edit_lot_resizes_and_the_allocator_follows(admin_client, db):
+    lot_id = create_lot(spots=2)
+    response = admin_client.post(f'/admin/edit_lot/{lot_id}', data={
+        'name': 'Central', 'price': '10', 'address': '1 Main Road', 'pin_code': '560001', 'max_spots': '3'})
+    assert response.status_code == 302
+    assert ParkingLot.get_lot_by_id(lot_id).total_spots == 3
+
+    user_ids = create_users(4)
+    booked = [ParkingSpot.book_spot(lot_id, user_id) for user_id in user_ids]
+    assert [bool(booking) for booking in booked] == [True, True, True, False]
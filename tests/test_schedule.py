@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import create_lot, create_users
+from models.database import ParkingSpot
+from models.schedule import SlotTree, schedule_index
+
+NOW = datetime(2030, 6, 3, 9, 0)
+
+def window(start_hours, end_hours):
+    return NOW + timedelta(hours=start_hours), NOW + timedelta(hours=end_hours)
+
+def test_slot_tree_adds_ranges_and_finds_peaks():
+    tree = SlotTree(100, 50)
+    tree.add(100, 110, 1)
+    tree.add(105, 120, 2)
+    tree.add(130, 200, 1)
+
+    assert tree.peak(100, 105) == 1
+    assert tree.peak(100, 150) == 3
+    assert tree.peak(110, 120) == 2
+    assert tree.peak(120, 130) == 0
+    assert tree.peak(90, 101) == 1
+
+def test_holds_use_up_capacity_for_overlapping_windows(app, db):
+    lot_id = create_lot(spots=2)
+    users = create_users(3)
+
+    assert schedule_index.reserve(db, lot_id, users[0], *window(2, 4), now=NOW)
+    assert schedule_index.reserve(db, lot_id, users[1], *window(3, 5), now=NOW)
+    assert schedule_index.reserve(db, lot_id, users[2], *window(3.5, 4.5), now=NOW) is None
+    # Later windows are untouched.
+    assert schedule_index.reserve(db, lot_id, users[2], *window(5, 6), now=NOW)
+    assert schedule_index.free_spots(db, lot_id, *window(0, 2), now=NOW) == 2
+
+def test_walk_ins_cannot_take_capacity_held_for_arrivals(app, db):
+    lot_id = create_lot(spots=2)
+    walk_in, arriving = create_users(2)
+    now = datetime.now()
+    schedule_index.reserve(db, lot_id, arriving, now + timedelta(minutes=30), now + timedelta(hours=2))
+
+    assert ParkingSpot.book_spot(lot_id, walk_in)
+    assert ParkingSpot.book_spot(lot_id, walk_in) is None
+
+def test_check_in_turns_a_hold_into_a_stay(app, db):
+    lot_id = create_lot(spots=1)
+    user_id, = create_users(1)
+    schedule_id = schedule_index.reserve(db, lot_id, user_id, *window(1, 3), now=NOW)
+
+    with pytest.raises(ValueError, match='Check-in opens'):
+        schedule_index.check_in(db, schedule_id, user_id, now=NOW)
+    booked_lot, spot_id, reservation_id = schedule_index.check_in(db, schedule_id, user_id, now=NOW + timedelta(hours=1))
+
+    assert booked_lot == lot_id
+    assert db.execute('SELECT spot_id FROM reservations WHERE id = ?', (reservation_id,)).fetchone()[0] == spot_id
+    assert db.execute('SELECT status FROM scheduled_reservations WHERE id = ?', (schedule_id,)).fetchone()[0] == 'checked_in'
+    assert schedule_index.check_in(db, schedule_id, user_id, now=NOW + timedelta(hours=1)) is None
+
+def test_cancelling_frees_the_window(app, db):
+    lot_id = create_lot(spots=1)
+    first, second = create_users(2)
+    schedule_id = schedule_index.reserve(db, lot_id, first, *window(1, 2), now=NOW)
+    assert schedule_index.free_spots(db, lot_id, *window(1, 2), now=NOW) == 0
+
+    assert schedule_index.cancel(db, schedule_id, second) is None
+    assert schedule_index.cancel(db, schedule_id, first) == lot_id
+    assert schedule_index.reserve(db, lot_id, second, *window(1, 2), now=NOW)
+
+@pytest.mark.parametrize('start_hours, end_hours', [(2, 1), (-3, -1), (1, 24 * 15)])
+def test_invalid_windows_are_refused(app, db, start_hours, end_hours):
+    lot_id = create_lot(spots=1)
+    user_id, = create_users(1)
+    with pytest.raises(ValueError):
+        schedule_index.reserve(db, lot_id, user_id, *window(start_hours, end_hours), now=NOW)
+
+def form_window(hours_from_now=1, length=2):
+    start = datetime.now().replace(microsecond=0) + timedelta(hours=hours_from_now)
+    return {'start': start.isoformat(), 'end': (start + timedelta(hours=length)).isoformat()}
+
+def test_schedule_form_on_an_unknown_lot(user_client):
+    response = user_client.post('/user/schedule', data={'lot_id': '999', **form_window()}, follow_redirects=True)
+    assert b'Parking lot not found!' in response.data
+
+def test_schedule_form_reserves_and_lists_the_hold(user_client):
+    lot_id = create_lot(spots=1, name='Central')
+    response = user_client.post('/user/schedule', data={'lot_id': str(lot_id), **form_window()}, follow_redirects=True)
+    assert b'Check in when you arrive' in response.data
+
+    response = user_client.post('/user/schedule', data={'lot_id': str(lot_id), **form_window()}, follow_redirects=True)
+    assert b'No spots are free in this lot for that time!' in response.data
+
+def test_full_lots_are_still_offered_for_later(user_client):
+    lot_id = create_lot(spots=1, name='Tiny Lot')
+    other, = create_users(1)
+    ParkingSpot.book_spot(lot_id, other)
+
+    page = user_client.get('/user/book_parking').get_data(as_text=True)
+
+    assert 'Tiny Lot (full now)' in page
+
+def test_schedule_endpoint(client):
+    lot_id = create_lot(spots=3)
+    window = form_window()
+    response = client.get(f'/api/v1/lots/{lot_id}/schedule', query_string=window)
+    assert response.get_json()['free_spots'] == 3
+    assert client.get('/api/v1/lots/999/schedule', query_string=window).status_code == 404
+    assert client.get(f'/api/v1/lots/{lot_id}/schedule?start=soon').status_code == 400
+
+def test_unknown_lots_leave_nothing_behind(app, db):
+    locks = list(schedule_index._locks)
+    for lot_id in range(1000, 1100):
+        assert schedule_index.free_spots(db, lot_id, *window(1, 2), now=NOW) is None
+        assert schedule_index.walk_in_capacity(db, lot_id, now=NOW) == 0
+
+    assert schedule_index._locks == locks
+    assert not set(range(1000, 1100)) & set(schedule_index._lots)
@@ -0,0 +1,55 @@
+import pytest
+
+from conftest import create_lot, create_users
+from models import search
+from models.database import ParkingLot, ParkingSpot
+
+@pytest.fixture
+def lots(app):
+    return {
+        'central': create_lot(spots=2, name='Central Plaza', price=30.0, address='1 MG Road', pin_code='560001'),
+        'cafe': create_lot(spots=1, name='Café Corner', price=10.0, address='9 Brigade Road', pin_code='560025'),
+        'airport': create_lot(spots=5, name='Airport Long Stay', price=20.0, address='Terminal 2', pin_code='562300'),
+    }
+
+def names(results):
+    return [lot.prime_location_name for lot in results]
+
+def test_fts_query_quotes_words_and_prefixes_the_last():
+    assert search.fts_query('mg roa') == '"mg" "roa"*'
+    assert search.fts_query('a OR b NEAR(c') == '"a" "OR" "b" "NEAR" "c"*'
+    assert search.fts_query('  "*- ') == ''
+
+def test_text_search_matches_name_and_address_words(lots):
+    assert names(ParkingLot.search_lots(text='road')) == ['Café Corner', 'Central Plaza']
+    assert names(ParkingLot.search_lots(text='airp')) == ['Airport Long Stay']
+    # Accents are folded, and operators in the input are just words.
+    assert names(ParkingLot.search_lots(text='cafe')) == ['Café Corner']
+    assert names(ParkingLot.search_lots(text='plaza OR "stay')) == []
+
+def test_pin_prefix_and_price_filters(lots):
+    assert names(ParkingLot.search_lots(pin_prefix='5600')) == ['Café Corner', 'Central Plaza']
+    assert names(ParkingLot.search_lots(min_price=15, max_price=30)) == ['Airport Long Stay', 'Central Plaza']
+
+def test_orderings(lots):
+    assert names(ParkingLot.search_lots(order='price_desc')) == ['Central Plaza', 'Airport Long Stay', 'Café Corner']
+    assert names(ParkingLot.search_lots(order='available')) == ['Airport Long Stay', 'Central Plaza', 'Café Corner']
+
+def test_full_lots_only_show_when_asked_for(lots):
+    user_id, = create_users(1)
+    ParkingSpot.book_spot(lots['cafe'], user_id)
+
+    assert 'Café Corner' not in names(ParkingLot.search_lots())
+    assert 'Café Corner' in names(ParkingLot.search_lots(only_available=False))
+
+def test_renamed_lots_are_found_by_their_new_name(lots):
+    ParkingLot.update_lot(lots['central'], 'Metro Square', 30.0, '1 MG Road', '560001', 2)
+    assert names(ParkingLot.search_lots(text='metro')) == ['Metro Square']
+    assert names(ParkingLot.search_lots(text='plaza')) == []
+
+def test_search_endpoint(client, lots):
+    response = client.get('/api/v1/lots/search?q=road&order=price_desc&limit=1')
+    assert [lot['name'] for lot in response.get_json()['lots']] == ['Central Plaza']
+
+    response = client.get('/api/v1/lots/search?pin=562&order=bogus')
+    assert [lot['id'] for lot in response.get_json()['lots']] == [lots['airport']]
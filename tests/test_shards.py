@@ -0,0 +1,84 @@
+import pytest
+
+from conftest import create_lot, create_users, lot_counters
+from models import shards
+from models.database import ParkingLot, ParkingSpot, Reservation
+from models.shards import shard_map
+
+@pytest.fixture
+def app_config():
+    return {'DATABASE_SHARDS': 3}
+
+def test_shard_paths_and_id_ranges(app, tmp_path):
+    assert shard_map.paths == [str(tmp_path / name) for name in
+                               ('parking_app.db', 'parking_app-1.db', 'parking_app-2.db')]
+    assert shard_map.shard_of(shards.id_base(2) + 7) == 2
+    # Ids from a shard that is not configured read from the main database.
+    assert shard_map.shard_of(shards.id_base(5)) == 0
+    assert shard_map.shard_of(None) == 0
+
+def test_lots_go_to_the_emptiest_shard(app):
+    first = create_lot(spots=10)
+    second = create_lot(spots=3)
+    third = create_lot(spots=5)
+    fourth = create_lot(spots=1)
+
+    assert [shard_map.shard_of(lot_id) for lot_id in (first, second, third, fourth)] == [0, 1, 2, 1]
+    for lot_id in (first, second, third, fourth):
+        shard = shard_map.shard_of(lot_id)
+        assert shards.id_base(shard) < lot_id < shards.id_base(shard + 1)
+        spots = ParkingSpot.get_spots_by_lot(lot_id)
+        assert all(shard_map.shard_of(spot.id) == shard for spot in spots)
+
+def test_reads_are_merged_across_shards_in_id_order(app):
+    lot_ids = [create_lot(spots=spots, name=f'Lot {spots}') for spots in (4, 3, 2, 1)]
+
+    assert [lot.id for lot in ParkingLot.get_all_lots()] == sorted(lot_ids)
+    page = ParkingLot.get_all_lots(after_id=sorted(lot_ids)[0], limit=2)
+    assert [lot.id for lot in page] == sorted(lot_ids)[1:3]
+    assert [lot.prime_location_name for lot in ParkingLot.search_lots(order='available')] == [
+        'Lot 4', 'Lot 3', 'Lot 2', 'Lot 1']
+
+def test_bookings_on_every_shard_reach_the_user(app):
+    user_id, = create_users(1)
+    lot_ids = [create_lot(spots=2) for _ in range(3)]
+    bookings = [ParkingSpot.book_spot(lot_id, user_id) for lot_id in lot_ids]
+
+    for lot_id, (spot_id, reservation_id) in zip(lot_ids, bookings):
+        assert shard_map.shard_of(spot_id) == shard_map.shard_of(reservation_id) == shard_map.shard_of(lot_id)
+        assert lot_counters(shard_map.connection_for(lot_id), lot_id) == (2, 1, 1)
+    active = Reservation.get_active_reservations(user_id)
+    assert sorted(reservation.id for reservation in active) == sorted(booking[1] for booking in bookings)
+
+    for _, reservation_id in bookings:
+        assert Reservation.release_reservation(reservation_id, user_id) is not None
+    assert Reservation.get_active_reservations(user_id) == []
+    history = Reservation.get_user_history(user_id, archive_path=app.config['ARCHIVE_DATABASE'])
+    assert len(history) == 3
+
+def test_other_shards_see_users_through_the_accounts_view(app):
+    user_id, = create_users(1, prefix='remote')
+    create_lot(spots=1)
+    lot_id = create_lot(spots=1)
+    assert shard_map.shard_of(lot_id) == 1
+
+    conn = shard_map.connection(1)
+    assert conn.execute('SELECT username FROM users WHERE id = ?', (user_id,)).fetchone()[0] == 'remote0'
+    conn.close()
+    ParkingSpot.book_spot(lot_id, user_id, 'remote0')
+    assert [spot.username for spot in ParkingSpot.get_spots_by_lot(lot_id)] == ['remote0']
+
+def test_totals_sum_every_shard(app):
+    user_ids = create_users(2)
+    lot_ids = [create_lot(spots=spots) for spots in (3, 2, 1)]
+    ParkingSpot.book_spot(lot_ids[1], user_ids[0])
+    ParkingSpot.book_spot(lot_ids[2], user_ids[1])
+
+    assert ParkingLot.get_totals() == (3, 6, 2, 2)
+
+def test_admin_dashboard_lists_every_shard(admin_client):
+    lot_ids = [create_lot(spots=1, name=f'Lot {n}') for n in range(3)]
+
+    page = admin_client.get('/admin/dashboard').get_data(as_text=True)
+    assert all(f'Lot {n}' in page for n in range(3))
+    assert {shard_map.shard_of(lot_id) for lot_id in lot_ids} == {0, 1, 2}
@@ -0,0 +1,113 @@
+import json
+
+import pytest
+
+from conftest import create_lot, create_users
+from models.database import ParkingSpot
+from services.events import spot_events
+
+def parse_event(chunk):
+    fields = dict(line.split(': ', 1) for line in chunk.decode().strip().splitlines())
+    return fields.get('event'), fields['id'], json.loads(fields['data'])
+
+def open_stream(client, url, **kwargs):
+    response = client.get(url, **kwargs)
+    chunks = response.iter_encoded()
+    assert next(chunks).startswith(b'retry:')
+    return response, chunks
+
+def test_snapshot_sends_the_visible_page_and_the_lot_counters(admin_client, db):
+    lot_id = create_lot(spots=6)
+    user_id, = create_users(1)
+    booked_spot, _ = ParkingSpot.book_spot(lot_id, user_id)
+    spot_ids = [row[0] for row in db.execute('SELECT id FROM parking_spots WHERE lot_id = ? ORDER BY id', (lot_id,))]
+
+    response, chunks = open_stream(admin_client, f'/admin/view_spots/{lot_id}/stream?after={spot_ids[0]}&limit=2')
+    try:
+        kind, _, snapshot = parse_event(next(chunks))
+    finally:
+        response.close()
+
+    assert response.mimetype == 'text/event-stream'
+    assert kind == 'snapshot'
+    assert [spot['spot_id'] for spot in snapshot['spots']] == spot_ids[1:3]
+    assert (snapshot['available_spots'], snapshot['occupied_spots']) == (5, 1)
+    assert booked_spot == spot_ids[0]
+
+def test_snapshot_is_followed_by_spot_changes(admin_client):
+    lot_id = create_lot(spots=2)
+    user_id, = create_users(1)
+
+    response, chunks = open_stream(admin_client, f'/admin/view_spots/{lot_id}/stream')
+    try:
+        next(chunks)
+        spot_id, _ = ParkingSpot.book_spot(lot_id, user_id, 'user0')
+        kind, _, data = parse_event(next(chunks))
+    finally:
+        response.close()
+
+    assert kind == 'spot'
+    assert (data['spot_id'], data['status'], data['username']) == (spot_id, 'O', 'user0')
+
+def test_reconnect_replays_missed_events_instead_of_a_snapshot(admin_client):
+    lot_id = create_lot(spots=2)
+    user_id, = create_users(1)
+    last_seen = spot_events.event_id(spot_events.current_seq())
+    spot_id, _ = ParkingSpot.book_spot(lot_id, user_id)
+
+    response, chunks = open_stream(admin_client, f'/admin/view_spots/{lot_id}/stream',
+                                   headers={'Last-Event-ID': last_seen})
+    try:
+        kind, _, data = parse_event(next(chunks))
+    finally:
+        response.close()
+
+    assert kind == 'spot'
+    assert data['spot_id'] == spot_id
+
+def test_stream_is_for_admins_only(user_client):
+    lot_id = create_lot(spots=1)
+    assert user_client.get(f'/admin/view_spots/{lot_id}/stream').status_code == 302
+
+def test_unknown_lots_get_a_404(admin_client):
+    assert admin_client.get('/admin/view_spots/999/stream').status_code == 404
+
+@pytest.mark.parametrize('app_config', [{'STREAM_POLL_SECONDS': 0.05}])
+def test_changes_from_other_processes_resend_the_snapshot(admin_client, db):
+    lot_id = create_lot(spots=2)
+    user_id, = create_users(1)
+    spot_id = db.execute('SELECT MIN(id) FROM parking_spots WHERE lot_id = ?', (lot_id,)).fetchone()[0]
+
+    response, chunks = open_stream(admin_client, f'/admin/view_spots/{lot_id}/stream')
+    try:
+        next(chunks)
+        assert next(chunks) == b': keepalive\n\n'
+        # A booking in another worker reaches the database but not this
+        # process's event bus.
+        db.execute('INSERT INTO reservations (spot_id, user_id) VALUES (?, ?)', (spot_id, user_id))
+        db.commit()
+        kind, _, snapshot = parse_event(next(chunks))
+        # A booking published here keeps the counters in step, so no resend.
+        ParkingSpot.book_spot(lot_id, user_id)
+        assert parse_event(next(chunks))[0] == 'spot'
+        assert next(chunks) == b': keepalive\n\n'
+    finally:
+        response.close()
+
+    assert kind == 'snapshot'
+    assert (snapshot['available_spots'], snapshot['occupied_spots']) == (1, 1)
+    assert [spot['status'] for spot in snapshot['spots']] == ['O', 'A']
+
+@pytest.mark.parametrize('app_config', [{'STREAM_POLL_SECONDS': 0.05}])
+def test_stream_ends_when_the_lot_is_deleted(admin_client, db):
+    lot_id = create_lot(spots=1)
+
+    response, chunks = open_stream(admin_client, f'/admin/view_spots/{lot_id}/stream')
+    try:
+        next(chunks)
+        db.execute('DELETE FROM parking_lots WHERE id = ?', (lot_id,))
+        db.commit()
+        # The stream runs out instead of waiting forever.
+        assert all(chunk == b': keepalive\n\n' for chunk in chunks)
+    finally:
+        response.close()